@@ -0,0 +1,141 @@
+"""partition_account_roles_log
+
+Turns AccountRolesLog into a table that is range-partitioned by month on
+created_at.  Requires PostgreSQL 11 or later.
+
+The existing table is attached, as is, as partition "AccountRolesLog_legacy"
+for everything up to the end of the current month, so no rows are copied.
+Partitions for later months are created by the function
+"AccountRolesLog_create_partition"(date), which is called by the
+authz_admin_log_partitions maintenance command.
+
+Partitioned tables can't be the target of a foreign key whose columns don't
+include the partition key, so the foreign key from AccountRoles.log_id is
+dropped.
+
+Revision ID: 3a1f0c6e9b27
+Revises: 5ed33a096533
+Create Date: 2026-10-18 14:30:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3a1f0c6e9b27'
+down_revision = '5ed33a096533'
+branch_labels = None
+depends_on = None
+
+
+_INDEXED_COLUMNS = ('created_at', 'created_by', 'account_id', 'action')
+
+
+def upgrade():
+    op.execute('ALTER TABLE "AccountRoles" DROP CONSTRAINT "AccountRoles_log_id_fkey"')
+    op.execute('DROP TRIGGER "AccountRolesLog_notify" ON "AccountRolesLog"')
+
+    # Move the existing table and its indexes out of the way:
+    op.execute('ALTER TABLE "AccountRolesLog" RENAME TO "AccountRolesLog_legacy"')
+    op.execute('ALTER TABLE "AccountRolesLog_legacy" RENAME CONSTRAINT "AccountRolesLog_pkey" TO "AccountRolesLog_legacy_pkey"')
+    # Redundant with the primary key:
+    op.execute('DROP INDEX "ix_AccountRolesLog_id"')
+    for column in _INDEXED_COLUMNS:
+        op.execute('ALTER INDEX "ix_AccountRolesLog_%s" RENAME TO "ix_AccountRolesLog_legacy_%s"' % (column, column))
+    op.execute('ALTER INDEX "idx_arl_role_ids" RENAME TO "idx_arl_legacy_role_ids"')
+
+    op.execute('''
+        CREATE TABLE "AccountRolesLog" (
+            id integer NOT NULL DEFAULT nextval('"AccountRolesLog_id_seq"'),
+            created_at timestamp without time zone NOT NULL DEFAULT now(),
+            created_by varchar NOT NULL,
+            request_info text,
+            account_id varchar NOT NULL,
+            action varchar(1) NOT NULL,
+            role_ids varchar(32)[] NOT NULL,
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+    ''')
+    op.execute('ALTER SEQUENCE "AccountRolesLog_id_seq" OWNED BY "AccountRolesLog".id')
+    for column in _INDEXED_COLUMNS:
+        op.execute('CREATE INDEX "ix_AccountRolesLog_%s" ON "AccountRolesLog" (%s)' % (column, column))
+    op.execute('CREATE INDEX "idx_arl_role_ids" ON "AccountRolesLog" USING gin (role_ids)')
+
+    # Existing indexes of the legacy table are attached to the indexes of the
+    # partitioned table; only the new primary key index is built.
+    op.execute('''
+        DO $$
+        BEGIN
+            EXECUTE format(
+                'ALTER TABLE "AccountRolesLog" ATTACH PARTITION "AccountRolesLog_legacy" '
+                'FOR VALUES FROM (MINVALUE) TO (%L)',
+                (date_trunc('month', now()) + interval '1 month')::date
+            );
+        END;
+        $$
+    ''')
+    # Catches rows if the maintenance command hasn't created a partition in
+    # time, so that writes never fail:
+    op.execute('CREATE TABLE "AccountRolesLog_default" PARTITION OF "AccountRolesLog" DEFAULT')
+
+    op.execute('''
+        CREATE FUNCTION "AccountRolesLog_create_partition"(month date) RETURNS text AS $$
+        DECLARE
+            lower_bound date := date_trunc('month', month)::date;
+            partition_name text := 'AccountRolesLog_' || to_char(month, 'YYYYMM');
+        BEGIN
+            IF to_regclass(quote_ident(partition_name)) IS NULL THEN
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF "AccountRolesLog" FOR VALUES FROM (%L) TO (%L)',
+                    partition_name, lower_bound, (lower_bound + interval '1 month')::date
+                );
+            END IF;
+            RETURN partition_name;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        SELECT "AccountRolesLog_create_partition"((date_trunc('month', now()) + n * interval '1 month')::date)
+          FROM generate_series(1, 3) AS n
+    ''')
+
+    op.execute('''
+        CREATE TRIGGER "AccountRolesLog_notify"
+        AFTER INSERT ON "AccountRolesLog"
+        FOR EACH ROW EXECUTE PROCEDURE notify_account_roles()
+    ''')
+
+
+def downgrade():
+    # Rows in partitions that were archived and dropped are not restored.
+    op.execute('DROP TRIGGER "AccountRolesLog_notify" ON "AccountRolesLog"')
+    op.execute('DROP FUNCTION "AccountRolesLog_create_partition"(date)')
+    op.execute('''
+        CREATE TABLE "AccountRolesLog_unpartitioned" (
+            id integer NOT NULL DEFAULT nextval('"AccountRolesLog_id_seq"'),
+            created_at timestamp without time zone NOT NULL DEFAULT now(),
+            created_by varchar NOT NULL,
+            request_info text,
+            account_id varchar NOT NULL,
+            action varchar(1) NOT NULL,
+            role_ids varchar(32)[] NOT NULL
+        )
+    ''')
+    op.execute('INSERT INTO "AccountRolesLog_unpartitioned" SELECT * FROM "AccountRolesLog"')
+    op.execute('ALTER SEQUENCE "AccountRolesLog_id_seq" OWNED BY NONE')
+    op.execute('DROP TABLE "AccountRolesLog"')
+    op.execute('ALTER TABLE "AccountRolesLog_unpartitioned" RENAME TO "AccountRolesLog"')
+    op.execute('ALTER SEQUENCE "AccountRolesLog_id_seq" OWNED BY "AccountRolesLog".id')
+    op.execute('ALTER TABLE "AccountRolesLog" ADD CONSTRAINT "AccountRolesLog_pkey" PRIMARY KEY (id)')
+    op.execute('CREATE INDEX "ix_AccountRolesLog_id" ON "AccountRolesLog" (id)')
+    for column in _INDEXED_COLUMNS:
+        op.execute('CREATE INDEX "ix_AccountRolesLog_%s" ON "AccountRolesLog" (%s)' % (column, column))
+    op.execute('CREATE INDEX "idx_arl_role_ids" ON "AccountRolesLog" USING gin (role_ids)')
+    op.execute('''
+        CREATE TRIGGER "AccountRolesLog_notify"
+        AFTER INSERT ON "AccountRolesLog"
+        FOR EACH ROW EXECUTE PROCEDURE notify_account_roles()
+    ''')
+    op.execute('''
+        ALTER TABLE "AccountRoles" ADD CONSTRAINT "AccountRoles_log_id_fkey"
+        FOREIGN KEY (log_id) REFERENCES "AccountRolesLog" (id)
+    ''')
@@ -0,0 +1,30 @@
+"""account_roles_log_account_id_id_index
+
+Replaces the index on AccountRolesLog (account_id) by one on (account_id, id
+DESC), for point-in-time snapshots of accounts: with this index, the latest
+log entry of each account up to a given moment (SELECT DISTINCT ON
+(account_id) ... ORDER BY account_id, id DESC) is found without sorting.  It
+also serves every query that the old index served.
+
+Revision ID: 4b8f2a6d3c19
+Revises: 9c4e2d7f1a85
+Create Date: 2026-10-18 19:40:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '4b8f2a6d3c19'
+down_revision = '9c4e2d7f1a85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE INDEX "ix_AccountRolesLog_account_id_id" ON "AccountRolesLog" (account_id, id DESC)')
+    op.execute('DROP INDEX "ix_AccountRolesLog_account_id"')
+
+
+def downgrade():
+    op.execute('CREATE INDEX "ix_AccountRolesLog_account_id" ON "AccountRolesLog" (account_id)')
+    op.execute('DROP INDEX "ix_AccountRolesLog_account_id_id"')
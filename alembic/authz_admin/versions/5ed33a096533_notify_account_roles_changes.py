@@ -0,0 +1,38 @@
+"""notify_account_roles_changes
+
+Revision ID: 5ed33a096533
+Revises: 7c7de80eb29b
+Create Date: 2026-10-18 10:12:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '5ed33a096533'
+down_revision = '7c7de80eb29b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Every change to an account is logged in AccountRolesLog, in the same
+    # transaction as the change itself.  Notifications are delivered on
+    # commit, so listeners never see uncommitted changes.
+    op.execute('''
+        CREATE FUNCTION notify_account_roles() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('account_roles', NEW.account_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+    op.execute('''
+        CREATE TRIGGER "AccountRolesLog_notify"
+        AFTER INSERT ON "AccountRolesLog"
+        FOR EACH ROW EXECUTE PROCEDURE notify_account_roles()
+    ''')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER "AccountRolesLog_notify" ON "AccountRolesLog"')
+    op.execute('DROP FUNCTION notify_account_roles()')
@@ -0,0 +1,37 @@
+"""account_roles_checkpoint
+
+Adds table AccountRolesCheckpoint, with the latest archived log entry of each
+account.  :func:`authz_admin.log_partitions.archive_partition` updates it
+before it drops a partition of AccountRolesLog, so that point-in-time
+snapshots of accounts (see :func:`authz_admin.database.accounts`) remain
+complete for every moment after the archived entries.
+
+Revision ID: 6e1d9b3a7f52
+Revises: 4b8f2a6d3c19
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '6e1d9b3a7f52'
+down_revision = '4b8f2a6d3c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'AccountRolesCheckpoint',
+        sa.Column('account_id', sa.String, nullable=False, primary_key=True),
+        sa.Column('role_ids', postgresql.ARRAY(sa.String(32)), nullable=False),
+        sa.Column('log_id', sa.Integer, index=True, nullable=False),
+        sa.Column('action', sa.String(1), nullable=False),
+        sa.Column('created_at', sa.DateTime, index=True, nullable=False)
+    )
+
+
+def downgrade():
+    op.drop_table('AccountRolesCheckpoint')
@@ -0,0 +1,70 @@
+"""structured_request_info
+
+Replaces the free-text AccountRolesLog.request_info, which held the complete
+request headers (including bearer tokens), by a compact JSONB record.  See
+authz_admin.audit.request_info().
+
+Existing rows are converted in batches of _BATCH_SIZE ids.  Each batch is
+committed on its own, outside the migration transaction, so that no
+transaction rewrites the whole table or holds its row locks for long.  If the
+migration is interrupted, running it again skips the rows that were already
+converted.  Only the rows added meanwhile are converted in the final
+transaction, which also replaces the column.  From the legacy headers, only
+the user agent, the request id and a digest of the bearer token are kept.
+
+Revision ID: 9c4e2d7f1a85
+Revises: 3a1f0c6e9b27
+Create Date: 2026-10-18 16:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '9c4e2d7f1a85'
+down_revision = '3a1f0c6e9b27'
+branch_labels = None
+depends_on = None
+
+
+_BATCH_SIZE = 10000
+
+_CONVERT = '''
+    UPDATE "AccountRolesLog"
+       SET request_data = CASE
+           WHEN request_info LIKE '<CIMultiDictProxy(%' THEN jsonb_strip_nulls(jsonb_build_object(
+               'user_agent', left(substring(request_info from $r$(?i)'User-Agent': '([^']*)'$r$), 255),
+               'request_id', left(substring(request_info from $r$(?i)'X-Request-Id': '([^']*)'$r$), 255),
+               'token', encode(sha256(convert_to(
+                   substring(request_info from $r$(?i)'Authorization': 'Bearer ([^']*)'$r$), 'UTF8'
+               )), 'hex')
+           ))
+           ELSE jsonb_build_object('source', left(request_info, 255))
+       END
+     WHERE request_info IS NOT NULL AND request_data IS NULL
+'''
+_CONVERT_BATCH = sa.text(_CONVERT + ' AND id >= :lower AND id < :upper')
+_CONVERT_REST = sa.text(_CONVERT)
+
+
+def upgrade():
+    op.execute('ALTER TABLE "AccountRolesLog" ADD COLUMN IF NOT EXISTS request_data jsonb')
+    conn = op.get_bind()
+    lower, upper = conn.execute('SELECT min(id), max(id) + 1 FROM "AccountRolesLog"').fetchone()
+    # Ends the migration transaction so far.  The driver implicitly begins a
+    # new transaction with the next statement, which Alembic commits at the
+    # end of the migration.
+    op.execute('COMMIT')
+    if lower is not None:
+        for batch_lower in range(lower, upper, _BATCH_SIZE):
+            conn.execute(_CONVERT_BATCH, lower=batch_lower, upper=batch_lower + _BATCH_SIZE)
+            op.execute('COMMIT')
+    # Blocks writes, but not reads, until the column has been replaced:
+    op.execute('LOCK TABLE "AccountRolesLog" IN EXCLUSIVE MODE')
+    conn.execute(_CONVERT_REST)
+    op.execute('ALTER TABLE "AccountRolesLog" DROP COLUMN request_info')
+    op.execute('ALTER TABLE "AccountRolesLog" RENAME COLUMN request_data TO request_info')
+
+
+def downgrade():
+    op.execute('ALTER TABLE "AccountRolesLog" ALTER COLUMN request_info TYPE text USING request_info::text')
@@ -0,0 +1,27 @@
+"""account_roles_account_id_collation
+
+Gives AccountRoles.account_id the "C" collation, so that accounts are sorted,
+and paginated, by the code points of their ids: the same order in which the
+in-memory mirror (:mod:`authz_admin.mirror`) sorts them, regardless of the
+default collation of the database.  Rebuilds the indexes on the column.
+
+Revision ID: a2c5e8f1b4d7
+Revises: 6e1d9b3a7f52
+Create Date: 2026-10-18 22:30:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'a2c5e8f1b4d7'
+down_revision = '6e1d9b3a7f52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('ALTER TABLE "AccountRoles" ALTER COLUMN account_id TYPE varchar COLLATE "C"')
+
+
+def downgrade():
+    op.execute('ALTER TABLE "AccountRoles" ALTER COLUMN account_id TYPE varchar COLLATE "default"')
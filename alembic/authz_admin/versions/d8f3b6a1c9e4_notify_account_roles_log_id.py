@@ -0,0 +1,41 @@
+"""notify_account_roles_log_id
+
+Adds the id of the log entry to the payload of the notifications on channel
+account_roles: "<log id> <account id>".  With it, the account mirror knows
+which version of the accounts it has applied; see
+authz_admin.mirror.AccountRolesMirror.version.
+
+Revision ID: d8f3b6a1c9e4
+Revises: a2c5e8f1b4d7
+Create Date: 2026-10-19 10:20:00.000000
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'd8f3b6a1c9e4'
+down_revision = 'a2c5e8f1b4d7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('''
+        CREATE OR REPLACE FUNCTION notify_account_roles() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('account_roles', NEW.id || ' ' || NEW.account_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
+
+
+def downgrade():
+    op.execute('''
+        CREATE OR REPLACE FUNCTION notify_account_roles() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify('account_roles', NEW.account_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    ''')
@@ -24,7 +24,9 @@ setup(
     # Entry points:
     entry_points={
         'console_scripts': [
-            'authz_admin = authz_admin.main:main'
+            'authz_admin = authz_admin.main:main',
+            'authz_admin_import = authz_admin.account_import:main',
+            'authz_admin_log_partitions = authz_admin.log_partitions:main'
         ],
     },
 
@@ -140,6 +142,9 @@ setup(
         'yarl==0.12.0'
     ],
     extras_require={
+        'asyncpg': [
+            'asyncpg'
+        ],
         'docs': [
             'MacFSEvents==0.7',
             'Sphinx==1.6.4',
@@ -0,0 +1,189 @@
+# language=rst
+"""
+Bulk import of accounts.
+
+Accounts can be imported in bulk, either with ``POST /account_imports`` (see
+:class:`authz_admin.handlers.AccountImports`) or with the
+``authz_admin_import`` console script::
+
+    authz_admin_import accounts.ndjson
+    authz_admin_import --format csv - < accounts.csv
+
+Two input formats are supported:
+
+NDJSON (``application/x-ndjson``)
+    One JSON object per line, for example::
+
+        {"account": "j.doe@amsterdam.nl", "roles": ["CDE", "DPB"]}
+
+CSV (``text/csv``)
+    One account per line.  The first column holds the account id, all other
+    non-empty columns hold role ids.  An optional header line, with
+    ``account`` in the first column, is skipped.
+
+The whole input is validated against the configuration before anything is
+written.  See :func:`authz_admin.database.import_accounts` for what happens
+next.
+
+"""
+
+import argparse
+import asyncio
+import csv
+import getpass
+from json import loads as json_loads, dumps as json_dumps
+import logging
+import re
+import sys
+import types
+import typing as T
+
+from . import audit, backends, config, database
+from .database import ImportRow
+
+_logger = logging.getLogger(__name__)
+
+
+MAX_IMPORT_ROWS = 100000
+_ACCOUNT_ID = re.compile(r'[^\s]{1,255}')
+_MAX_REPORTED_ERRORS = 100
+
+
+class InvalidImport(ValueError):
+    # language=rst
+    """Raised when an import can't be processed.
+
+    :ivar errors: a list of ``(line, message)`` tuples.
+
+    """
+
+    def __init__(self, errors: T.List[T.Tuple[int, str]]):
+        super().__init__(errors)
+        self.errors = errors
+
+    def __str__(self):
+        lines = ["Line %d: %s" % error for error in self.errors[:_MAX_REPORTED_ERRORS]]
+        if len(self.errors) > _MAX_REPORTED_ERRORS:
+            lines.append("... and %d more errors." % (len(self.errors) - _MAX_REPORTED_ERRORS))
+        return '\n'.join(lines)
+
+
+def parse_ndjson(lines: T.Iterable[str]) -> T.List[ImportRow]:
+    rows = []
+    errors = []
+    for line_number, line in enumerate(lines, start=1):
+        if line.strip() == '':
+            continue
+        try:
+            obj = json_loads(line)
+            assert isinstance(obj, dict)
+            assert isinstance(obj['account'], str)
+            assert isinstance(obj['roles'], list)
+            assert all(isinstance(role_id, str) for role_id in obj['roles'])
+        except Exception:
+            errors.append((line_number, 'expected an object like {"account": "...", "roles": [...]}'))
+            continue
+        rows.append(ImportRow(line_number, obj['account'], tuple(obj['roles'])))
+    if len(errors) > 0:
+        raise InvalidImport(errors)
+    return rows
+
+
+def parse_csv(lines: T.Iterable[str]) -> T.List[ImportRow]:
+    rows = []
+    for line_number, record in enumerate(csv.reader(lines), start=1):
+        record = [field.strip() for field in record]
+        if len(record) == 0 or record[0] == '':
+            continue
+        if line_number == 1 and record[0].lower() == 'account':
+            continue
+        rows.append(ImportRow(
+            line_number, record[0], tuple(field for field in record[1:] if field != '')
+        ))
+    return rows
+
+
+PARSERS = types.MappingProxyType({
+    'application/x-ndjson': parse_ndjson,
+    'text/csv': parse_csv
+})
+# language=rst
+"""Parsers by content type."""
+
+
+def validate(rows: T.List[ImportRow], existing_roles: T.Container[str]):
+    # language=rst
+    """Checks account ids and role ids of all ``rows``.
+
+    :raises InvalidImport: if any row is invalid, or if there are more than
+        :data:`MAX_IMPORT_ROWS` rows.
+
+    """
+    if len(rows) > MAX_IMPORT_ROWS:
+        raise InvalidImport([
+            (rows[MAX_IMPORT_ROWS].line, "more than %d accounts in one import" % MAX_IMPORT_ROWS)
+        ])
+    errors = []
+    for row in rows:
+        if not _ACCOUNT_ID.fullmatch(row.account_id):
+            errors.append((row.line, "invalid account id %r" % row.account_id))
+        for role_id in row.role_ids:
+            if role_id not in existing_roles:
+                errors.append((row.line, "unknown role %r" % role_id))
+    if len(errors) > 0:
+        raise InvalidImport(errors)
+
+
+async def _import(dbconf, rows, created_by):
+    async with backends.create(dbconf, minsize=1, maxsize=1) as backend:
+        return await database.import_accounts(
+            database.Pool(backend), rows,
+            created_by=created_by,
+            request_info=audit.source_info('authz_admin_import')
+        )
+
+
+def main():
+    # language=rst
+    """The entry point of the ``authz_admin_import`` console script.
+
+    Prints a JSON report with the number of created accounts and a list of
+    conflicts.
+
+    :returns int: the exit status of the process: 0 if all accounts were
+        created, 1 if there were conflicts, and 2 if the input was invalid.
+
+    """
+    parser = argparse.ArgumentParser(description="Bulk import of ADW accounts.")
+    parser.add_argument(
+        'file', type=argparse.FileType('r', encoding='utf-8'),
+        help="NDJSON or CSV file to import, or - for standard input."
+    )
+    parser.add_argument(
+        '--format', choices=('ndjson', 'csv'),
+        help="Input format.  Defaults to csv for *.csv files, ndjson otherwise."
+    )
+    parser.add_argument(
+        '--created-by', default=getpass.getuser(),
+        help="Author to record in the audit log.  Defaults to the current user."
+    )
+    args = parser.parse_args()
+    input_format = args.format or ('csv' if args.file.name.endswith('.csv') else 'ndjson')
+    parse = parse_csv if input_format == 'csv' else parse_ndjson
+    conf = config.load()
+    try:
+        with args.file:
+            rows = parse(args.file)
+        validate(rows, conf['authz_admin']['roles'])
+    except InvalidImport as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    created, conflicts = asyncio.get_event_loop().run_until_complete(
+        _import(conf['postgres'], rows, args.created_by)
+    )
+    print(json_dumps({'created': len(created), 'conflicts': conflicts}, indent=2))
+    return 1 if len(conflicts) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# language=rst
+"""
+Request information for the audit log.
+
+Every entry in ``AccountRolesLog`` has a ``request_info`` JSONB column, which
+describes the request that caused the change.  :func:`request_info` builds
+this record from an HTTP request; changes that don't originate from an HTTP
+request are described by :func:`source_info`.
+
+Example record::
+
+    {
+        "method": "PUT",
+        "path": "/authz_admin/accounts/j.doe@amsterdam.nl",
+        "remote": "10.0.0.1",
+        "user_agent": "Mozilla/5.0 ...",
+        "request_id": "4e1c...",
+        "subject": "p.van.beek@amsterdam.nl",
+        "token": "9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+    }
+
+The bearer token itself is never stored, only its SHA-256 digest.  All
+values are truncated to :data:`MAX_VALUE_LENGTH` characters, and absent
+values are omitted.
+
+"""
+
+import logging
+import typing as T
+
+from aiohttp import web
+
+from . import authorization
+
+_logger = logging.getLogger(__name__)
+
+
+MAX_VALUE_LENGTH = 255
+
+_REQUEST_ID_HEADERS = ('X-Request-Id', 'X-Correlation-Id')
+
+
+def _remote(request: web.Request) -> T.Optional[str]:
+    forwarded_for = request.headers.get('X-Forwarded-For')
+    if forwarded_for is not None:
+        return forwarded_for.split(',')[0].strip()
+    peername = request.transport.get_extra_info('peername') \
+        if request.transport is not None else None
+    if isinstance(peername, (list, tuple)) and len(peername) > 0:
+        return str(peername[0])
+    return None
+
+
+def request_info(request: web.Request) -> T.Dict[str, str]:
+    # language=rst
+    """The audit record for ``request``."""
+    result = {
+        'method': request.method,
+        'path': request.rel_url.path,
+        'remote': _remote(request),
+        'user_agent': request.headers.get('User-Agent'),
+        'request_id': next((
+            request.headers[header] for header in _REQUEST_ID_HEADERS
+            if header in request.headers
+        ), None),
+        'subject': request.get(authorization.TOKEN_SUBJECT)
+    }
+    authorization_header = authorization.parse_authorization_header(request)
+    if authorization_header is not None and authorization_header[0].lower() == 'bearer':
+        result['token'] = authorization.token_digest(authorization_header[1]).hex()
+    return {
+        key: value[:MAX_VALUE_LENGTH]
+        for key, value in result.items()
+        if value is not None
+    }
+
+
+def source_info(source: str) -> T.Dict[str, str]:
+    # language=rst
+    """The audit record for changes made by ``source``, like a console script."""
+    return {'source': source[:MAX_VALUE_LENGTH]}
@@ -1,5 +1,9 @@
+import collections
+import collections.abc
+import hashlib
 import logging
 import re
+import time
 import typing as T
 import functools
 
@@ -7,21 +11,145 @@ from aiohttp import web
 import jwt
 
 from rest_utils._view import View
+from . import routes
 
 _logger = logging.getLogger(__name__)
 
 
-async def _extract_scopes(request: web.Request,
-                          _security_scheme: T.Dict) -> T.Set:
+def token_digest(token: str) -> bytes:
+    # language=rst
+    """SHA-256 digest of an access token.
 
+    Used wherever a token must be recognizable without being stored, like in
+    :class:`TokenCache` and in the audit log.
+
+    """
+    return hashlib.sha256(token.encode()).digest()
+
+
+TOKEN_CACHE_MAXSIZE = 4096
+# language=rst
+"""Default maximum number of verified access tokens kept in a :class:`TokenCache`."""
+
+
+class TokenCache:
+    # language=rst
+    """In-process LRU cache of verified access tokens.
+
+    Entries are keyed by a SHA-256 digest of the raw token, so the tokens
+    themselves are never kept in memory.  The cached values are the bitmask of
+    granted scopes, as computed by :meth:`authz_admin.config.ScopeIndex.mask`,
+    and the subject (``sub`` claim) of the token.  An entry expires at the
+    ``exp`` claim of its token.  All entries are dropped as soon as the cache is consulted
+    with a different JWKS than the one the entries were verified with.
+
+    Example usage::
+
+        app['token_cache'] = TokenCache()
+        ...
+        app['token_cache'].statistics()
+        >>> {'size': 12, 'hits': 8312, 'misses': 12}
+
+    """
+
+    def __init__(self, maxsize: int=TOKEN_CACHE_MAXSIZE):
+        self._maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._jwks = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return token_digest(token)
+
+    def _check_jwks(self, jwks):
+        if jwks is not self._jwks:
+            if len(self._entries) > 0:
+                _logger.info("JWKS changed; dropping %d cached access tokens.", len(self._entries))
+            self._entries.clear()
+            self._jwks = jwks
+
+    def get(self, token: str, jwks) -> T.Optional[T.Tuple[int, T.Optional[str]]]:
+        # language=rst
+        """The scope mask and subject of a previously verified ``token``, or ``None``."""
+        self._check_jwks(jwks)
+        key = self._key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, scopes, subject = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return scopes, subject
+
+    def put(self, token: str, jwks, expires_at: T.Union[int, float], scopes: int,
+            subject: T.Optional[str]=None):
+        self._check_jwks(jwks)
+        key = self._key(token)
+        self._entries[key] = (expires_at, scopes, subject)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def statistics(self) -> T.Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+TOKEN_SUBJECT = 'authz_admin.token_subject'
+# language=rst
+"""Request key of the subject of the verified bearer token, if any."""
+
+_AUTHORIZATION_HEADER = re.compile(r'(\w+) ([-\w.=]+)')
+_API_KEY = re.compile(r'[-\w]+=*')
+
+
+def parse_authorization_header(request: web.Request) -> T.Optional[T.Tuple[str, str]]:
+    # language=rst
+    """The authorization scheme and credentials in the ``Authorization`` header.
+
+    :returns: a tuple ``(scheme, credentials)``, or ``None`` if there's no
+        (syntactically valid) ``Authorization`` request header.
+
+    """
     authorization_header = request.headers.get('authorization')
     if authorization_header is None:
-        return set()
-    match = re.fullmatch(r'bearer ([-\w.=]+)', authorization_header, flags=re.IGNORECASE)
+        return None
+    match = _AUTHORIZATION_HEADER.fullmatch(authorization_header)
     if not match:
-        return set()
+        return None
+    return match[1], match[2]
+
+
+def _extract_scopes(request: web.Request,
+                    authorization: T.Optional[T.Tuple[str, str]],
+                    _security_scheme: T.Dict) -> int:
+    # language=rst
+    """The bitmask of scopes granted by the bearer token in the request.
+
+    See :class:`authz_admin.config.ScopeIndex`.
+
+    """
+    if authorization is None or authorization[0].lower() != 'bearer':
+        return 0
+
+    token = authorization[1]
+    jwks = request.app['jwks']
+    token_cache = request.app['token_cache']
+    cached = token_cache.get(token, jwks)
+    if cached is not None:
+        scopes, request[TOKEN_SUBJECT] = cached
+        return scopes
 
-    token = match[1]
     try:
         header = jwt.get_unverified_header(token)
     except (jwt.InvalidTokenError, jwt.DecodeError):
@@ -30,7 +158,7 @@ async def _extract_scopes(request: web.Request,
     if 'kid' not in header:
         raise web.HTTPBadRequest(text='API authz problem: Did not get a valid key identifier') from None
 
-    keys = request.app['jwks'].verifiers
+    keys = jwks.verifiers
 
     if header['kid'] not in keys:
         raise web.HTTPBadRequest(text="API authz problem: Unknown key identifier: {}".format(header['kid'])) from None
@@ -47,49 +175,95 @@ async def _extract_scopes(request: web.Request,
         raise web.HTTPBadRequest(
             text='No scopes in access token'
         )
-    return set(access_token['scopes'])
+    scopes = request.app['scope_index'].mask(access_token['scopes'])
+    subject = access_token.get('sub')
+    if not isinstance(subject, str):
+        subject = None
+    request[TOKEN_SUBJECT] = subject
+    # Tokens without an expiration time are never cached:
+    if isinstance(access_token.get('exp'), (int, float)):
+        token_cache.put(token, jwks, access_token['exp'], scopes, subject)
+    return scopes
 
 
-async def _extract_api_key_info(request: web.Request,
-                                security_scheme: T.Dict) -> T.Any:
+def _extract_api_key_info(request: web.Request,
+                          authorization: T.Optional[T.Tuple[str, str]],
+                          security_scheme: T.Dict) -> T.Any:
     assert security_scheme['in'] == 'header'
     assert security_scheme['name'] == 'Authorization'
-    authorization_header = request.headers.get('authorization')
-    if authorization_header is None:
+    if authorization is None or authorization[0] != 'apikey':
         return False
-    match = re.fullmatch(r'apikey ([-\w]+=*)', authorization_header)
-    if not match:
+    if not _API_KEY.fullmatch(authorization[1]):
         return False
-    return match[1] == request.app['config']['authz_admin']['api_key']
+    return authorization[1] == request.app['config']['authz_admin']['api_key']
 
 
-async def _extract_authz_info(request: web.Request,
-                              security_definitions: T.Dict[str, T.Dict[str, T.Any]]):
-    result = {}
-    for key, security_scheme in security_definitions.items():
-        security_type = security_scheme['type']
-        if security_type == 'oauth2':
-            result[key] = await _extract_scopes(request, security_scheme)
-        elif security_type == 'apiKey':
-            result[key] = await _extract_api_key_info(request, security_scheme)
-        else:
-            _logger.error('Unknown security type: %s' % security_type)
-            raise web.HTTPInternalServerError()
-    return result
+class _AuthzInfo(collections.abc.Mapping):
+    # language=rst
+    """Lazily extracted authorization info of a request.
+
+    Maps security scheme names from ``securityDefinitions`` to the authorization
+    info for that scheme.  Each scheme is only evaluated when it's first looked
+    up, and the ``Authorization`` request header is parsed at most once.
+
+    """
+
+    def __init__(self, request: web.Request,
+                 security_definitions: T.Mapping[str, T.Mapping[str, T.Any]]):
+        self._request = request
+        self._security_definitions = security_definitions
+        self._authorization = False
+        self._cache = {}
+
+    def _parsed_authorization_header(self):
+        if self._authorization is False:
+            self._authorization = parse_authorization_header(self._request)
+        return self._authorization
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            security_scheme = self._security_definitions[key]
+            security_type = security_scheme['type']
+            if security_type == 'oauth2':
+                extract = _extract_scopes
+            elif security_type == 'apiKey':
+                extract = _extract_api_key_info
+            else:
+                _logger.error('Unknown security type: %s' % security_type)
+                raise web.HTTPInternalServerError()
+            self._cache[key] = extract(
+                self._request, self._parsed_authorization_header(), security_scheme
+            )
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._security_definitions)
+
+    def __len__(self):
+        return len(self._security_definitions)
 
 
 async def middleware(app: web.Application, handler):
     async def middleware_handler(request: web.Request) -> web.Response:
-        swagger = app['swagger']
-        security_definitions = swagger.specification['securityDefinitions']
-        request['authz_info'] = await _extract_authz_info(request, security_definitions)
+        # Nothing is evaluated here; schemes are evaluated on demand by
+        # enforce_one_of(), so static and anonymous resources pay nothing.
+        security_definitions = app['swagger'].specification['securityDefinitions']
+        request['authz_info'] = _AuthzInfo(request, security_definitions)
 
         return await handler(request)
     return middleware_handler
 
 
 async def enforce_one_of(request: web.Request,
-                         security_requirements: T.List[T.Dict[str, T.Optional[T.Iterable]]]):
+                         security_requirements: T.Iterable[T.Mapping[str, int]]):
+    # language=rst
+    """Raises :exc:`aiohttp.web.HTTPUnauthorized` unless one of ``security_requirements`` is met.
+
+    :param security_requirements: as compiled by
+        :func:`authz_admin.routes.compile_routes`, ie. mappings from security
+        scheme names to bitmasks of required scopes.
+
+    """
     for security_requirement in security_requirements:
         if await _enforce_all_of(request, security_requirement):
             return
@@ -97,14 +271,14 @@ async def enforce_one_of(request: web.Request,
 
 
 async def _enforce_all_of(request: web.Request,
-                          security_requirements: T.Dict[str, T.Optional[T.Iterable]]) -> bool:
+                          security_requirements: T.Mapping[str, int]) -> bool:
     swagger = request.app['swagger']
     security_definitions = swagger.specification['securityDefinitions']
     for requirement, scopes in security_requirements.items():
         authz_info = request['authz_info'][requirement]
         security_type = security_definitions[requirement]['type']
         if security_type == 'oauth2':
-            if len(set(scopes) - authz_info) > 0:
+            if scopes & ~authz_info:
                 return False
         elif security_type == 'apiKey':
             if not authz_info:
@@ -119,25 +293,16 @@ def authorize(p_method=None):
     def decorator(f: T.Callable):
         @functools.wraps(f)
         async def wrapper(self: View, *args, **kwargs):
-            swagger = self.request.app['swagger']
-            base_path = swagger.base_path
-            paths = swagger.specification['paths']
-            path, _ = swagger.get_path_spec(
-                self.rel_url.raw_path
-            )
-            assert path is not None
-            assert path.startswith(base_path)
-            path = path[len(base_path):]
-            method = p_method or self.request.method
-            if method.lower() not in paths[path]:
+            route = routes.route_info(self)
+            assert route is not None
+            method = (p_method or self.request.method).lower()
+            if method not in route.operations:
                 raise web.HTTPMethodNotAllowed(
-                    method, list([
-                        method.upper() for method in paths[path].keys()
-                    ])
+                    method.upper(), list(route.allowed_methods)
                 )
-            method_info = paths[path][method.lower()]
-            if 'security' in method_info:
-                await enforce_one_of(self.request, method_info['security'])
+            security = route.operations[method].security
+            if security is not None:
+                await enforce_one_of(self.request, security)
             return await f(self, *args, **kwargs)
         return wrapper
     return decorator
@@ -0,0 +1,369 @@
+# language=rst
+"""
+Database drivers.
+
+:mod:`authz_admin.database` talks to Postgres through a :class:`Backend`, and
+never directly through a driver.  The backend is selected with the
+``backend`` setting in the ``postgres`` section of the configuration file:
+
+``aiopg`` (default)
+    Based on psycopg2.  A :class:`~authz_admin.statements.PreparedStatement`
+    is prepared with an SQL ``PREPARE`` the first time it's executed on a
+    connection.
+
+``asyncpg``
+    Uses Postgres' binary protocol, and decodes arrays natively, which makes
+    reading many rows cheaper.  Statements are prepared through asyncpg's own
+    per-connection statement cache.  Requires the ``asyncpg`` package, for
+    example through ``pip install authz_admin[asyncpg]``.  The pool's
+    ``max_lifetime`` setting is ignored: asyncpg can only close connections
+    after a period of inactivity.
+
+Both backends hand out connections with the same small interface, described
+by :class:`Connection`.  Rows are mappings from column names to values.
+
+The account mirror (:mod:`authz_admin.mirror`) and the
+``authz_admin_log_partitions`` maintenance command always use psycopg2.
+
+"""
+
+import abc
+from functools import lru_cache
+import logging
+import types
+import typing as T
+
+import aiopg.sa
+import psycopg2
+import psycopg2.errorcodes
+import sqlalchemy as sa
+
+from .statements import Statement, PreparedStatement
+
+_logger = logging.getLogger(__name__)
+
+
+class IntegrityError(Exception):
+    # language=rst
+    """Raised when a statement violates a constraint, regardless of the driver."""
+
+
+class Connection(abc.ABC):
+    # language=rst
+    """A database connection, as handed out by :meth:`Backend.acquire`."""
+
+    @abc.abstractmethod
+    async def fetch(self, statement: Statement, **params) -> T.List[T.Mapping[str, T.Any]]:
+        # language=rst
+        """All rows returned by ``statement``."""
+
+    @abc.abstractmethod
+    async def fetchrow(self, statement: Statement, **params) -> T.Optional[T.Mapping[str, T.Any]]:
+        # language=rst
+        """The first row returned by ``statement``, or ``None``."""
+
+    @abc.abstractmethod
+    async def fetchval(self, statement: Statement, **params) -> T.Any:
+        # language=rst
+        """The first column of the first row returned by ``statement``."""
+
+    @abc.abstractmethod
+    async def execute(self, statement: Statement, **params) -> int:
+        # language=rst
+        """Executes ``statement`` and returns the number of affected rows."""
+
+    @abc.abstractmethod
+    def transaction(self):
+        # language=rst
+        """An asynchronous context manager that wraps a transaction."""
+
+
+class Backend(abc.ABC):
+    # language=rst
+    """A pool of database connections.
+
+    :param dbconf: the ``postgres`` section of the configuration.
+    :param pool_overrides: settings that override those in the ``pool``
+        subsection of ``dbconf``.
+
+    """
+
+    def __init__(self, dbconf: T.Mapping[str, T.Any], **pool_overrides):
+        self.dbconf = dbconf
+        self.poolconf = dict(dbconf.get('pool', {}), **pool_overrides)
+
+    @abc.abstractmethod
+    async def open(self):
+        pass
+
+    @abc.abstractmethod
+    async def close(self):
+        pass
+
+    @abc.abstractmethod
+    def acquire(self):
+        # language=rst
+        """An asynchronous context manager that yields a :class:`Connection`."""
+
+    minsize = abc.abstractproperty()
+    maxsize = abc.abstractproperty()
+    size = abc.abstractproperty()
+    freesize = abc.abstractproperty()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+
+class _AcquireContextManager:
+
+    def __init__(self, context_manager, connection_class):
+        self._context_manager = context_manager
+        self._connection_class = connection_class
+
+    async def __aenter__(self):
+        return self._connection_class(await self._context_manager.__aenter__())
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return await self._context_manager.__aexit__(exc_type, exc_value, traceback)
+
+
+def connection_kwargs(dbconf) -> T.Dict[str, T.Any]:
+    # language=rst
+    """Keyword arguments for :func:`aiopg.connect`, from the ``postgres`` configuration section."""
+    result = {
+        'user': dbconf['user'],
+        'database': dbconf['dbname'],
+        'host': dbconf['host'],
+        'port': dbconf['port'],
+        'password': dbconf['password'],
+        'client_encoding': 'utf8'
+    }
+    poolconf = dbconf.get('pool', {})
+    if 'statement_timeout' in poolconf:
+        result['options'] = '-c statement_timeout=%d' % poolconf['statement_timeout']
+    return result
+
+
+# ┏━━━━━━━┓
+# ┃ aiopg ┃
+# ┗━━━━━━━┛
+
+@lru_cache(maxsize=None)
+def _named_text(statement: Statement) -> sa.sql.expression.TextClause:
+    return sa.text(statement.named_sql)
+
+
+@lru_cache(maxsize=None)
+def _prepare_text(statement: PreparedStatement) -> sa.sql.expression.TextClause:
+    if len(statement.param_names) == 0:
+        return sa.text('PREPARE %s AS %s' % (statement.name, statement.sql))
+    return sa.text('PREPARE %s (%s) AS %s' % (
+        statement.name, ', '.join(statement.param_types.values()), statement.sql
+    ))
+
+
+@lru_cache(maxsize=None)
+def _execute_text(statement: PreparedStatement) -> sa.sql.expression.TextClause:
+    if len(statement.param_names) == 0:
+        return sa.text('EXECUTE %s' % statement.name)
+    return sa.text('EXECUTE %s (%s)' % (
+        statement.name, ', '.join(':' + param_name for param_name in statement.param_names)
+    ))
+
+
+class AiopgConnection(Connection):
+
+    def __init__(self, conn: aiopg.sa.SAConnection):
+        self._conn = conn
+
+    async def _execute(self, statement: Statement, params):
+        params = {param_name: params[param_name] for param_name in statement.param_names}
+        try:
+            if not statement.prepared:
+                return await self._conn.execute(_named_text(statement), params)
+            # Prepared statements live as long as the connection, so we keep
+            # track of them on the raw connection:
+            raw_conn = self._conn.connection
+            prepared = raw_conn.__dict__.setdefault('_authz_admin_prepared', set())
+            if statement.name not in prepared:
+                await self._conn.execute(_prepare_text(statement))
+                prepared.add(statement.name)
+            try:
+                return await self._conn.execute(_execute_text(statement), params)
+            except psycopg2.Error as e:
+                if e.pgcode == psycopg2.errorcodes.INVALID_SQL_STATEMENT_NAME:
+                    # Deallocated behind our back, for example by a ``DISCARD
+                    # ALL`` in a connection pooler.  Prepare again next time.
+                    _logger.warning("Prepared statement %s has disappeared.", statement.name)
+                    prepared.clear()
+                raise
+        except psycopg2.IntegrityError as e:
+            raise IntegrityError(str(e)) from e
+
+    async def fetch(self, statement, **params):
+        result_proxy = await self._execute(statement, params)
+        return await result_proxy.fetchall()
+
+    async def fetchrow(self, statement, **params):
+        result_proxy = await self._execute(statement, params)
+        return await result_proxy.fetchone()
+
+    async def fetchval(self, statement, **params):
+        result_proxy = await self._execute(statement, params)
+        return await result_proxy.scalar()
+
+    async def execute(self, statement, **params):
+        result_proxy = await self._execute(statement, params)
+        return result_proxy.rowcount
+
+    def transaction(self):
+        return self._conn.begin()
+
+
+class AiopgBackend(Backend):
+
+    _engine = None
+
+    async def open(self):
+        self._engine = await aiopg.sa.create_engine(
+            minsize=self.poolconf.get('minsize', 1),
+            maxsize=self.poolconf.get('maxsize', 10),
+            pool_recycle=self.poolconf.get('max_lifetime', -1),
+            **connection_kwargs(self.dbconf)
+        )
+
+    async def close(self):
+        self._engine.close()
+        await self._engine.wait_closed()
+
+    def acquire(self):
+        return _AcquireContextManager(self._engine.acquire(), AiopgConnection)
+
+    @property
+    def minsize(self):
+        return self._engine.minsize
+
+    @property
+    def maxsize(self):
+        return self._engine.maxsize
+
+    @property
+    def size(self):
+        return self._engine.size
+
+    @property
+    def freesize(self):
+        return self._engine.freesize
+
+
+# ┏━━━━━━━━━┓
+# ┃ asyncpg ┃
+# ┗━━━━━━━━━┛
+
+class AsyncpgConnection(Connection):
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    async def _call(self, method, statement: Statement, params):
+        import asyncpg
+        try:
+            return await method(statement.sql, *statement.args(params))
+        except asyncpg.IntegrityConstraintViolationError as e:
+            raise IntegrityError(str(e)) from e
+
+    async def fetch(self, statement, **params):
+        return await self._call(self._conn.fetch, statement, params)
+
+    async def fetchrow(self, statement, **params):
+        return await self._call(self._conn.fetchrow, statement, params)
+
+    async def fetchval(self, statement, **params):
+        return await self._call(self._conn.fetchval, statement, params)
+
+    async def execute(self, statement, **params):
+        # The command tag, like ``UPDATE 1`` or ``INSERT 0 1``:
+        status = await self._call(self._conn.execute, statement, params)
+        return int(status.rsplit(' ', 1)[-1])
+
+    def transaction(self):
+        return self._conn.transaction()
+
+
+async def _init_asyncpg_connection(conn):
+    # Statements take and return JSON documents as text, like psycopg2 does for
+    # parameters.  Decoding results, on the other hand, is also done by
+    # psycopg2, so we do it here too.
+    import json
+    for type_name in ('json', 'jsonb'):
+        await conn.set_type_codec(
+            type_name, schema='pg_catalog', format='text',
+            encoder=lambda value: value, decoder=json.loads
+        )
+
+
+class AsyncpgBackend(Backend):
+
+    _pool = None
+
+    async def open(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise RuntimeError(
+                "The asyncpg backend requires the asyncpg package."
+            ) from None
+        server_settings = {}
+        if 'statement_timeout' in self.poolconf:
+            server_settings['statement_timeout'] = str(self.poolconf['statement_timeout'])
+        self._pool = await asyncpg.create_pool(
+            min_size=self.poolconf.get('minsize', 1),
+            max_size=self.poolconf.get('maxsize', 10),
+            user=self.dbconf['user'],
+            database=self.dbconf['dbname'],
+            host=self.dbconf['host'],
+            port=self.dbconf['port'],
+            password=self.dbconf['password'],
+            server_settings=server_settings,
+            init=_init_asyncpg_connection
+        )
+
+    async def close(self):
+        await self._pool.close()
+
+    def acquire(self):
+        return _AcquireContextManager(self._pool.acquire(), AsyncpgConnection)
+
+    @property
+    def minsize(self):
+        return self._pool.get_min_size()
+
+    @property
+    def maxsize(self):
+        return self._pool.get_max_size()
+
+    @property
+    def size(self):
+        return self._pool.get_size()
+
+    @property
+    def freesize(self):
+        return self._pool.get_idle_size()
+
+
+BACKENDS = types.MappingProxyType({
+    'aiopg': AiopgBackend,
+    'asyncpg': AsyncpgBackend
+})
+# language=rst
+"""Backend classes by name, as used in the configuration."""
+
+
+def create(dbconf: T.Mapping[str, T.Any], **pool_overrides) -> Backend:
+    # language=rst
+    """The (not yet opened) backend configured in ``dbconf``."""
+    return BACKENDS[dbconf.get('backend', 'aiopg')](dbconf, **pool_overrides)
@@ -28,8 +28,10 @@ See also :mod:`config_loader`.
 
 """
 
+import functools
 import logging
 import logging.config
+import operator
 import os.path
 import pathlib
 import re
@@ -185,3 +187,91 @@ def all_scopes(config: T.Hashable) -> T.FrozenSet[str]:
         for scope_token in dataset.get('scopes', {}):
             retval.append("{}.{}".format(dataset_token, scope_token))
     return frozenset(retval)
+
+
+class ScopeIndex:
+    # language=rst
+    """Bit positions and implied scopes of all fully qualified scopes.
+
+    Every fully qualified scope identifier (eg. ``AUR/W``) is assigned a bit
+    position.  The transitive closure of the ``includes`` relation is computed
+    once, so that a set of scopes can be represented as an integer bitmask in
+    which all implied scopes are already present.  Checking whether a set of
+    granted scopes satisfies a set of required scopes then becomes::
+
+        required & ~granted == 0
+
+    Example usage::
+
+        scope_index = ScopeIndex(config)
+        granted = scope_index.mask(['AUR/W'])
+        required = scope_index.mask(['AUR/R'], implied=False)
+        assert required & ~granted == 0
+
+    """
+
+    def __init__(self, config: T.Mapping):
+        bits = {}
+        includes = {}
+        for dataset_token, dataset in config['authz_admin']['datasets'].items():
+            for scope_token, scope in dataset.get('scopes', {}).items():
+                fq_scope = '{}/{}'.format(dataset_token, scope_token)
+                bits[fq_scope] = 1 << len(bits)
+                if 'includes' in scope:
+                    includes[fq_scope] = '{}/{}'.format(dataset_token, scope['includes'])
+        closure = {}
+        for fq_scope in bits:
+            implied = [fq_scope]
+            while implied[-1] in includes and includes[implied[-1]] not in implied:
+                implied.append(includes[implied[-1]])
+            closure[fq_scope] = frozenset(implied)
+        # Maps each fully qualified scope to its own bit:
+        self.bits = frozen(bits)
+        # Maps each fully qualified scope to the set of scopes it implies,
+        # including itself:
+        self.closure = frozen(closure)
+        # Like self.closure, but as bitmasks:
+        self.closure_masks = frozen({
+            fq_scope: functools.reduce(operator.or_, (bits[s] for s in implied), 0)
+            for fq_scope, implied in closure.items()
+        })
+        # A bit that's never granted, for required scopes that don't exist:
+        self.unknown_scope_mask = 1 << len(bits)
+
+    def mask(self, scopes: T.Iterable[str], implied: bool=True) -> int:
+        # language=rst
+        """The bitmask for a set of fully qualified scopes.
+
+        :param implied: whether to include the scopes implied by ``scopes``.
+            Use ``True`` for *granted* scopes, and ``False`` for *required*
+            scopes.  Unknown granted scopes are ignored; unknown required scopes
+            yield a bit which can never be satisfied.
+
+        """
+        result = 0
+        if implied:
+            for scope in scopes:
+                result |= self.closure_masks.get(scope, 0)
+        else:
+            for scope in scopes:
+                result |= self.bits.get(scope, self.unknown_scope_mask)
+        return result
+
+
+def role_scopes(config: T.Mapping, scope_index: ScopeIndex) -> T.Mapping[str, T.FrozenSet[str]]:
+    # language=rst
+    """All scopes granted by each role in the configuration.
+
+    Resolves roles through profiles to fully qualified scope identifiers,
+    including all scopes implied through the ``includes`` relation.
+
+    """
+    profiles = config['authz_admin']['profiles']
+    result = {}
+    for role_token, role in config['authz_admin']['roles'].items():
+        scopes = set()
+        for profile_token in role['profiles']:
+            for fq_scope in profiles[profile_token]['scopes']:
+                scopes |= scope_index.closure.get(fq_scope, {fq_scope})
+        result[role_token] = frozenset(scopes)
+    return frozen(result)
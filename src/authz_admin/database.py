@@ -1,6 +1,13 @@
 # language=rst
 """
 
+Safe requests (``GET``, ``HEAD`` and ``OPTIONS``) read from a read-only
+replica, if one is configured in the ``replica`` subsection of the
+``postgres`` section.  Writes, and all reads while handling other requests,
+go to the primary.  A client that sends an ETag, in ``If-None-Match`` or
+``If-Match``, of a version that the replica hasn't applied yet is served from
+the primary, so that clients read their own writes.
+
 .. todo:: Automatic schema creation and schema updates on target platforms.
 
     Currently, creating or upgrading the database schema on acceptance and
@@ -8,16 +15,23 @@
 
 """
 
+import asyncio
+import bisect
+import datetime
 from functools import lru_cache
+import json
 import logging
+import types
 import typing as T
 
-import aiopg.sa
 import sqlalchemy as sa
 from sqlalchemy.dialects import postgresql
 import sqlalchemy.sql.functions as sa_functions
-import sqlalchemy.exc as sa_exceptions
 from aiohttp import web
+from rest_utils import int_from_etag, EMBED_CONCURRENCY, VALID_ETAG_PATTERN
+
+from . import audit, backends, mirror
+from .statements import Statement, PreparedStatement
 
 
 _logger = logging.getLogger(__name__)
@@ -33,88 +47,619 @@ def metadata() -> sa.MetaData:
 
     sa.Table(
         'AccountRolesLog', result,
-        sa.Column('id', sa.Integer, index=True, nullable=False, primary_key=True),
-        sa.Column('created_at', sa.DateTime, server_default=sa_functions.now(), index=True, nullable=False),
+        # Partitioned by month on created_at, which is therefore part of the
+        # primary key.  See the Alembic migration partition_account_roles_log
+        # and :mod:`authz_admin.log_partitions`.
+        sa.Column('id', sa.Integer, nullable=False, primary_key=True),
+        sa.Column('created_at', sa.DateTime, server_default=sa_functions.now(), index=True, nullable=False, primary_key=True),
         sa.Column('created_by', sa.Unicode, index=True, nullable=False),
-        sa.Column('request_info', sa.UnicodeText, nullable=None),
-        sa.Column('account_id', sa.String, index=True, nullable=False),
+        # See :func:`authz_admin.audit.request_info`:
+        sa.Column('request_info', postgresql.JSONB, nullable=None),
+        sa.Column('account_id', sa.String, nullable=False),
         sa.Column('action', sa.String(1), index=True, nullable=False),
         sa.Column('role_ids', postgresql.ARRAY(sa.String(32)), nullable=False),
-        sa.Index('idx_arl_role_ids', 'role_ids', postgresql_using='gin')
+        sa.Index('idx_arl_role_ids', 'role_ids', postgresql_using='gin'),
+        # For point-in-time snapshots; see :func:`accounts`:
+        sa.Index('ix_AccountRolesLog_account_id_id', 'account_id', sa.text('id DESC'))
     )
 
     sa.Table(
         'AccountRoles', result,
-        sa.Column('account_id', sa.String, index=True, nullable=False, primary_key=True),
+        # Collation "C" sorts by code point, like :mod:`authz_admin.mirror`:
+        sa.Column('account_id', sa.String(collation='C'), index=True, nullable=False, primary_key=True),
         sa.Column('role_ids', postgresql.ARRAY(sa.String(32)), nullable=False),
-        sa.Column('log_id', sa.Integer, sa.ForeignKey('AccountRolesLog.id'),
-                  index=True, nullable=False, unique=True),
+        # No foreign key: the log entry may have been archived.
+        sa.Column('log_id', sa.Integer, index=True, nullable=False, unique=True),
         sa.Index('idx_ar_role_ids', 'role_ids', postgresql_using='gin')
     )
 
+    sa.Table(
+        'AccountRolesCheckpoint', result,
+        # The latest archived log entry of each account.  See
+        # :func:`authz_admin.log_partitions.archive_partition`.
+        sa.Column('account_id', sa.String, nullable=False, primary_key=True),
+        sa.Column('role_ids', postgresql.ARRAY(sa.String(32)), nullable=False),
+        sa.Column('log_id', sa.Integer, index=True, nullable=False),
+        sa.Column('action', sa.String(1), nullable=False),
+        sa.Column('created_at', sa.DateTime, index=True, nullable=False)
+    )
+
     return result
 
 
-async def _accountroleslog_insert(
-    conn,
-    created_by: str,
-    request_info: str,
-    account_id: str,
-    action: str,
-    role_ids: T.Iterable[str]
-) -> int:
+ACQUIRE_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+# language=rst
+"""Upper bounds, in seconds, of the acquire-wait-time histogram buckets.
+
+See :class:`Pool`.
+
+"""
+
+
+class Pool:
     # language=rst
+    """Connection pool wrapper that enforces an acquire timeout and keeps statistics.
+
+    Use :meth:`acquire` instead of ``backend.acquire()``::
+
+        async with request.app['pool'].acquire() as conn:
+            ...
+
+    ``conn`` is a :class:`authz_admin.backends.Connection`.
+
+    Raises:
+        aiohttp.web.HTTPServiceUnavailable: if no connection could be acquired
+            within the configured ``acquire_timeout``.
+
     """
 
-    Insert an entry in the audit log, and return the *log id*.
+    def __init__(self, backend: backends.Backend, acquire_timeout: T.Optional[float]=None):
+        self.backend = backend
+        self._acquire_timeout = acquire_timeout
+        self._waiters = 0
+        self._timeouts = 0
+        self._acquire_wait_histogram = [0] * (len(ACQUIRE_WAIT_BUCKETS) + 1)
+
+    def acquire(self):
+        return _PoolAcquireContextManager(self)
+
+    def _record_wait(self, seconds: float):
+        self._acquire_wait_histogram[bisect.bisect_left(ACQUIRE_WAIT_BUCKETS, seconds)] += 1
+
+    def statistics(self) -> T.Dict[str, T.Any]:
+        # language=rst
+        """Live statistics of this pool.
+
+        ``acquire_wait_histogram`` maps the upper bound of each bucket (in
+        seconds, as a string) to the number of acquisitions that waited at most
+        that long.
+
+        """
+        bounds = [str(bound) for bound in ACQUIRE_WAIT_BUCKETS] + ['+Inf']
+        return {
+            'backend': self.backend.dbconf.get('backend', 'aiopg'),
+            'minsize': self.backend.minsize,
+            'maxsize': self.backend.maxsize,
+            'size': self.backend.size,
+            'in_use': self.backend.size - self.backend.freesize,
+            'free': self.backend.freesize,
+            'waiters': self._waiters,
+            'acquire_timeouts': self._timeouts,
+            'acquire_wait_histogram': dict(zip(bounds, self._acquire_wait_histogram))
+        }
+
+
+class _PoolAcquireContextManager:
+
+    def __init__(self, pool: Pool):
+        self._pool = pool
+        self._context_manager = None
+
+    async def __aenter__(self):
+        pool = self._pool
+        self._context_manager = pool.backend.acquire()
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        pool._waiters += 1
+        try:
+            return await asyncio.wait_for(
+                self._context_manager.__aenter__(), pool._acquire_timeout
+            )
+        except asyncio.TimeoutError:
+            pool._timeouts += 1
+            _logger.warning("Timeout while acquiring a database connection.")
+            raise web.HTTPServiceUnavailable(
+                text="Database connection pool exhausted."
+            ) from None
+        finally:
+            pool._waiters -= 1
+            pool._record_wait(loop.time() - start)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return await self._context_manager.__aexit__(exc_type, exc_value, traceback)
+
+
+class Replica:
+    # language=rst
+    """A read-only replica of the database.
+
+    :ivar pool: the :class:`Pool` of connections to the replica.
+    :ivar applied_version: a lower bound of the id of the latest
+        ``AccountRolesLog`` entry that the replica has applied.
 
     """
-    accountroleslog_table = metadata().tables['AccountRolesLog']
-    result_set = await conn.execute(
-        accountroleslog_table.insert().values(
-            created_by='authz_admin_service',
-            request_info='Initialization',
-            account_id=account_id,
-            action='C',
-            role_ids=role_ids
-        ).returning(accountroleslog_table.c.id)
-    )
-    row = await result_set.fetchone()
-    return row[0]
+
+    def __init__(self, pool: Pool):
+        self.pool = pool
+        self.applied_version = 0
+
+    async def has_applied(self, version: int) -> bool:
+        # language=rst
+        """Whether the replica has caught up with log entry ``version``.
+
+        Only asks the replica if :attr:`applied_version` is too old to tell.
+
+        """
+        if version > self.applied_version:
+            async with self.pool.acquire() as conn:
+                self.applied_version = max(
+                    self.applied_version, await conn.fetchval(_ACCOUNTS_VERSION)
+                )
+        return version <= self.applied_version
+
+
+async def _open_pool(dbconf) -> Pool:
+    _logger.info("Connecting to database: postgres://%s:%i/%s, with backend %s",
+                 dbconf['host'], dbconf['port'], dbconf['dbname'],
+                 dbconf.get('backend', 'aiopg'))
+    backend = backends.create(dbconf)
+    await backend.open()
+    return Pool(backend, acquire_timeout=dbconf.get('pool', {}).get('acquire_timeout'))
 
 
 async def initialize_app(app):
     dbconf = app['config']['postgres']
-    _logger.info("Connecting to database: postgres://%s:%i/%s",
-                 dbconf['host'], dbconf['port'], dbconf['dbname'])
-    engine_context = aiopg.sa.create_engine(
-        user=dbconf['user'],
-        database=dbconf['dbname'],
-        host=dbconf['host'],
-        port=dbconf['port'],
-        password=dbconf['password'],
-        client_encoding='utf8'
+    app['pool'] = await _open_pool(dbconf)
+    await initialize_database(app['pool'].backend, required_accounts=app['config']['authz_admin']['required_accounts'])
+    # Embedded resources are rendered concurrently, each with its own
+    # connection.  By default, one request may use half of the pool:
+    app[EMBED_CONCURRENCY] = dbconf.get('pool', {}).get(
+        'embed_concurrency', max(1, app['pool'].backend.maxsize // 2)
     )
-    app['engine'] = await engine_context.__aenter__()
-    await initialize_database(app['engine'], required_accounts=app['config']['authz_admin']['required_accounts'])
+    if 'replica' in dbconf:
+        replica_conf = dict(dbconf, **dbconf['replica'])
+        del replica_conf['replica']
+        app['replica'] = Replica(await _open_pool(replica_conf))
+    if dbconf.get('mirror_accounts', False):
+        app['mirror'] = mirror.AccountRolesMirror(backends.connection_kwargs(dbconf))
+        await app['mirror'].start()
 
     async def on_shutdown(app):
-        await engine_context.__aexit__(None, None, None)
+        if 'mirror' in app:
+            await app['mirror'].stop()
+        if 'replica' in app:
+            await app['replica'].pool.backend.close()
+        await app['pool'].backend.close()
     app.on_shutdown.append(on_shutdown)
 
 
-async def accounts(request, role_ids=None):
-    accountroles = metadata().tables['AccountRoles']
-    statement = sa.select([accountroles])
+_SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+_READ_POOL = 'authz_admin.database.read_pool'
+
+
+def _client_version(request) -> int:
+    # The highest log id in the ETags the client sent us, or in the ``as_of``
+    # query parameter, if any.
+    as_of = request.query.get('as_of', '')
+    result = int(as_of) if as_of.isdigit() else 0
+    for header_name in ('If-None-Match', 'If-Match'):
+        for header in request.headers.getall(header_name, ()):
+            for etag in VALID_ETAG_PATTERN.findall(header):
+                version = int_from_etag(etag)
+                if version is not None:
+                    result = max(result, version)
+    return result
+
+
+async def _read_pool(request) -> Pool:
+    # language=rst
+    """The pool to read from while handling ``request``.
+
+    This is the replica, if one is configured and ``request`` is a safe
+    request, unless the client sent an ETag of a newer version than the
+    replica has applied.  Otherwise, it's the primary.  The choice is made
+    once per request, so that all reads in a request see the same database,
+    even those of embedded views that are rendered concurrently.
+
+    """
+    choice = request.get(_READ_POOL)
+    if choice is None:
+        # Stored before awaiting anything, so that concurrent callers await
+        # the same choice:
+        choice = asyncio.ensure_future(_choose_read_pool(request))
+        request[_READ_POOL] = choice
+    return await asyncio.shield(choice)
+
+
+async def _choose_read_pool(request) -> Pool:
+    replica = request.app.get('replica')
+    if replica is not None and request.method in _SAFE_METHODS \
+            and await replica.has_applied(_client_version(request)):
+        return replica.pool
+    return request.app['pool']
+
+
+def _mirror(request) -> T.Optional[mirror.AccountRolesMirror]:
+    # language=rst
+    """The account mirror, if it's enabled and ready to answer queries."""
+    result = request.app.get('mirror')
+    if result is not None and result.ready:
+        return result
+    return None
+
+
+def _update_mirror(request, account_id: str, role_ids=None, log_id=None):
+    account_mirror = request.app.get('mirror')
+    if account_mirror is None:
+        return
+    if log_id is None:
+        account_mirror.apply(account_id, None)
+    else:
+        account_mirror.apply(account_id, {
+            'account_id': account_id,
+            'role_ids': role_ids,
+            'log_id': log_id
+        })
+
+
+AsOf = T.Union[int, datetime.datetime]
+# language=rst
+"""A point in time: either a log id or a timestamp.  See :func:`accounts`."""
+
+# The state of all accounts as of :as_of, reconstructed from the audit log and
+# the checkpoint of its archived partitions: the latest entry of each account,
+# unless that entry is a deletion.
+_SNAPSHOT = '''(
+    SELECT DISTINCT ON (account_id) account_id, role_ids, log_id, action
+      FROM (
+        SELECT account_id, role_ids, log_id, action, created_at
+          FROM "AccountRolesCheckpoint"
+         UNION ALL
+        SELECT account_id, role_ids, id AS log_id, action, created_at
+          FROM "AccountRolesLog"
+      ) AS entries
+     WHERE {} <= :as_of
+     ORDER BY account_id, log_id DESC
+) AS snapshot'''
+
+# Log ids in as_of may have up to 18 digits; see
+# :func:`authz_admin.handlers._accounts.as_of_param`.
+_AS_OF_COLUMNS = types.MappingProxyType({
+    int: ('log_id', 'bigint'),
+    datetime.datetime: ('created_at', 'timestamp')
+})
+
+# Whether entries after :as_of have been archived, ie. whether the snapshot as
+# of :as_of can't be reconstructed anymore:
+_ARCHIVED_AFTER = types.MappingProxyType({
+    as_of_type: PreparedStatement(
+        'archived_after_%s' % column,
+        'SELECT EXISTS (SELECT 1 FROM "AccountRolesCheckpoint" WHERE %s > :as_of)' % column,
+        as_of=param_type
+    )
+    for as_of_type, (column, param_type) in _AS_OF_COLUMNS.items()
+})
+
+
+def _as_of_type(as_of: T.Optional[AsOf]) -> T.Optional[type]:
+    if as_of is None:
+        return None
+    return int if isinstance(as_of, int) else datetime.datetime
+
+
+@lru_cache(maxsize=None)
+def _accounts_statement(by_role_ids: bool, by_account_ids: bool, after: bool,
+                        before: bool, reverse: bool, limit: bool,
+                        as_of_type: T.Optional[type]=None) -> PreparedStatement:
+    where = []
+    param_types = {}
+    if as_of_type is None:
+        source = '"AccountRoles"'
+        name = 'accounts_'
+    else:
+        column, param_types['as_of'] = _AS_OF_COLUMNS[as_of_type]
+        source = _SNAPSHOT.format(column)
+        name = 'accounts_as_of_%s_' % column
+        where.append("action <> 'D'")
+    if by_role_ids:
+        where.append('role_ids @> :role_ids')
+        param_types['role_ids'] = 'varchar(32)[]'
+    if by_account_ids:
+        where.append('account_id = ANY(:account_ids)')
+        param_types['account_ids'] = 'varchar[]'
+    # Explicitly in collation "C", for snapshots, which are read from tables
+    # in the default collation.  See :func:`accounts`.
+    if after:
+        where.append('account_id COLLATE "C" > :after')
+        param_types['after'] = 'varchar'
+    if before:
+        where.append('account_id COLLATE "C" < :before')
+        param_types['before'] = 'varchar'
+    sql = 'SELECT account_id, role_ids, log_id FROM ' + source
+    if len(where) > 0:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY account_id COLLATE "C"'
+    if reverse:
+        sql += ' DESC'
+    if limit:
+        sql += ' LIMIT :limit'
+        param_types['limit'] = 'integer'
+    name += ''.join(
+        '1' if flag else '0'
+        for flag in (by_role_ids, by_account_ids, after, before, reverse, limit)
+    )
+    return PreparedStatement(name, sql, **param_types)
+
+
+async def accounts(request, role_ids=None, account_ids=None,
+                   after=None, before=None, limit=None, as_of: T.Optional[AsOf]=None):
+    # language=rst
+    """All accounts, optionally filtered, in order of account id.
+
+    Account ids are compared by code point (collation ``"C"``), in the same
+    order as :meth:`authz_admin.mirror.AccountRolesMirror.accounts`, and
+    regardless of the default collation of the database.
+
+    :param role_ids: if given, only accounts having *all* these roles.
+    :param account_ids: if given, only accounts with one of these ids.
+    :param after: if given, only accounts with an id greater than this.
+    :param before: if given, only accounts with an id less than this.  Combined
+        with ``limit``, this yields the *last* ``limit`` matching accounts
+        (still in ascending order).
+    :param limit: the maximum number of accounts to yield.
+    :param as_of: if given, the accounts as they were right after the change
+        with this log id (if it's an :class:`int`), or at this moment (if it's
+        a :class:`datetime.datetime`).
+
+    Pagination is keyset-based on the primary key, so fetching one page costs
+    O(page size), regardless of the size of the table.  Each combination of
+    filters is a separate :class:`~authz_admin.statements.PreparedStatement`.
+
+    Past states are reconstructed from ``AccountRolesLog``, using the index on
+    ``(account_id, id DESC)``, and from ``AccountRolesCheckpoint``, which holds
+    the latest entry of each account in the archived log partitions (see
+    :mod:`authz_admin.log_partitions`).
+
+    :raises: :ref:`HTTPGone <aiohttp-web-exceptions>` if ``as_of`` is before
+        the last archived log entry.
+
+    """
+    account_mirror = _mirror(request)
+    if account_mirror is not None and as_of is None:
+        for row in account_mirror.accounts(role_ids, account_ids, after, before, limit):
+            yield row
+        return
+    reverse = before is not None and limit is not None
+    statement = _accounts_statement(
+        role_ids is not None, account_ids is not None, after is not None,
+        before is not None, reverse, limit is not None, _as_of_type(as_of)
+    )
+    params = {'after': after, 'before': before, 'limit': limit, 'as_of': as_of}
     if role_ids is not None:
-        statement = statement.where(accountroles.c.role_ids.contains(
-            sa.cast(role_ids, postgresql.ARRAY(sa.String(32)))
-        ))
-    async with request.app['engine'].acquire() as conn:
-        async for row in conn.execute(
-            statement
-        ):
+        params['role_ids'] = list(role_ids)
+    if account_ids is not None:
+        params['account_ids'] = list(account_ids)
+    pool = await _read_pool(request)
+    async with pool.acquire() as conn:
+        if as_of is not None and await conn.fetchval(
+                _ARCHIVED_AFTER[_as_of_type(as_of)], as_of=as_of):
+            raise web.HTTPGone(
+                text="The state as of %s has been archived." % as_of
+            )
+        rows = await conn.fetch(statement, **params)
+    if reverse:
+        rows = reversed(rows)
+    for row in rows:
+        yield row
+
+
+ACCOUNTS_BATCH_SIZE = 1000
+# language=rst
+"""Number of accounts fetched per query by :func:`stream_accounts`."""
+
+
+async def stream_accounts(request, role_ids=None, batch_size=ACCOUNTS_BATCH_SIZE,
+                          as_of: T.Optional[AsOf]=None):
+    # language=rst
+    """Like :func:`accounts`, but with bounded memory use.
+
+    Accounts are read in keyset batches of ``batch_size`` rows.  A database
+    connection is only held while a batch is being fetched, not while the
+    caller consumes the rows, so a slow client doesn't hold on to a pooled
+    connection.  Consequently, the stream isn't a consistent snapshot: changes
+    committed between two batches may or may not be seen.
+
+    """
+    account_mirror = _mirror(request)
+    if account_mirror is not None and as_of is None:
+        for row in account_mirror.accounts(role_ids):
+            yield row
+        return
+    after = None
+    while True:
+        batch = [
+            row async for row in accounts(
+                request, role_ids, after=after, limit=batch_size, as_of=as_of
+            )
+        ]
+        for row in batch:
+            yield row
+        if len(batch) < batch_size:
+            return
+        after = batch[-1]['account_id']
+
+
+_ACCOUNTS_BY_ROLE = PreparedStatement(
+    'accounts_by_role', '''
+    SELECT r.role_id, a.account_id, a.role_ids, a.log_id
+      FROM "AccountRoles" a
+     CROSS JOIN unnest(a.role_ids) AS r(role_id)
+     WHERE a.role_ids && :role_ids AND r.role_id = ANY(:role_ids)
+     ORDER BY r.role_id, a.account_id
+    ''',
+    role_ids='varchar(32)[]'
+)
+
+
+async def accounts_by_role(request, role_ids: T.Iterable[str]) -> T.Dict[str, T.List]:
+    # language=rst
+    """The accounts having each of ``role_ids``, with a single query.
+
+    :returns: a dict that maps each role id to the list of accounts having
+        that role, in order of account id.
+
+    """
+    role_ids = list(role_ids)
+    account_mirror = _mirror(request)
+    if account_mirror is not None:
+        return {
+            role_id: list(account_mirror.accounts([role_id]))
+            for role_id in role_ids
+        }
+    result = {role_id: [] for role_id in role_ids}
+    pool = await _read_pool(request)
+    async with pool.acquire() as conn:
+        for row in await conn.fetch(_ACCOUNTS_BY_ROLE, role_ids=role_ids):
+            result[row['role_id']].append(row)
+    return result
+
+
+_ACCOUNTS_VERSION = PreparedStatement(
+    'accounts_version',
+    'SELECT coalesce(max(id), 0) FROM "AccountRolesLog"'
+)
+
+
+async def accounts_version(request, mirrored: bool=True) -> int:
+    # language=rst
+    """The id of the latest entry in the ``AccountRolesLog``.
+
+    Every change to any account adds a log entry, so this value can serve as
+    an ETag for collections of accounts.  The query is answered from the
+    primary key index.
+
+    :param mirrored: whether the state is read from the account mirror, if
+        it's ready (see :func:`accounts`).  If so, this is the version of the
+        mirror instead, which may lag behind the database; see
+        :attr:`authz_admin.mirror.AccountRolesMirror.version`.
+
+    """
+    account_mirror = _mirror(request) if mirrored else None
+    if account_mirror is not None:
+        return account_mirror.version
+    pool = await _read_pool(request)
+    async with pool.acquire() as conn:
+        return await conn.fetchval(_ACCOUNTS_VERSION)
+
+_SELECT_LOG_ENTRIES = '''
+SELECT id, created_at, created_by, request_info, account_id, action, role_ids
+  FROM "AccountRolesLog"
+'''
+
+_LOG_ENTRY = PreparedStatement(
+    'log_entry', _SELECT_LOG_ENTRIES + ' WHERE id = :entry_id', entry_id='bigint'
+)
+
+_LOG_ENTRY_FILTERS = (
+    ('account_id', 'account_id = :account_id', 'varchar'),
+    ('created_by', 'created_by = :created_by', 'varchar'),
+    ('action', 'action = :action', 'varchar(1)'),
+    ('role_id', 'role_ids @> ARRAY[:role_id]', 'varchar(32)'),
+    ('since', 'created_at >= :since', 'timestamp'),
+    ('until', 'created_at < :until', 'timestamp'),
+    ('after', 'id > :after', 'bigint')
+)
+
+
+@lru_cache(maxsize=None)
+def _log_entries_statement(filters: T.Tuple[bool, ...], limit: bool) -> PreparedStatement:
+    where = []
+    param_types = {}
+    for (param_name, condition, param_type), enabled in zip(_LOG_ENTRY_FILTERS, filters):
+        if enabled:
+            where.append(condition)
+            param_types[param_name] = param_type
+    sql = _SELECT_LOG_ENTRIES
+    if len(where) > 0:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += ' ORDER BY id'
+    if limit:
+        sql += ' LIMIT :limit'
+        param_types['limit'] = 'integer'
+    name = 'log_entries_' + ''.join('1' if flag else '0' for flag in filters + (limit,))
+    return PreparedStatement(name, sql, **param_types)
+
+
+async def log_entries(request, account_id=None, created_by=None, action=None,
+                      role_id=None, since=None, until=None, after=None, limit=None):
+    # language=rst
+    """Entries of the ``AccountRolesLog``, optionally filtered, in order of id.
+
+    :param role_id: if given, only entries in which the account had this role
+        (after the change).
+    :param since: if given, only entries created at or after this
+        :class:`datetime.datetime`.
+    :param until: if given, only entries created before this
+        :class:`datetime.datetime`.
+    :param after: if given, only entries with an id greater than this.
+    :param limit: the maximum number of entries to yield.
+
+    Every filter has a matching index on ``AccountRolesLog``, and pagination is
+    keyset-based on the primary key.
+
+    """
+    params = {
+        'account_id': account_id, 'created_by': created_by, 'action': action,
+        'role_id': role_id, 'since': since, 'until': until, 'after': after,
+        'limit': limit
+    }
+    statement = _log_entries_statement(
+        tuple(params[param_name] is not None for param_name, _, _ in _LOG_ENTRY_FILTERS),
+        limit is not None
+    )
+    pool = await _read_pool(request)
+    async with pool.acquire() as conn:
+        rows = await conn.fetch(statement, **params)
+    for row in rows:
+        yield row
+
+
+async def stream_log_entries(request, batch_size=ACCOUNTS_BATCH_SIZE, **filters):
+    # language=rst
+    """Like :func:`log_entries`, but with bounded memory use.
+
+    Reads keyset batches, like :func:`stream_accounts`.  Accepts the same
+    filters as :func:`log_entries`, except ``limit``.
+
+    """
+    after = filters.pop('after', None)
+    while True:
+        batch = [
+            row async for row in log_entries(
+                request, after=after, limit=batch_size, **filters
+            )
+        ]
+        for row in batch:
             yield row
+        if len(batch) < batch_size:
+            return
+        after = batch[-1]['id']
+
+
+async def log_entry(request, entry_id: int):
+    pool = await _read_pool(request)
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(_LOG_ENTRY, entry_id=entry_id)
 
 
 # async def account_names_with_role(request, role_id):
@@ -129,155 +674,391 @@ async def accounts(request, role_ids=None):
 #             yield row['account_id']
 
 
-async def account(request, account_id):
-    accountroles_table = metadata().tables['AccountRoles']
-    async with request.app['engine'].acquire() as conn:
-        result_proxy = await conn.execute(
-            sa.select([accountroles_table])
-            .where(accountroles_table.c.account_id == account_id)
-        )
-        return await result_proxy.fetchone()
+_ACCOUNT = PreparedStatement(
+    'account',
+    'SELECT account_id, role_ids, log_id FROM "AccountRoles" WHERE account_id = :account_id',
+    account_id='varchar'
+)
+
+_DELETE_ACCOUNT = PreparedStatement(
+    'delete_account', '''
+    WITH deleted AS (
+        DELETE FROM "AccountRoles"
+         WHERE account_id = :account_id AND log_id = :expected_log_id
+        RETURNING account_id, role_ids
+    )
+    INSERT INTO "AccountRolesLog" (created_by, request_info, account_id, action, role_ids)
+    SELECT :created_by, :request_info, account_id, 'D', role_ids FROM deleted
+    RETURNING id
+    ''',
+    account_id='varchar', expected_log_id='integer', created_by='varchar',
+    request_info='jsonb'
+)
+
+_UPDATE_ACCOUNT = PreparedStatement(
+    'update_account', '''
+    WITH updated AS (
+        UPDATE "AccountRoles"
+           SET role_ids = :role_ids,
+               log_id = nextval(pg_get_serial_sequence('"AccountRolesLog"', 'id'))
+         WHERE account_id = :account_id AND log_id = :expected_log_id
+        RETURNING account_id, role_ids, log_id
+    ), log AS (
+        INSERT INTO "AccountRolesLog" (id, created_by, request_info, account_id, action, role_ids)
+        SELECT log_id, :created_by, :request_info, account_id, 'U', role_ids FROM updated
+    )
+    SELECT log_id FROM updated
+    ''',
+    role_ids='varchar(32)[]', account_id='varchar', expected_log_id='integer',
+    created_by='varchar', request_info='jsonb'
+)
+
+_CREATE_ACCOUNT = PreparedStatement(
+    'create_account', '''
+    WITH log AS (
+        INSERT INTO "AccountRolesLog" (created_by, request_info, account_id, action, role_ids)
+        VALUES (:created_by, :request_info, :account_id, 'C', :role_ids)
+        RETURNING id, account_id, role_ids
+    )
+    INSERT INTO "AccountRoles" (account_id, role_ids, log_id)
+    SELECT account_id, role_ids, id FROM log
+    RETURNING log_id
+    ''',
+    created_by='varchar', request_info='jsonb', account_id='varchar',
+    role_ids='varchar(32)[]'
+)
 
 
-async def delete_account(request, account):
+async def account(request, account_id, as_of: T.Optional[AsOf]=None):
     # language=rst
+    """The account with id ``account_id``, or ``None``.
+
+    :param as_of: if given, the account as it was at that point in time; see
+        :func:`accounts`.
+
     """
+    if as_of is not None:
+        rows = [row async for row in accounts(request, account_ids=[account_id], as_of=as_of)]
+        return rows[0] if len(rows) > 0 else None
+    account_mirror = _mirror(request)
+    if account_mirror is not None:
+        return account_mirror.account(account_id)
+    pool = await _read_pool(request)
+    async with pool.acquire() as conn:
+        return await conn.fetchrow(_ACCOUNT, account_id=account_id)
 
-    Raises:
-        PreconditionFailed: if the account doesn't exist or isn't in the
-            expected state.
+
+# Each write below is a single statement, which checks the expected state of
+# the account, writes the audit log entry and changes the account at once.  So
+# a write costs one round trip, and needs no explicit transaction.
+
+async def delete_account(request, account_id: str, expected_log_id: int) -> int:
+    # language=rst
+    """Deletes an account, if its current log id is ``expected_log_id``.
+
+    :returns: the log id of the deletion.
+    :raises PreconditionFailed: if the account doesn't exist or isn't in the
+        expected state.
 
     """
-    account_data = await account.data()
-    accountroles = metadata().tables['AccountRoles']
-    async with request.app['engine'].acquire() as conn:
-        async with conn.begin():
-            log_id = await _accountroleslog_insert(
-                conn,
-                created_by='p.van.beek@amsterdam.nl',
-                request_info=str(request.headers),
-                account_id=account['account'],
-                action='D',
-                role_ids=account_data['role_ids']
-            )
-            result_set = await conn.execute(
-                accountroles.delete().where(sa.and_(
-                    accountroles.c.account_id == account['account'],
-                    accountroles.c.log_id == account_data['log_id']
-                ))
-            )
-            if result_set.rowcount != 1:
-                raise PreconditionFailed()
+    async with request.app['pool'].acquire() as conn:
+        log_id = await conn.fetchval(
+            _DELETE_ACCOUNT,
+            account_id=account_id,
+            expected_log_id=expected_log_id,
+            created_by='p.van.beek@amsterdam.nl',
+            request_info=json.dumps(audit.request_info(request))
+        )
+    if log_id is None:
+        raise PreconditionFailed()
+    _update_mirror(request, account_id)
     return log_id
 
 
-async def update_account(request, account, role_ids):
+async def update_account(request, account_id: str, role_ids: T.Iterable[str],
+                         expected_log_id: int) -> int:
     # language=rst
+    """Replaces the roles of an account, if its current log id is ``expected_log_id``.
+
+    :returns: the new log id of the account.
+    :raises PreconditionFailed: if the account doesn't exist or isn't in the
+        expected state.
+
     """
+    role_ids = list(role_ids)
+    async with request.app['pool'].acquire() as conn:
+        log_id = await conn.fetchval(
+            _UPDATE_ACCOUNT,
+            role_ids=role_ids,
+            account_id=account_id,
+            expected_log_id=expected_log_id,
+            created_by='p.van.beek@amsterdam.nl',
+            request_info=json.dumps(audit.request_info(request))
+        )
+    if log_id is None:
+        raise PreconditionFailed()
+    _update_mirror(request, account_id, role_ids, log_id)
+    return log_id
 
-    Raises:
-        PreconditionFailed: if the account doesn't exist or isn't in the
-            expected state.
+
+async def create_account(request, account_id: str, role_ids: T.Iterable[str]) -> int:
+    # language=rst
+    """Creates an account.
+
+    :returns: the log id of the new account.
+    :raises PreconditionFailed: if the account already exists.
 
     """
-    account_data = await account.data()
-    accountroles = metadata().tables['AccountRoles']
-    async with request.app['engine'].acquire() as conn:
-        async with conn.begin():
-            log_id = await _accountroleslog_insert(
-                conn,
+    role_ids = list(role_ids)
+    async with request.app['pool'].acquire() as conn:
+        try:
+            log_id = await conn.fetchval(
+                _CREATE_ACCOUNT,
                 created_by='p.van.beek@amsterdam.nl',
-                request_info=str(request.headers),
-                account_id=account['account'],
-                action='U',
+                request_info=json.dumps(audit.request_info(request)),
+                account_id=account_id,
                 role_ids=role_ids
             )
-            result_set = await conn.execute(
-                accountroles.update().where(sa.and_(
-                    accountroles.c.account_id == account['account'],
-                    accountroles.c.log_id == account_data['log_id']
-                )).values(
-                    role_ids=role_ids,
-                    log_id=log_id
-                )
-            )
-            if result_set.rowcount != 1:
-                raise PreconditionFailed()
+        except backends.IntegrityError:
+            raise PreconditionFailed() from None
+    _update_mirror(request, account_id, role_ids, log_id)
     return log_id
 
 
-async def create_account(request, account_id, role_ids):
+_IMPORT_CREATE_STAGING_TABLE = Statement('''
+CREATE TEMPORARY TABLE account_import (
+    line integer NOT NULL,
+    account_id varchar NOT NULL,
+    role_ids varchar(32)[] NOT NULL,
+    conflict varchar
+) ON COMMIT DROP
+''')
+
+_IMPORT_STAGE = Statement('''
+INSERT INTO account_import (line, account_id, role_ids)
+SELECT line, account_id, string_to_array(role_ids, ',')
+  FROM json_to_recordset(CAST(:rows AS json))
+    AS r(line integer, account_id varchar, role_ids varchar)
+''', rows='json')
+
+_IMPORT_LOCK = Statement('LOCK TABLE "AccountRoles" IN SHARE ROW EXCLUSIVE MODE')
+
+_IMPORT_MARK_EXISTING = Statement('''
+UPDATE account_import s
+   SET conflict = 'exists'
+  FROM "AccountRoles" a
+ WHERE a.account_id = s.account_id
+''')
+
+_IMPORT_MARK_DUPLICATES = Statement('''
+UPDATE account_import s
+   SET conflict = 'duplicate'
+  FROM (SELECT line, row_number() OVER (PARTITION BY account_id ORDER BY line) AS n
+          FROM account_import) d
+ WHERE d.line = s.line AND d.n > 1 AND s.conflict IS NULL
+''')
+
+_IMPORT_CONFLICTS = Statement('''
+SELECT line, account_id, conflict
+  FROM account_import
+ WHERE conflict IS NOT NULL
+ ORDER BY line
+''')
+
+_IMPORT_INSERT = Statement('''
+WITH log AS (
+    INSERT INTO "AccountRolesLog" (created_by, request_info, account_id, action, role_ids)
+    SELECT :created_by, CAST(:request_info AS jsonb), account_id, 'C', role_ids
+      FROM account_import
+     WHERE conflict IS NULL
+     ORDER BY line
+    RETURNING id, account_id, role_ids
+)
+INSERT INTO "AccountRoles" (account_id, role_ids, log_id)
+SELECT account_id, role_ids, id FROM log
+RETURNING account_id, role_ids, log_id
+''', created_by='varchar', request_info='jsonb')
+
+
+class ImportRow(T.NamedTuple):
+    line: int
+    account_id: str
+    role_ids: T.Tuple[str, ...]
+
+
+async def _import_accounts(conn, rows: T.Iterable[ImportRow],
+                           created_by: str, request_info: T.Mapping[str, str]):
+    # Must be called within a transaction.
+    await conn.execute(_IMPORT_CREATE_STAGING_TABLE)
+    await conn.execute(_IMPORT_STAGE, rows=json.dumps([
+        {
+            'line': row.line,
+            'account_id': row.account_id,
+            'role_ids': ','.join(row.role_ids)
+        } for row in rows
+    ]))
+    # Keep concurrent writers out until we commit, so that no account can be
+    # created between marking conflicts and inserting:
+    await conn.execute(_IMPORT_LOCK)
+    await conn.execute(_IMPORT_MARK_EXISTING)
+    await conn.execute(_IMPORT_MARK_DUPLICATES)
+    conflicts = [
+        {'line': line, 'account': account_id, 'reason': reason}
+        for line, account_id, reason in await conn.fetch(_IMPORT_CONFLICTS)
+    ]
+    created = await conn.fetch(
+        _IMPORT_INSERT, created_by=created_by, request_info=json.dumps(request_info)
+    )
+    return created, conflicts
+
+
+async def import_accounts(pool: Pool, rows: T.Iterable[ImportRow],
+                          created_by: str, request_info: T.Mapping[str, str],
+                          account_mirror: T.Optional[mirror.AccountRolesMirror]=None):
     # language=rst
+    """Creates many accounts at once.
+
+    All rows are loaded into a temporary staging table in one statement.  Then,
+    in the same transaction, rows for existing accounts and repeated rows for
+    the same account are marked as conflicts, and the audit log entries and
+    account rows for all other rows are inserted set-wise.
+
+    :returns: a tuple ``(created, conflicts)``, where ``created`` is a list of
+        ``AccountRoles`` rows, and ``conflicts`` a list of dicts with keys
+        ``line``, ``account`` and ``reason`` (either ``'exists'`` or
+        ``'duplicate'``), in order of line number.
+
     """
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            created, conflicts = await _import_accounts(conn, rows, created_by, request_info)
+    if account_mirror is not None:
+        for row in created:
+            account_mirror.apply(row['account_id'], row)
+    return created, conflicts
+
+
+_CHANGE_ROLE = '''
+WITH changed AS (
+    UPDATE "AccountRoles"
+       SET role_ids = {new_role_ids},
+           log_id = nextval(pg_get_serial_sequence('"AccountRolesLog"', 'id'))
+     WHERE {where}
+    RETURNING account_id, role_ids, log_id
+), log AS (
+    INSERT INTO "AccountRolesLog" (id, created_by, request_info, account_id, action, role_ids)
+    SELECT log_id, :created_by, CAST(:request_info AS jsonb), account_id, 'U', role_ids
+      FROM changed
+)
+SELECT account_id, role_ids, log_id FROM changed ORDER BY account_id
+'''
+_HAS_ROLE = 'role_ids @> CAST(ARRAY[{}] AS varchar(32)[])'
+
+
+@lru_cache()
+def _change_role_statement(action: str, by_account: bool, by_role: bool) -> Statement:
+    param_types = {'role_id': 'varchar', 'created_by': 'varchar', 'request_info': 'jsonb'}
+    if action == 'add':
+        new_role_ids = 'array_append(role_ids, :role_id)'
+        where = ['NOT ' + _HAS_ROLE.format(':role_id')]
+    else:
+        new_role_ids = 'array_remove(role_ids, :role_id)'
+        where = [_HAS_ROLE.format(':role_id')]
+    if by_account:
+        where.append('account_id = ANY(:account_ids)')
+        param_types['account_ids'] = 'varchar[]'
+    if by_role:
+        where.append(_HAS_ROLE.format(':having_role_id'))
+        param_types['having_role_id'] = 'varchar'
+    return Statement(_CHANGE_ROLE.format(
+        new_role_ids=new_role_ids, where=' AND '.join(where)
+    ), **param_types)
 
-    Raises:
-        PreconditionFailed: if the account already exists.
+
+async def change_role(request, action: str, role_id: str,
+                      account_ids: T.Optional[T.Iterable[str]]=None,
+                      having_role_id: T.Optional[str]=None):
+    # language=rst
+    """Adds a role to, or removes a role from, many accounts at once.
+
+    The selected accounts are updated in a single statement, which also
+    writes one ``AccountRolesLog`` entry per changed account.  Accounts that
+    already are in the requested state aren't touched.
+
+    :param action: either ``'add'`` or ``'remove'``.
+    :param account_ids: if given, only these accounts are changed.
+    :param having_role_id: if given, only accounts having this role are
+        changed.
+    :returns: the changed ``AccountRoles`` rows, in order of account id.
 
     """
-    accountroles = metadata().tables['AccountRoles']
-    async with request.app['engine'].acquire() as conn:
-        async with conn.begin():
-            log_id = await _accountroleslog_insert(
-                conn,
-                created_by='p.van.beek@amsterdam.nl',
-                request_info=str(request.headers),
-                account_id=account_id,
-                action='C',
-                role_ids=role_ids
-            )
-            try:
-                await conn.execute(
-                    accountroles.insert().values(
-                        account_id=account_id,
-                        role_ids=role_ids,
-                        log_id=log_id
-                    )
-                )
-            except sa_exceptions.IntegrityError:
-                raise PreconditionFailed()
+    assert action in ('add', 'remove')
+    statement = _change_role_statement(
+        action, account_ids is not None, having_role_id is not None
+    )
+    params = {
+        'role_id': role_id,
+        'created_by': 'p.van.beek@amsterdam.nl',
+        'request_info': json.dumps(audit.request_info(request))
+    }
+    if account_ids is not None:
+        params['account_ids'] = list(account_ids)
+    if having_role_id is not None:
+        params['having_role_id'] = having_role_id
+    async with request.app['pool'].acquire() as conn:
+        rows = await conn.fetch(statement, **params)
+    for row in rows:
+        _update_mirror(request, row['account_id'], row['role_ids'], row['log_id'])
+    return rows
 
-    return log_id
+
+INITIALIZATION_LOCK_ID = 0x617a6164
+# language=rst
+"""Key of the Postgres advisory lock held by :func:`initialize_database`."""
+
+_INITIALIZATION_LOCK = Statement('SELECT pg_advisory_xact_lock(:lock_id)', lock_id='bigint')
+
+_EXISTING_ACCOUNTS = Statement(
+    'SELECT account_id FROM "AccountRoles" WHERE account_id = ANY(:account_ids)',
+    account_ids='varchar[]'
+)
 
 
 async def initialize_database(
-    engine,
+    backend: backends.Backend,
     required_accounts: T.Dict[str, T.Iterable[str]]
 ):
     # language=rst
-    """
+    """Creates all missing ``required_accounts``.
 
-    Raises:
-        PreconditionFailed: if a race condition exists between this process and
-            another process trying to initialize the database at the same time.
+    Existing accounts are found with a single query, and missing accounts are
+    created set-wise (see :func:`import_accounts`).  Processes starting at the
+    same time are serialized with a transaction-level advisory lock, so they
+    don't race; existing accounts are never modified.
 
     """
-    accountroles_table = metadata().tables['AccountRoles']
-    async with engine.acquire() as conn:
-        for account_id, role_ids in required_accounts.items():
-            result_proxy = await conn.execute(
-                sa.select([sa_functions.count('*')])
-                    .select_from(accountroles_table)
-                    .where(accountroles_table.c.account_id == account_id)
+    if len(required_accounts) == 0:
+        return
+    async with backend.acquire() as conn:
+        async with conn.transaction():
+            await conn.fetchval(_INITIALIZATION_LOCK, lock_id=INITIALIZATION_LOCK_ID)
+            existing = {
+                row['account_id'] for row in await conn.fetch(
+                    _EXISTING_ACCOUNTS, account_ids=list(required_accounts)
+                )
+            }
+            missing = [
+                ImportRow(line, account_id, tuple(role_ids))
+                for line, (account_id, role_ids) in enumerate(required_accounts.items(), start=1)
+                if account_id not in existing
+            ]
+            if len(missing) == 0:
+                return
+            for row in missing:
+                _logger.info("Required account '%s' not found. Creating this account with roles %s",
+                             row.account_id, repr(row.role_ids))
+            await _import_accounts(
+                conn, missing,
+                created_by='authz_admin_service',
+                request_info=audit.source_info('Initialization')
             )
-            row = await result_proxy.fetchone()
-            if row[0] == 0:
-                _logger.info("Required account '%s' not found. Creating this account with roles %s", account_id, repr(role_ids))
-                async with conn.begin():
-                    log_id = await _accountroleslog_insert(
-                        conn,
-                        created_by='authz_admin_service',
-                        request_info='Initialization',
-                        account_id=account_id,
-                        action='C',
-                        role_ids=role_ids
-                    )
-                    try:
-                        await conn.execute(
-                            accountroles_table.insert().values(
-                                account_id=account_id,
-                                role_ids=role_ids,
-                                log_id=log_id
-                            )
-                        )
-                    except sa_exceptions.IntegrityError:
-                        raise PreconditionFailed() from None
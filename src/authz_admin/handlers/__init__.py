@@ -1,6 +1,11 @@
-from ._accounts import Account, Accounts
+from ._accounts import Account, Accounts, AccountScopes
 #from ._authorization import authorization
+from ._decisions import AuthorizationDecisions
+from ._imports import AccountImports
+from ._log import LogEntries, LogEntry
 from ._profiles import Profiles, Profile
+from ._role_changes import RoleChanges
 from ._roles import Role, Roles
 from ._root import Root
 from ._scopes import Datasets, Dataset, Scope
+from ._statistics import Statistics
@@ -1,27 +1,179 @@
+import datetime
 import logging
 import re
 from json import loads as json_loads
+import typing as T
 
 from aiohttp import web
 
 from authz_admin import database, view, authorization
-from rest_utils import etag_from_int, assert_preconditions
+from rest_utils import etag_from_int, int_from_etag, assert_preconditions, VALID_ETAG_PATTERN
 from . import _roles
 
 _logger = logging.getLogger(__name__)
 
 
+MAX_PAGE_SIZE = 1000
+_DATETIME_FORMATS = ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def parse_datetime(value: str) -> T.Optional[datetime.datetime]:
+    # language=rst
+    """Parses a date or date-time query parameter, like ``2017-12-31T23:59:59``.
+
+    :returns: ``None`` on syntax errors.
+
+    """
+    for datetime_format in _DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, datetime_format)
+        except ValueError:
+            pass
+    return None
+
+
+def as_of_param(v: view.OAuth2View) -> T.Optional[database.AsOf]:
+    # language=rst
+    """The validated ``as_of`` query parameter of ``v``: a log id or a date-time.
+
+    :raises: :ref:`HTTPBadRequest <aiohttp-web-exceptions>` on syntax errors.
+
+    """
+    value = v.query.get('as_of')
+    if value is None:
+        return None
+    if re.fullmatch(r'\d{1,18}', value):
+        return int(value)
+    result = parse_datetime(value)
+    if result is None:
+        raise web.HTTPBadRequest(
+            text="Query parameter 'as_of' must be a log id, a date or a date-time, "
+                 "like 2017-12-31T23:59:59."
+        )
+    return result
+
+
+def _pagination_params(v: view.OAuth2View):
+    # language=rst
+    """The validated ``limit``, ``after`` and ``before`` query parameters of ``v``.
+
+    :raises: :ref:`HTTPBadRequest <aiohttp-web-exceptions>` on syntax errors.
+
+    """
+    limit = v.query.get('limit')
+    if limit is not None:
+        if not re.fullmatch(r'[1-9]\d{0,5}', limit) or int(limit) > MAX_PAGE_SIZE:
+            raise web.HTTPBadRequest(
+                text="Query parameter 'limit' must be an integer between 1 and %d." % MAX_PAGE_SIZE
+            )
+        limit = int(limit)
+    after = v.query.get('after')
+    before = v.query.get('before')
+    if after is not None and before is not None:
+        raise web.HTTPBadRequest(
+            text="Query parameters 'after' and 'before' are mutually exclusive."
+        )
+    return limit, after, before
+
+
+async def account_page(v: view.OAuth2View, role_ids, embed):
+    # language=rst
+    """One page of accounts, for collections with keyset pagination.
+
+    :returns: a tuple ``(accounts, links)``, where ``accounts`` is a list of
+        :class:`Account` views, and ``links`` a dict with HAL ``next`` and/or
+        ``prev`` link objects.  Without a ``limit`` query parameter,
+        ``accounts`` is an asynchronous generator that streams *all* matching
+        accounts (see :func:`authz_admin.database.stream_accounts`), and
+        ``links`` is empty.  With an ``as_of`` query parameter, the accounts
+        are those at that point in time.
+
+    """
+    limit, after, before = _pagination_params(v)
+    as_of = as_of_param(v)
+    if limit is None and after is None and before is None:
+        return _stream_accounts(v.request, role_ids, embed, as_of), {}
+    rows = [
+        row async for row in database.accounts(
+            v.request, role_ids, after=after, before=before,
+            limit=limit + 1 if limit is not None else None,
+            as_of=as_of
+        )
+    ]
+    links = {}
+    if limit is None:
+        return [account_view(v.request, row, embed) for row in rows], links
+    has_more = len(rows) > limit
+    if before is not None:
+        rows = rows[1:] if has_more else rows
+        has_next, has_prev = True, has_more
+    else:
+        rows = rows[:limit]
+        has_next, has_prev = has_more, after is not None
+    url = v.canonical_rel_url
+    query = {
+        key: value for key, value in url.query.items()
+        if key not in ('after', 'before')
+    }
+    if has_next and len(rows) > 0:
+        links['next'] = {'href': str(url.with_query(dict(query, after=rows[-1]['account_id'])))}
+    if has_prev and len(rows) > 0:
+        links['prev'] = {'href': str(url.with_query(dict(query, before=rows[0]['account_id'])))}
+    return [account_view(v.request, row, embed) for row in rows], links
+
+
+async def _stream_accounts(request, role_ids, embed, as_of):
+    async for row in database.stream_accounts(request, role_ids, as_of=as_of):
+        yield account_view(request, row, embed)
+
+
+def _expected_log_id(request) -> T.Optional[int]:
+    # language=rst
+    """The log id in the request's ``If-Match`` header, if it holds exactly one account ETag.
+
+    Account ETags encode the log id of the account's latest change, so with
+    this log id a write can check the precondition in the same statement
+    that changes the account, without reading the account first.
+
+    """
+    if_match = ','.join(request.headers.getall('If-Match', ())).strip()
+    if not re.fullmatch(r'"[^"]*"', if_match) or not VALID_ETAG_PATTERN.fullmatch(if_match):
+        return None
+    return int_from_etag(if_match)
+
+
+def account_view(request, row, embed):
+    # language=rst
+    """The :class:`Account` view of ``row``, an ``AccountRoles`` record."""
+    return Account(
+        request,
+        {'account': row['account_id']},
+        embed,
+        data=row
+    )
+
+
 class Accounts(view.OAuth2View):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.__cached_accounts = None
+        self.__cached_page = None
+        self.__etag = None
 
     @property
     def link_title(self):
         return "ADW accounts"
 
-    async def accounts(self):
+    async def etag(self):
+        if self.__etag is None:
+            self.__etag = etag_from_int(
+                await database.accounts_version(
+                    self.request, mirrored='as_of' not in self.query
+                )
+            )
+        return self.__etag
+
+    def role_ids(self):
         role_ids = self.request.query.get('roles')
         if role_ids is not None:
             role_ids = role_ids.split(',')
@@ -30,20 +182,21 @@ class Accounts(view.OAuth2View):
                     raise web.HTTPBadRequest(
                         text="Syntax error in query parameter 'roles'."
                     )
-        if self.__cached_accounts is None:
-            self.__cached_accounts = list([
-                Account(
-                    self.request,
-                    {'account': row['account_id']},
-                    self.embed.get('item'),
-                    data=row
-                )
-                async for row in database.accounts(self.request, role_ids)
-            ])
-        return self.__cached_accounts
+        return role_ids
+
+    async def accounts(self):
+        # The page may contain an asynchronous generator, which can be consumed
+        # only once.  That's fine: :meth:`rest_utils.View.links` and
+        # :meth:`rest_utils.View.embedded` never both consume the same key.
+        if self.__cached_page is None:
+            self.__cached_page = await account_page(
+                self, self.role_ids(), self.embed.get('item')
+            )
+        return self.__cached_page
 
     async def _links(self):
-        return {'item': await self.accounts()}
+        accounts, links = await self.accounts()
+        return dict(links, item=accounts)
 
 
 class Account(view.OAuth2View):
@@ -54,7 +207,9 @@ class Account(view.OAuth2View):
 
     async def data(self):
         if self._data is False:
-            self._data = await database.account(self.request, self['account'])
+            self._data = await database.account(
+                self.request, self['account'], as_of=as_of_param(self)
+            )
         return self._data
 
     @property
@@ -83,13 +238,20 @@ class Account(view.OAuth2View):
             ]
         }
 
+    def _assert_present(self):
+        if 'as_of' in self.query:
+            raise web.HTTPBadRequest(text="Past states of an account can't be changed.")
+
     @authorization.authorize()
     async def put(self):
+        self._assert_present()
         if_match = self.request.headers.get('if-match', '')
         if_none_match = self.request.headers.get('if-none-match', '')
         if if_match == '' and if_none_match == '':
             raise web.HTTPPreconditionRequired()
-        assert_preconditions(self.request, await self.etag())
+        expected_log_id = _expected_log_id(self.request)
+        if expected_log_id is None:
+            assert_preconditions(self.request, await self.etag())
         if not re.match(r'application/(?:hal\+)?json(?:$|;)',
                         self.request.content_type):
             raise web.HTTPUnsupportedMediaType()
@@ -117,7 +279,7 @@ class Account(view.OAuth2View):
                 text="Not all roles are valid HALJSON link objects to an existing role."
             ) from None
 
-        if await self.data() is None:
+        if expected_log_id is None and await self.data() is None:
             try:
                 log_id = await database.create_account(self.request, self['account'], new_roles)
             except database.PreconditionFailed:
@@ -128,23 +290,88 @@ class Account(view.OAuth2View):
                 'ETag': etag_from_int(log_id)
             }
         else:
+            if expected_log_id is None:
+                expected_log_id = (await self.data())['log_id']
             try:
-                log_id = await database.update_account(self.request, self, new_roles)
+                log_id = await database.update_account(
+                    self.request, self['account'], new_roles, expected_log_id
+                )
             except database.PreconditionFailed:
-                raise web.HTTPPreconditionFailed() from None
+                raise await self._precondition_failed() from None
             status = 204
             headers = {'ETag': etag_from_int(log_id)}
         return web.Response(status=status, headers=headers)
 
     @authorization.authorize()
     async def delete(self) -> web.Response:
-        assert_preconditions(
-            self.request,
-            await self.etag(),
-            require_if_match=True
-        )
+        self._assert_present()
+        expected_log_id = _expected_log_id(self.request)
+        if expected_log_id is None:
+            assert_preconditions(
+                self.request,
+                await self.etag(),
+                require_if_match=True
+            )
+            expected_log_id = (await self.data())['log_id']
         try:
-            await database.delete_account(self.request, self)
+            await database.delete_account(self.request, self['account'], expected_log_id)
         except database.PreconditionFailed:
-            raise web.HTTPPreconditionFailed() from None
+            raise await self._precondition_failed() from None
         return web.Response(status=204)
+
+    async def _precondition_failed(self) -> web.HTTPException:
+        # Only on this (rare) path do we read the account, to tell a missing
+        # account from one that has changed, like assert_preconditions() does.
+        self._data = False
+        if await self.data() is None:
+            return web.HTTPNotFound()
+        return web.HTTPPreconditionFailed()
+
+
+class AccountScopes(view.OAuth2View):
+    # language=rst
+    """All scopes an account has, through its roles and their profiles.
+
+    Intended for the token issuer, which needs this information on every
+    login.  The ETag of this resource is the ETag of the account, so clients
+    can revalidate cheaply.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._data = False
+
+    async def data(self):
+        if self._data is False:
+            self._data = await database.account(self.request, self['account'])
+        return self._data
+
+    @property
+    def link_title(self):
+        return "Scopes van ADW account <%s>" % self['account']
+
+    async def etag(self):
+        data = await self.data()
+        if data is None:
+            return None
+        return etag_from_int(data['log_id'])
+
+    async def attributes(self):
+        data = await self.data()
+        role_scopes = self.request.app['role_scopes']
+        scopes = set()
+        for role_id in data['role_ids']:
+            scopes |= role_scopes.get(role_id, frozenset())
+        return {'scopes': sorted(scopes)}
+
+    async def _links(self):
+        data = await self.data()
+        return {
+            'account': Account(
+                self.request,
+                {'account': self['account']},
+                self.embed.get('account'),
+                data=data
+            )
+        }
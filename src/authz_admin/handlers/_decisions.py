@@ -0,0 +1,74 @@
+import logging
+import re
+from json import loads as json_loads
+
+from aiohttp import web
+
+import rest_utils
+from authz_admin import database, view, authorization
+
+_logger = logging.getLogger(__name__)
+
+
+MAX_DECISION_PAIRS = 50000
+
+
+class AuthorizationDecisions(view.OAuth2View):
+    # language=rst
+    """Batch authorization decisions for downstream services.
+
+    Clients ``POST`` a JSON array of ``[account, scope]`` pairs, and get a JSON
+    object with a ``decisions`` array of booleans, in the same order.  All
+    accounts are fetched in a single query, and resolved to scopes through
+    the role→scope index built from the configuration.
+
+    """
+
+    @property
+    def link_title(self):
+        return "Autorisatiebeslissingen"
+
+    async def _pairs(self):
+        if not re.match(r'application/(?:hal\+)?json(?:$|;)',
+                        self.request.content_type):
+            raise web.HTTPUnsupportedMediaType()
+        try:
+            pairs = json_loads(await self.request.text())
+            assert isinstance(pairs, list)
+            assert len(pairs) <= MAX_DECISION_PAIRS
+            for pair in pairs:
+                assert isinstance(pair, list) and len(pair) == 2
+                assert isinstance(pair[0], str) and isinstance(pair[1], str)
+        except Exception:
+            raise web.HTTPBadRequest(
+                text="Request body must be an array of at most %d [account, scope] pairs." % MAX_DECISION_PAIRS
+            ) from None
+        return pairs
+
+    @authorization.authorize()
+    async def post(self) -> web.StreamResponse:
+        pairs = await self._pairs()
+        account_ids = {account_id for account_id, _ in pairs}
+        role_scopes = self.request.app['role_scopes']
+        account_scopes = {}
+        if len(account_ids) > 0:
+            async for row in database.accounts(self.request, account_ids=account_ids):
+                scopes = set()
+                for role_id in row['role_ids']:
+                    scopes |= role_scopes.get(role_id, frozenset())
+                account_scopes[row['account_id']] = scopes
+        no_scopes = frozenset()
+        decisions = (
+            scope in account_scopes.get(account_id, no_scopes)
+            for account_id, scope in pairs
+        )
+        response = web.StreamResponse()
+        response.content_type = 'application/json'
+        response.charset = 'utf-8'
+        response.enable_compression()
+        await response.prepare(self.request)
+        async for chunk in rest_utils.json_encode({'decisions': decisions}):
+            response.write(chunk)
+            await response.drain()
+        await response.write_eof()
+        return response
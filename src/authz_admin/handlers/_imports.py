@@ -0,0 +1,60 @@
+import logging
+
+from aiohttp import web
+
+from authz_admin import account_import, audit, database, view, authorization
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountImports(view.OAuth2View):
+    # language=rst
+    """Bulk import of accounts.
+
+    Clients ``POST`` NDJSON or CSV, as described in
+    :mod:`authz_admin.account_import`, and get a JSON object with the number of
+    ``created`` accounts and a list of ``conflicts``.  Nothing is written if
+    the request body contains syntax errors or unknown roles.
+
+    """
+
+    @property
+    def link_title(self):
+        return "Bulkimport van ADW accounts"
+
+    async def _rows(self):
+        parse = account_import.PARSERS.get(self.request.content_type)
+        if parse is None:
+            raise web.HTTPUnsupportedMediaType(
+                text="Expected one of: %s" % ', '.join(account_import.PARSERS)
+            )
+        lines = []
+        try:
+            async for line in self.request.content:
+                lines.append(line.decode('utf-8'))
+                if len(lines) > account_import.MAX_IMPORT_ROWS + 1:
+                    raise web.HTTPRequestEntityTooLarge()
+        except UnicodeDecodeError:
+            raise web.HTTPBadRequest(text="Request body must be UTF-8.") from None
+        existing_roles = self.request.app['config']['authz_admin']['roles']
+        try:
+            rows = parse(lines)
+            account_import.validate(rows, existing_roles)
+        except account_import.InvalidImport as e:
+            raise web.HTTPBadRequest(text=str(e)) from None
+        return rows
+
+    @authorization.authorize()
+    async def post(self) -> web.Response:
+        rows = await self._rows()
+        created, conflicts = await database.import_accounts(
+            self.request.app['pool'], rows,
+            created_by='p.van.beek@amsterdam.nl',
+            request_info=audit.request_info(self.request),
+            account_mirror=self.request.app.get('mirror')
+        )
+        _logger.info("Imported %d accounts, with %d conflicts.", len(created), len(conflicts))
+        return web.json_response({
+            'created': len(created),
+            'conflicts': conflicts
+        })
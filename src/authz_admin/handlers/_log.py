@@ -0,0 +1,210 @@
+import logging
+import re
+from json import dumps as json_dumps
+
+from aiohttp import web
+
+from authz_admin import database, view, authorization
+from rest_utils import assert_preconditions, etag_from_int, NDJSON_CONTENT_TYPE, BEST_CONTENT_TYPE
+from . import _accounts, _roles
+
+_logger = logging.getLogger(__name__)
+
+
+DEFAULT_LOG_PAGE_SIZE = 100
+MAX_LOG_PAGE_SIZE = 1000
+_ACTIONS = {'C', 'U', 'D'}
+
+
+def _datetime_param(query, name):
+    value = query.get(name)
+    if value is None:
+        return None
+    result = _accounts.parse_datetime(value)
+    if result is None:
+        raise web.HTTPBadRequest(
+            text="Query parameter '%s' must be a date or date-time, like 2017-12-31T23:59:59." % name
+        )
+    return result
+
+
+def _int_param(query, name, maximum):
+    value = query.get(name)
+    if value is None:
+        return None
+    if not re.fullmatch(r'\d{1,18}', value) or int(value) > maximum:
+        raise web.HTTPBadRequest(
+            text="Query parameter '%s' must be an integer between 0 and %d." % (name, maximum)
+        )
+    return int(value)
+
+
+def _record(row):
+    # language=rst
+    """The plain JSON record for a log entry, as used in NDJSON output."""
+    return {
+        'id': row['id'],
+        'created_at': row['created_at'].isoformat(),
+        'created_by': row['created_by'],
+        'request_info': row['request_info'],
+        'account': row['account_id'],
+        'action': row['action'],
+        'roles': list(row['role_ids'])
+    }
+
+
+class LogEntries(view.OAuth2View):
+    # language=rst
+    """The audit log of all changes to accounts.
+
+    Supports the query parameters ``account``, ``created_by``, ``action``,
+    ``role``, ``since`` and ``until`` to filter entries, and ``after`` and
+    ``limit`` for keyset pagination on the entry id.  Clients that accept
+    ``application/x-ndjson`` get *all* matching entries (or at most ``limit``),
+    streamed as one JSON record per line.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__etag = None
+        self.__cached_links = None
+
+    @property
+    def link_title(self):
+        return "Auditlog"
+
+    async def etag(self):
+        # Log entries are never modified, so the latest id identifies the
+        # state of every view of the log:
+        if self.__etag is None:
+            self.__etag = etag_from_int(
+                await database.accounts_version(self.request, mirrored=False), weak=True
+            )
+        return self.__etag
+
+    def filters(self):
+        query = self.query
+        action = query.get('action')
+        if action is not None and action not in _ACTIONS:
+            raise web.HTTPBadRequest(
+                text="Query parameter 'action' must be one of C, U or D."
+            )
+        return {
+            'account_id': query.get('account'),
+            'created_by': query.get('created_by'),
+            'action': action,
+            'role_id': query.get('role'),
+            'since': _datetime_param(query, 'since'),
+            'until': _datetime_param(query, 'until'),
+            'after': _int_param(query, 'after', 2**63 - 1)
+        }
+
+    def limit(self, default):
+        limit = _int_param(self.query, 'limit', MAX_LOG_PAGE_SIZE)
+        if limit == 0:
+            raise web.HTTPBadRequest(
+                text="Query parameter 'limit' must be an integer between 1 and %d." % MAX_LOG_PAGE_SIZE
+            )
+        return default if limit is None else limit
+
+    async def _links(self):
+        if self.__cached_links is None:
+            self.__cached_links = await self._page()
+        return self.__cached_links
+
+    async def _page(self):
+        limit = self.limit(DEFAULT_LOG_PAGE_SIZE)
+        rows = [
+            row async for row in database.log_entries(
+                self.request, limit=limit + 1, **self.filters()
+            )
+        ]
+        result = {
+            'item': [
+                LogEntry(self.request, {'entry': str(row['id'])}, self.embed.get('item'), data=row)
+                for row in rows[:limit]
+            ]
+        }
+        if len(rows) > limit:
+            url = self.canonical_rel_url
+            result['next'] = {
+                'href': str(url.update_query(after=str(rows[limit - 1]['id'])))
+            }
+        return result
+
+    @authorization.authorize('GET')
+    async def _authorize(self):
+        pass
+
+    async def get(self) -> web.StreamResponse:
+        if not self.request[BEST_CONTENT_TYPE].startswith(NDJSON_CONTENT_TYPE):
+            return await super().get()
+        await self._authorize()
+        etag = await self.etag()
+        assert_preconditions(self.request, etag)
+        filters = self.filters()
+        limit = self.limit(None)
+        if limit is None:
+            rows = database.stream_log_entries(self.request, **filters)
+        else:
+            rows = database.log_entries(self.request, limit=limit, **filters)
+        response = web.StreamResponse()
+        response.headers.add('ETag', etag)
+        response.content_type = NDJSON_CONTENT_TYPE
+        response.charset = 'utf-8'
+        response.enable_compression()
+        await response.prepare(self.request)
+        if self.request.method == 'GET':
+            async for row in rows:
+                response.write((json_dumps(_record(row)) + '\n').encode())
+                await response.drain()
+        await response.write_eof()
+        return response
+
+
+class LogEntry(view.OAuth2View):
+
+    def __init__(self, *args, data=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not re.fullmatch(r'\d{1,18}', self['entry']):
+            raise web.HTTPNotFound()
+        self._data = data
+
+    async def data(self):
+        if self._data is False:
+            self._data = await database.log_entry(self.request, int(self['entry']))
+        return self._data
+
+    @property
+    def link_title(self):
+        return "Auditlogregel %s" % self['entry']
+
+    async def etag(self):
+        data = await self.data()
+        if data is None:
+            return None
+        return etag_from_int(data['id'])
+
+    async def attributes(self):
+        record = _record(await self.data())
+        del record['account'], record['roles']
+        return record
+
+    async def _links(self):
+        data = await self.data()
+        return {
+            'account': _accounts.Account(
+                self.request,
+                {'account': data['account_id']},
+                self.embed.get('account')
+            ),
+            'role': [
+                _roles.Role(
+                    self.request,
+                    {'role': role_id},
+                    self.embed.get('role')
+                ) for role_id in data['role_ids']
+                if role_id in self.request.app['config']['authz_admin']['roles']
+            ]
+        }
@@ -11,6 +11,8 @@ _logger = logging.getLogger(__name__)
 
 class Profiles(view.OAuth2View):
 
+    CACHEABLE = True
+
     # def __init__(self, *args, **kwargs):
     #     super().__init__(*args, **kwargs)
     #     # TODO: implement
@@ -36,6 +38,8 @@ class Profiles(view.OAuth2View):
 
 class Profile(view.OAuth2View):
 
+    CACHEABLE = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         profiles = self.request.app['config']['authz_admin']['profiles']
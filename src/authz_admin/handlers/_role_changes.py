@@ -0,0 +1,71 @@
+import logging
+import re
+from json import loads as json_loads
+
+from aiohttp import web
+
+from authz_admin import database, view, authorization
+
+_logger = logging.getLogger(__name__)
+
+
+MAX_ROLE_CHANGE_ACCOUNTS = 50000
+
+
+class RoleChanges(view.OAuth2View):
+    # language=rst
+    """Adds a role to, or removes a role from, many accounts at once.
+
+    Clients ``POST`` a JSON object like::
+
+        {"action": "add", "role": "CDE_PLUS", "having_role": "CDE"}
+        {"action": "remove", "role": "CDE_PLUS", "accounts": ["jane.doe@amsterdam.nl"]}
+
+    At least one of ``accounts`` and ``having_role`` is required.  If both are
+    given, only accounts matching both are changed.  See
+    :func:`authz_admin.database.change_role`.
+
+    """
+
+    @property
+    def link_title(self):
+        return "Bulkwijziging van rollen"
+
+    async def _change(self):
+        if not re.match(r'application/(?:hal\+)?json(?:$|;)',
+                        self.request.content_type):
+            raise web.HTTPUnsupportedMediaType()
+        existing_roles = self.request.app['config']['authz_admin']['roles']
+        try:
+            change = json_loads(await self.request.text())
+            assert isinstance(change, dict)
+            assert change.get('action') in ('add', 'remove')
+            assert change.get('role') in existing_roles
+            assert 'accounts' in change or 'having_role' in change
+            if 'accounts' in change:
+                assert isinstance(change['accounts'], list)
+                assert len(change['accounts']) <= MAX_ROLE_CHANGE_ACCOUNTS
+                assert all(isinstance(account_id, str) for account_id in change['accounts'])
+            if 'having_role' in change:
+                assert change['having_role'] in existing_roles
+        except Exception:
+            raise web.HTTPBadRequest(
+                text="Request body must be an object with an 'action' ('add' or "
+                     "'remove'), an existing 'role', and 'accounts' (an array of at "
+                     "most %d account ids) and/or an existing 'having_role'." % MAX_ROLE_CHANGE_ACCOUNTS
+            ) from None
+        return change
+
+    @authorization.authorize()
+    async def post(self) -> web.Response:
+        change = await self._change()
+        rows = await database.change_role(
+            self.request, change['action'], change['role'],
+            account_ids=change.get('accounts'),
+            having_role_id=change.get('having_role')
+        )
+        _logger.info("%s role %s: changed %d accounts.",
+                     change['action'].capitalize(), change['role'], len(rows))
+        return web.json_response({
+            'changed': [row['account_id'] for row in rows]
+        })
@@ -1,17 +1,53 @@
+import asyncio
 import logging
+import typing as T
 
 from aiohttp import web
 from docutils.core import publish_parts
 
-from authz_admin import database
-from authz_admin import view
+from authz_admin import database, view
 from . import _profiles, _accounts
 
 _logger = logging.getLogger(__name__)
 
 
+_ROLE_ACCOUNTS_LOADER = 'authz_admin.handlers.role_accounts_loader'
+
+
+class _RoleAccountsLoader:
+    # language=rst
+    """Request-scoped loader of the accounts of many roles.
+
+    A collection of roles registers all its roles with the loader before they
+    are rendered.  The first :class:`Role` that needs its accounts then
+    fetches the accounts of *all* registered roles, with a single query (see
+    :func:`authz_admin.database.accounts_by_role`), and the others share the
+    result.
+
+    """
+
+    def __init__(self, request, role_ids: T.Iterable[str]):
+        self._request = request
+        self._role_ids = frozenset(role_ids)
+        self._future = None
+
+    def __contains__(self, role_id):
+        return role_id in self._role_ids
+
+    async def accounts(self, role_id: str):
+        if self._future is None:
+            self._future = asyncio.ensure_future(
+                database.accounts_by_role(self._request, self._role_ids)
+            )
+        # Shielded, so that a cancelled render doesn't cancel the query for
+        # all the other roles:
+        return (await asyncio.shield(self._future))[role_id]
+
+
 class Roles(view.OAuth2View):
 
+    CACHEABLE = True
+
     # def __init__(self, *args, **kwargs):
     #     super().__init__(*args, **kwargs)
     #     # TODO: implement
@@ -24,18 +60,22 @@ class Roles(view.OAuth2View):
         return "ADW Rollen"
 
     async def _links(self):
+        role_ids = self.request.app['config']['authz_admin']['roles']
+        if _ROLE_ACCOUNTS_LOADER not in self.request:
+            self.request[_ROLE_ACCOUNTS_LOADER] = _RoleAccountsLoader(self.request, role_ids)
         items = [
             Role(
                 self.request,
                 {'role': name},
                 self.embed.get('item')
             )
-            for name in self.request.app['config']['authz_admin']['roles']
+            for name in role_ids
         ]
         return {'item': items}
 
 
 class Role(view.OAuth2View):
+    # Not cacheable: a role links to its accounts, which live in the database.
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -57,21 +97,28 @@ class Role(view.OAuth2View):
             result['description'] = publish_parts(self._role['description'], writer_name='html')['fragment']
         return result
 
+    async def _accounts(self):
+        loader = self.request.get(_ROLE_ACCOUNTS_LOADER)
+        if loader is not None and self['role'] in loader:
+            embed = self.embed.get('account')
+            return [
+                _accounts.account_view(self.request, row, embed)
+                for row in await loader.accounts(self['role'])
+            ], {}
+        return await _accounts.account_page(
+            self, [self['role']], self.embed.get('account')
+        )
+
     async def _links(self):
-        return {
-            'profile': [
+        accounts, links = await self._accounts()
+        return dict(
+            links,
+            profile=[
                 _profiles.Profile(
                     self.request,
                     {'profile': profile},
                     self.embed.get('profile')
                 ) for profile in self._role['profiles']
             ],
-            'account': [
-                _accounts.Account(
-                    self.request,
-                    {'account': row['account_id']},
-                    self.embed.get('account'),
-                    data=dict(row)
-                ) async for row in database.accounts(self.request, [self['role']])
-            ]
-        }
+            account=accounts
+        )
@@ -10,6 +10,8 @@ _logger = logging.getLogger(__name__)
 
 class Datasets(view.OAuth2View):
 
+    CACHEABLE = True
+
     async def etag(self):
         return self.request.app['etag']
 
@@ -31,6 +33,8 @@ class Datasets(view.OAuth2View):
 
 class Dataset(view.OAuth2View):
 
+    CACHEABLE = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         datasets = self.request.app['config']['authz_admin']['datasets']
@@ -63,6 +67,8 @@ class Dataset(view.OAuth2View):
 
 class Scope(view.OAuth2View):
 
+    CACHEABLE = True
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         datasets = self.request.app['config']['authz_admin']['datasets']
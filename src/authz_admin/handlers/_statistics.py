@@ -0,0 +1,42 @@
+import logging
+
+import rest_utils
+from authz_admin import view
+
+_logger = logging.getLogger(__name__)
+
+
+class Statistics(view.OAuth2View):
+    # language=rst
+    """Live operational statistics of this service instance.
+
+    Includes the state of the database connection pool, so that the pool can
+    be sized against the database server's ``max_connections``, and the
+    hit/miss counters of the access token cache and the response cache.  If
+    the account mirror is enabled, its state is included too, and so is the
+    state of the replica's connection pool if a read replica is configured.
+
+    """
+
+    async def etag(self):
+        return True
+
+    @property
+    def link_title(self):
+        return "Statistieken"
+
+    async def attributes(self):
+        app = self.request.app
+        result = {
+            'database_pool': app['pool'].statistics(),
+            'token_cache': app['token_cache'].statistics(),
+            'response_cache': app[rest_utils.RESPONSE_CACHE].statistics()
+        }
+        if 'replica' in app:
+            result['database_replica_pool'] = dict(
+                app['replica'].pool.statistics(),
+                applied_version=app['replica'].applied_version
+            )
+        if 'mirror' in app:
+            result['account_mirror'] = app['mirror'].statistics()
+        return result
@@ -0,0 +1,246 @@
+# language=rst
+"""
+Maintenance of the monthly partitions of ``AccountRolesLog``.
+
+Meant to be run periodically, for example daily from cron, with the
+``authz_admin_log_partitions`` console script.  Each run:
+
+1.  creates the partitions for the current month and the next
+    ``months_ahead`` months, unless these months are already covered by a
+    partition, like ``AccountRolesLog_legacy``;
+2.  writes the rows of every partition that only holds entries older than
+    ``retention_months`` months to a gzipped CSV file in ``archive_dir``,
+    records the latest entry of each account in it in
+    ``AccountRolesCheckpoint``, and then detaches and drops the partition.
+    Snapshots of accounts (see :func:`authz_admin.database.accounts`) as of
+    any moment after the archived entries remain complete that way.
+
+Both are configured in the ``log_partitions`` subsection of the ``postgres``
+section of the configuration file.
+
+If no partition exists for a month, new entries end up in the default
+partition ``AccountRolesLog_default``.  The partition for such a month can't
+be created anymore, and is skipped with a warning, until the rows have been
+moved by hand.
+
+"""
+
+import argparse
+import datetime
+import gzip
+import logging
+import os
+import os.path
+import re
+import sys
+import typing as T
+
+import psycopg2
+
+from . import backends, config
+
+_logger = logging.getLogger(__name__)
+
+
+DEFAULT_MONTHS_AHEAD = 3
+DEFAULT_RETENTION_MONTHS = 24
+
+_BOUNDS = re.compile(
+    r"FROM \((?:MINVALUE|'(\d{4})-(\d{2})-(\d{2})[^']*')\) TO \('(\d{4})-(\d{2})-(\d{2})"
+)
+
+_PARTITIONS = '''
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+  FROM pg_inherits i
+  JOIN pg_class c ON c.oid = i.inhrelid
+ WHERE i.inhparent = '"AccountRolesLog"'::regclass
+ ORDER BY c.relname
+'''
+
+# Keeps the newest entry of each account, so that partitions may be archived
+# in any order.
+_CHECKPOINT = '''
+INSERT INTO "AccountRolesCheckpoint" (account_id, role_ids, log_id, action, created_at)
+SELECT DISTINCT ON (account_id) account_id, role_ids, id, action, created_at
+  FROM "{}"
+ ORDER BY account_id, id DESC
+    ON CONFLICT (account_id) DO UPDATE
+   SET role_ids = EXCLUDED.role_ids, log_id = EXCLUDED.log_id,
+       action = EXCLUDED.action, created_at = EXCLUDED.created_at
+ WHERE "AccountRolesCheckpoint".log_id < EXCLUDED.log_id
+'''
+
+_DEFAULT_PARTITION_HAS_ENTRIES = '''
+SELECT EXISTS (
+    SELECT 1 FROM "AccountRolesLog_default"
+     WHERE created_at >= %s AND created_at < %s
+)
+'''
+
+
+def _add_months(month: datetime.date, months: int) -> datetime.date:
+    index = month.year * 12 + month.month - 1 + months
+    return datetime.date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_bounds(bound: str) -> T.Optional[T.Tuple[T.Optional[datetime.date], datetime.date]]:
+    # language=rst
+    """The lower and upper bound of a partition, from its ``relpartbound``.
+
+    :param bound: as returned by ``pg_get_expr()``, eg. ``FOR VALUES FROM
+        ('2017-01-01 00:00:00') TO ('2017-02-01 00:00:00')``.
+    :returns: ``None`` for the default partition.  The lower bound is
+        ``None`` if it's ``MINVALUE``.
+
+    """
+    match = _BOUNDS.search(bound)
+    if match is None:
+        return None
+    groups = match.groups()
+    lower = datetime.date(*(int(group) for group in groups[:3])) if groups[0] is not None else None
+    return lower, datetime.date(*(int(group) for group in groups[3:]))
+
+
+def _partitions(cursor) -> T.List[T.Tuple[str, T.Optional[T.Tuple[T.Optional[datetime.date], datetime.date]]]]:
+    cursor.execute(_PARTITIONS)
+    return [(name, _partition_bounds(bound)) for name, bound in cursor.fetchall()]
+
+
+def create_partitions(conn, months_ahead: int, today: datetime.date) -> T.List[str]:
+    # language=rst
+    """Creates the partitions for this month and the next ``months_ahead`` months.
+
+    Months that are already covered by a partition are skipped, and so are
+    months with entries in the default partition.
+
+    :returns: the names of the partitions that cover these months.
+
+    """
+    this_month = today.replace(day=1)
+    result = []
+    with conn.cursor() as cursor:
+        partitions = _partitions(cursor)
+        for i in range(months_ahead + 1):
+            lower = _add_months(this_month, i)
+            upper = _add_months(lower, 1)
+            covering = [
+                name for name, bounds in partitions
+                if bounds is not None
+                and (bounds[0] is None or bounds[0] < upper) and lower < bounds[1]
+            ]
+            if len(covering) > 0:
+                result.extend(name for name in covering if name not in result)
+                continue
+            cursor.execute(_DEFAULT_PARTITION_HAS_ENTRIES, (lower, upper))
+            if cursor.fetchone()[0]:
+                _logger.warning(
+                    "The default partition has entries for %s, so its partition can't "
+                    "be created.  Move these entries by hand.", lower.strftime('%Y-%m')
+                )
+                continue
+            cursor.execute('SELECT "AccountRolesLog_create_partition"(%s)', (lower,))
+            result.append(cursor.fetchone()[0])
+    conn.commit()
+    return result
+
+
+def expired_partitions(conn, retention_months: int, today: datetime.date) -> T.List[str]:
+    # language=rst
+    """Partitions of which all entries are older than ``retention_months`` months."""
+    cutoff = _add_months(today.replace(day=1), -retention_months)
+    result = []
+    with conn.cursor() as cursor:
+        for name, bounds in _partitions(cursor):
+            # The default partition has no bounds.
+            if bounds is not None and bounds[1] <= cutoff:
+                result.append(name)
+    conn.rollback()
+    return result
+
+
+def archive_partition(conn, name: str, archive_dir: str) -> str:
+    # language=rst
+    """Archives the rows of partition ``name``, and then detaches and drops it.
+
+    The rows are written, as CSV with a header line, to
+    :file:`{archive_dir}/{name}.csv.gz`.  Only expired partitions are
+    archived, so nothing is written to the partition anymore, and copying it
+    needs no lock on ``AccountRolesLog``.  Detaching does take an ``ACCESS
+    EXCLUSIVE`` lock on ``AccountRolesLog``, which blocks all reads and
+    writes of the log, so that happens in a separate, short transaction, once
+    the archive file is complete.  In that same transaction, the latest entry
+    of each account in the partition is recorded in
+    ``AccountRolesCheckpoint``.
+
+    :returns: the path of the archive file.
+
+    """
+    path = os.path.join(archive_dir, name + '.csv.gz')
+    partial_path = path + '.partial'
+    try:
+        with conn.cursor() as cursor:
+            with gzip.open(partial_path, 'wt', encoding='utf-8') as archive:
+                cursor.copy_expert('COPY "%s" TO STDOUT WITH (FORMAT csv, HEADER)' % name, archive)
+        conn.commit()
+        os.replace(partial_path, path)
+    except BaseException:
+        conn.rollback()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(_CHECKPOINT.format(name))
+            cursor.execute('ALTER TABLE "AccountRolesLog" DETACH PARTITION "%s"' % name)
+            cursor.execute('DROP TABLE "%s"' % name)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return path
+
+
+def main():
+    # language=rst
+    """The entry point of the ``authz_admin_log_partitions`` console script.
+
+    :returns int: the exit status of the process.
+
+    """
+    parser = argparse.ArgumentParser(
+        description="Creates future partitions of the audit log, and archives expired ones."
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help="Only list the partitions that would be archived."
+    )
+    args = parser.parse_args()
+    dbconf = config.load()['postgres']
+    partconf = dbconf.get('log_partitions', {})
+    months_ahead = partconf.get('months_ahead', DEFAULT_MONTHS_AHEAD)
+    retention_months = partconf.get('retention_months', DEFAULT_RETENTION_MONTHS)
+    archive_dir = partconf.get('archive_dir')
+    today = datetime.date.today()
+    conn = psycopg2.connect(**backends.connection_kwargs(dbconf))
+    try:
+        if not args.dry_run:
+            for name in create_partitions(conn, months_ahead, today):
+                _logger.info("Partition %s exists.", name)
+        expired = expired_partitions(conn, retention_months, today)
+        if len(expired) > 0 and archive_dir is None:
+            _logger.error("Partitions %s have expired, but no archive_dir is configured.",
+                          ', '.join(expired))
+            return 1
+        for name in expired:
+            if args.dry_run:
+                print(name)
+                continue
+            path = archive_partition(conn, name, archive_dir)
+            _logger.info("Archived partition %s to %s.", name, path)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
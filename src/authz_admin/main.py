@@ -9,7 +9,7 @@ from aiohttp import web
 from authorization_django import jwks
 
 import rest_utils
-from . import handlers, database, config, authorization
+from . import handlers, database, config, authorization, routes, prerender
 
 _logger = logging.getLogger(__name__)
 
@@ -20,13 +20,20 @@ def add_routes(base_path: str, router: web.UrlDispatcher):
     handlers.Root.add_to_router(router, base_path + '/')
     handlers.Accounts.add_to_router(router, base_path + '/accounts')
     handlers.Account.add_to_router(router, base_path + '/accounts/{account}')
+    handlers.AccountScopes.add_to_router(router, base_path + '/accounts/{account}/scopes')
+    handlers.AccountImports.add_to_router(router, base_path + '/account_imports')
+    handlers.AuthorizationDecisions.add_to_router(router, base_path + '/authorization_decisions')
     handlers.Datasets.add_to_router(router, base_path + '/datasets')
     handlers.Dataset.add_to_router(router, base_path + '/datasets/{dataset}')
     handlers.Scope.add_to_router(router, base_path + '/datasets/{dataset}/{scope}')
+    handlers.LogEntries.add_to_router(router, base_path + '/log')
+    handlers.LogEntry.add_to_router(router, base_path + '/log/{entry}')
     handlers.Profiles.add_to_router(router, base_path + '/profiles')
     handlers.Profile.add_to_router(router, base_path + '/profiles/{profile}')
+    handlers.RoleChanges.add_to_router(router, base_path + '/role_changes')
     handlers.Roles.add_to_router(router, base_path + '/roles')
     handlers.Role.add_to_router(router, base_path + '/roles/{role}')
+    handlers.Statistics.add_to_router(router, base_path + '/statistics')
 
 
 def build_application() -> web.Application:
@@ -47,9 +54,21 @@ def build_application() -> web.Application:
     )
     app['metadata'] = database.metadata()
     add_routes(app['swagger'].base_path, app.router)
+    app['scope_index'] = config.ScopeIndex(app['config'])
+    app['role_scopes'] = config.role_scopes(app['config'], app['scope_index'])
+    app['routes'] = routes.compile_routes(app['swagger'], app.router, app['scope_index'])
     app.on_startup.append(database.initialize_app)
+    if app['config']['authz_admin'].get('prerender', False):
+        app.on_startup.append(prerender.initialize_app)
     jwks_string = app['config']['authz_admin']['jwks']
     app['jwks'] = jwks.load(jwks_string)
+    app['token_cache'] = authorization.TokenCache()
+    app[rest_utils.RESPONSE_CACHE] = rest_utils.ResponseCache()
+
+    async def on_shutdown(app):
+        _logger.info("Access token cache statistics: %r", app['token_cache'].statistics())
+        _logger.info("Response cache statistics: %r", app[rest_utils.RESPONSE_CACHE].statistics())
+    app.on_shutdown.append(on_shutdown)
     return app
 
 
@@ -0,0 +1,259 @@
+# language=rst
+"""
+In-memory mirror of the ``AccountRoles`` table.
+
+When enabled with ``mirror_accounts: true`` in the ``postgres`` section of the
+configuration, the whole ``AccountRoles`` table is loaded into memory at
+startup.  The mirror is kept current through Postgres ``LISTEN/NOTIFY``: every
+insert into ``AccountRolesLog`` sends a notification on channel
+:data:`CHANNEL` with the log id and the account id as payload (see the Alembic
+migrations ``notify_account_roles_changes`` and
+``notify_account_roles_log_id``), after which the mirror re-reads that
+account.  The highest log id applied so far is the mirror's
+:attr:`~AccountRolesMirror.version`.
+
+For each role, the mirror keeps a bitmap over account *slots*, so that
+filtering accounts by role is a matter of AND-ing a few integers.  The
+account ids are also kept in a sorted list, so that a page of accounts is
+found by bisecting, and costs O(log n) plus the number of candidates tested,
+instead of sorting all accounts.
+
+While the mirror is not :attr:`~AccountRolesMirror.ready`, for example because
+the listening connection was lost, :mod:`authz_admin.database` falls back to
+querying the database.
+
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import operator
+import types
+import typing as T
+
+import aiopg
+
+_logger = logging.getLogger(__name__)
+
+
+CHANNEL = 'account_roles'
+
+_RECONNECT_DELAY = 5.0
+_SELECT_ALL = 'SELECT account_id, role_ids, log_id FROM "AccountRoles"'
+_SELECT_SOME = _SELECT_ALL + ' WHERE account_id = ANY(%(account_ids)s)'
+_SELECT_VERSION = 'SELECT coalesce(max(id), 0) FROM "AccountRolesLog"'
+
+
+def _row(account_id: str, role_ids: T.Iterable[str], log_id: int) -> T.Mapping[str, T.Any]:
+    return types.MappingProxyType({
+        'account_id': account_id,
+        'role_ids': tuple(role_ids),
+        'log_id': log_id
+    })
+
+
+class AccountRolesMirror:
+
+    def __init__(self, connection_kwargs: T.Mapping[str, T.Any]):
+        self._connection_kwargs = connection_kwargs
+        self._task = None
+        self.ready = False
+        # The id of the latest log entry that has been applied; the mirror's
+        # counterpart of :func:`authz_admin.database.accounts_version`.
+        # Changes written through this process are applied before their
+        # notification arrives, so the mirror is never older than this.
+        self.version = 0
+        self._clear()
+
+    def _clear(self):
+        self._rows = {}
+        # All account ids, sorted by code point:
+        self._account_ids = []
+        self._slots = {}
+        self._slot_accounts = []
+        self._free_slots = []
+        self._role_bitmaps = {}
+
+    # ┏━━━━━━━━━━━━━━━━━━━━━┓
+    # ┃ Reading from memory ┃
+    # ┗━━━━━━━━━━━━━━━━━━━━━┛
+
+    def account(self, account_id: str) -> T.Optional[T.Mapping[str, T.Any]]:
+        return self._rows.get(account_id)
+
+    def accounts(self, role_ids: T.Optional[T.Iterable[str]]=None,
+                 account_ids: T.Optional[T.Iterable[str]]=None,
+                 after: T.Optional[str]=None,
+                 before: T.Optional[str]=None,
+                 limit: T.Optional[int]=None) \
+            -> T.List[T.Mapping[str, T.Any]]:
+        # language=rst
+        """Accounts having *all* ``role_ids``, sorted by account id.
+
+        Same semantics as :func:`authz_admin.database.accounts`.  Account ids
+        are compared by code point, like in collation ``"C"`` in Postgres.
+
+        """
+        role_ids = list(role_ids) if role_ids is not None else []
+        bitmap = functools.reduce(
+            operator.and_,
+            (self._role_bitmaps.get(role_id, 0) for role_id in role_ids),
+            -1
+        )
+        if account_ids is not None:
+            candidates = sorted(
+                account_id for account_id in set(account_ids)
+                if account_id in self._rows
+                and (after is None or account_id > after)
+                and (before is None or account_id < before)
+            )
+        else:
+            start = 0 if after is None else bisect.bisect_right(self._account_ids, after)
+            end = len(self._account_ids) if before is None \
+                else bisect.bisect_left(self._account_ids, before)
+            candidates = self._account_ids[start:end]
+        if before is not None and limit is not None:
+            # The last ``limit`` matches, so test candidates from the end:
+            candidates = reversed(candidates)
+        rows = []
+        for account_id in candidates:
+            if limit is not None and len(rows) == limit:
+                break
+            if bitmap == -1 or bitmap >> self._slots[account_id] & 1:
+                rows.append(self._rows[account_id])
+        if before is not None and limit is not None:
+            rows.reverse()
+        return rows
+
+    def statistics(self) -> T.Dict[str, T.Any]:
+        return {
+            'ready': self.ready,
+            'accounts': len(self._rows),
+            'version': self.version,
+            'slots': len(self._slot_accounts)
+        }
+
+    # ┏━━━━━━━━━━━━━━━━━┓
+    # ┃ Updating memory ┃
+    # ┗━━━━━━━━━━━━━━━━━┛
+
+    def _remove(self, account_id: str):
+        row = self._rows.pop(account_id, None)
+        if row is None:
+            return
+        slot = self._slots.pop(account_id)
+        del self._account_ids[bisect.bisect_left(self._account_ids, account_id)]
+        mask = ~(1 << slot)
+        for role_id in row['role_ids']:
+            self._role_bitmaps[role_id] &= mask
+        self._slot_accounts[slot] = None
+        self._free_slots.append(slot)
+
+    def apply(self, account_id: str, row: T.Optional[T.Mapping[str, T.Any]]):
+        # language=rst
+        """Sets the state of one account.
+
+        :param row: the new state of the account, or ``None`` if the account
+            was deleted.  Stale rows (with a ``log_id`` lower than the one
+            already in the mirror) are ignored.
+
+        """
+        current = self._rows.get(account_id)
+        if row is not None and current is not None and row['log_id'] < current['log_id']:
+            return
+        self._remove(account_id)
+        if row is None:
+            return
+        row = _row(row['account_id'], row['role_ids'], row['log_id'])
+        if len(self._free_slots) > 0:
+            slot = self._free_slots.pop()
+            self._slot_accounts[slot] = account_id
+        else:
+            slot = len(self._slot_accounts)
+            self._slot_accounts.append(account_id)
+        self._slots[account_id] = slot
+        self._rows[account_id] = row
+        bisect.insort(self._account_ids, account_id)
+        bit = 1 << slot
+        for role_id in row['role_ids']:
+            self._role_bitmaps[role_id] = self._role_bitmaps.get(role_id, 0) | bit
+
+    # ┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓
+    # ┃ Listening for notifications ┃
+    # ┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛
+
+    async def _load(self, cursor):
+        # The version before the accounts, so that it's never newer than the
+        # accounts loaded.  Changes in between are notified, which bumps it.
+        await cursor.execute(_SELECT_VERSION)
+        version = (await cursor.fetchone())[0]
+        await cursor.execute(_SELECT_ALL)
+        self._clear()
+        for account_id, role_ids, log_id in await cursor.fetchall():
+            self.apply(account_id, _row(account_id, role_ids, log_id))
+        self.version = version
+        _logger.info("Loaded %d accounts into the account mirror.", len(self._rows))
+
+    async def _refresh(self, cursor, account_ids: T.Set[str]):
+        await cursor.execute(_SELECT_SOME, {'account_ids': list(account_ids)})
+        found = set()
+        for account_id, role_ids, log_id in await cursor.fetchall():
+            self.apply(account_id, _row(account_id, role_ids, log_id))
+            found.add(account_id)
+        for account_id in account_ids - found:
+            self.apply(account_id, None)
+
+    async def _listen(self, started: asyncio.Future):
+        async with aiopg.connect(**self._connection_kwargs) as conn:
+            async with conn.cursor() as cursor:
+                # LISTEN before loading, so no change can slip in between:
+                await cursor.execute('LISTEN %s' % CHANNEL)
+                await self._load(cursor)
+                self.ready = True
+                if not started.done():
+                    started.set_result(None)
+                while True:
+                    notifications = [await conn.notifies.get()]
+                    while not conn.notifies.empty():
+                        notifications.append(conn.notifies.get_nowait())
+                    # Payloads are "<log id> <account id>":
+                    payloads = [n.payload.split(' ', 1) for n in notifications]
+                    await self._refresh(cursor, {account_id for _, account_id in payloads})
+                    self.version = max(self.version, *(int(log_id) for log_id, _ in payloads))
+
+    async def _run(self, started: asyncio.Future):
+        while True:
+            try:
+                await self._listen(started)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.ready = False
+                if not started.done():
+                    started.set_exception(e)
+                    return
+                _logger.error("Account mirror lost its database connection; "
+                              "falling back to database queries.", exc_info=e)
+            await asyncio.sleep(_RECONNECT_DELAY)
+
+    async def start(self):
+        # language=rst
+        """Loads the mirror and starts listening for changes.
+
+        Returns as soon as the initial load is complete.
+
+        """
+        started = asyncio.get_event_loop().create_future()
+        self._task = asyncio.ensure_future(self._run(started))
+        await started
+
+    async def stop(self):
+        self.ready = False
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
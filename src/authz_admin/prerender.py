@@ -0,0 +1,148 @@
+# language=rst
+"""
+Pre-rendering of configuration-derived resources at startup.
+
+When enabled with ``prerender: true`` in the ``authz_admin`` section of the
+configuration, every cacheable resource (see :attr:`rest_utils.View.cacheable`)
+that is reachable from :class:`~authz_admin.handlers.Root` is rendered into
+the :class:`~rest_utils.ResponseCache` before the service accepts requests.
+Each resource is rendered once without an ``embed`` parameter, and once for
+each link relation in the ``_embedded`` object of its response schema in
+:file:`openapi.yml`, in each content type.  That way, the first request after
+a deploy is served from the cache, like all later ones.
+
+Not pre-rendered are:
+
+-   resources that require authorization, like ``/roles``, because there's
+    nobody to authorize at startup.  They're cached on the first authorized
+    request instead.
+-   ``embed`` variants that would embed non-cacheable resources, like the
+    roles of a profile, which link to accounts in the database.
+
+"""
+
+import logging
+import time
+import types
+import typing as T
+
+from aiohttp import hdrs, web
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+import rest_utils
+from . import handlers, routes
+
+_logger = logging.getLogger(__name__)
+
+
+_CONTENT_TYPES = ('application/hal+json', 'application/json')
+
+
+class _Request(dict):
+    # language=rst
+    """Stand-in for a :class:`aiohttp.web.Request` that is never answered.
+
+    Views only use its application, method, URL, headers and request-local
+    storage.  :attr:`authz_admin.view.OAuth2View.cacheable` also looks at
+    ``match_info.handler``: the view class the request was routed to, or
+    ``None`` if it wasn't routed to any view, like for embedded resources.
+
+    """
+    method = 'GET'
+    transport = None
+
+    def __init__(self, app: web.Application, rel_url: str, content_type: str,
+                 handler: T.Optional[type]=None):
+        super().__init__()
+        self.app = app
+        self.rel_url = URL(rel_url)
+        self.query = self.rel_url.query
+        self.headers = CIMultiDictProxy(CIMultiDict({hdrs.ACCEPT: content_type}))
+        self.match_info = types.SimpleNamespace(handler=handler)
+        self[rest_utils.BEST_CONTENT_TYPE] = rest_utils.best_content_type(self)
+
+
+def _embedded_relations(specification, schema) -> T.List[str]:
+    # The properties of the ``_embedded`` object in ``schema``, with $refs and
+    # allOfs resolved.
+    if '$ref' in schema:
+        schema = specification['definitions'][schema['$ref'].rsplit('/', 1)[-1]]
+    result = list(
+        schema.get('properties', {}).get('_embedded', {}).get('properties', {})
+    )
+    for subschema in schema.get('allOf', ()):
+        result.extend(_embedded_relations(specification, subschema))
+    return result
+
+
+def _declared_relations(app: web.Application, view: rest_utils.View) -> T.List[str]:
+    swagger = app['swagger']
+    path = routes.route_info(view).path[len(swagger.base_path):]
+    response = swagger.specification['paths'][path]['get']['responses'].get('200', {})
+    return _embedded_relations(swagger.specification, response.get('schema', {}))
+
+
+def _linked_views(value) -> T.List[rest_utils.View]:
+    # The views in ``value``, a value in the result of View._links().
+    if isinstance(value, rest_utils.View):
+        return [value]
+    if isinstance(value, (list, tuple)):
+        return [o for o in value if isinstance(o, rest_utils.View)]
+    return []
+
+
+async def _walk(app: web.Application) -> T.Dict[str, T.Tuple[type, T.List[T.Optional[str]]]]:
+    # language=rst
+    """All pre-renderable resources, by path.
+
+    :returns: for each path, the view class and the values of the ``embed``
+        parameter to render it with.
+
+    """
+    result = {}
+    request = _Request(app, app['swagger'].base_path + '/', _CONTENT_TYPES[0])
+    pending = [handlers.Root(request)]
+    seen = set()
+    while len(pending) > 0:
+        view = pending.pop()
+        links = {
+            relation: _linked_views(value)
+            for relation, value in (await view._links()).items()
+        }
+        if view.cacheable:
+            result[view.rel_url.path] = type(view), [None] + [
+                relation for relation in _declared_relations(app, view)
+                if relation in links and all(v.cacheable for v in links[relation])
+            ]
+        for linked in links.values():
+            for v in linked:
+                if v.cacheable and v.rel_url.path not in seen:
+                    seen.add(v.rel_url.path)
+                    pending.append(v)
+    return result
+
+
+async def initialize_app(app: web.Application):
+    # language=rst
+    """Renders all pre-renderable resources into ``app[rest_utils.RESPONSE_CACHE]``.
+
+    Meant to be appended to ``app.on_startup``.  Failures are logged, but
+    don't prevent the service from starting.
+
+    """
+    start = time.monotonic()
+    count = 0
+    for path, (view_class, embeds) in (await _walk(app)).items():
+        for embed in embeds:
+            rel_url = path if embed is None else '%s?embed=%s' % (path, embed)
+            for content_type in _CONTENT_TYPES:
+                request = _Request(app, rel_url, content_type, view_class)
+                try:
+                    await view_class(request).get()
+                except Exception:
+                    _logger.exception("Couldn't pre-render %s", rel_url)
+                    continue
+                if rest_utils.UNCACHEABLE not in request:
+                    count += 1
+    _logger.info("Pre-rendered %d responses in %.3f seconds.", count, time.monotonic() - start)
@@ -0,0 +1,121 @@
+# language=rst
+"""
+Route table, compiled once from the OpenAPI specification.
+
+For each :class:`rest_utils.View` subclass registered with
+:meth:`~rest_utils.View.add_to_router`, the route table holds the security
+requirements, allowed methods and default query parameters of the matching
+path in :file:`openapi.yml`.  This replaces per-request lookups through
+:meth:`swagger_parser.SwaggerParser.get_path_spec`, which scan all paths in the
+specification.
+
+Example usage::
+
+    from authz_admin import routes
+
+    app['routes'] = routes.compile_routes(app['swagger'], app.router, app['scope_index'])
+    ...
+    route = routes.route_info(some_view)
+    route.operations['get'].security
+
+"""
+
+import logging
+import types
+import typing as T
+
+from aiohttp import web
+
+from .frozen import frozen
+
+_logger = logging.getLogger(__name__)
+
+_HTTP_METHODS = frozenset({'get', 'put', 'post', 'delete', 'patch', 'head', 'options'})
+
+
+class OperationInfo(T.NamedTuple):
+    # Each security requirement maps security scheme names to a bitmask of
+    # required scopes.  See :class:`authz_admin.config.ScopeIndex`.
+    security: T.Optional[T.Tuple[T.Mapping[str, int], ...]]
+    default_query_params: T.Mapping[str, str]
+
+
+class RouteInfo(T.NamedTuple):
+    path: str
+    operations: T.Mapping[str, OperationInfo]
+    allowed_methods: T.Tuple[str, ...]
+
+
+def _swagger_path(resource: web.Resource) -> T.Optional[str]:
+    info = resource.get_info()
+    if 'path' in info:
+        return info['path']
+    return info.get('formatter')
+
+
+def _security(security_requirements, scope_index) -> T.Tuple[T.Mapping[str, int], ...]:
+    return tuple(
+        types.MappingProxyType({
+            scheme: scope_index.mask(scopes or (), implied=False)
+            for scheme, scopes in security_requirement.items()
+        })
+        for security_requirement in security_requirements
+    )
+
+
+def _operation_info(swagger, scope_index, path: str, method: str) -> OperationInfo:
+    relative_path = path[len(swagger.base_path):]
+    operation = swagger.specification['paths'][relative_path][method]
+    parameters = swagger.paths[path][method].get('parameters', {})
+    return OperationInfo(
+        security=_security(operation['security'], scope_index)
+        if 'security' in operation else None,
+        default_query_params=frozen({
+            param: param_info['default']
+            for param, param_info in parameters.items()
+            if 'default' in param_info
+        })
+    )
+
+
+def compile_routes(swagger, router: web.UrlDispatcher, scope_index) -> T.Mapping[type, RouteInfo]:
+    # language=rst
+    """Compiles the route table for all views registered in ``router``.
+
+    :param swagger: a :class:`swagger_parser.SwaggerParser`.
+    :param scope_index: a :class:`authz_admin.config.ScopeIndex`, used to
+        compile the required scopes of each operation into bitmasks.
+    :returns: a read-only mapping from :class:`rest_utils.View` subclasses to
+        :class:`RouteInfo` objects.
+
+    """
+    result = {}
+    for resource in router.resources():
+        view_class = getattr(resource, 'rest_utils_class', None)
+        if view_class is None:
+            continue
+        path = _swagger_path(resource)
+        if path not in swagger.paths:
+            _logger.error("No path %s in swagger specification for %s", path, view_class)
+            continue
+        operations = {
+            method: _operation_info(swagger, scope_index, path, method)
+            for method in swagger.paths[path]
+            if method in _HTTP_METHODS
+        }
+        allowed_methods = [method.upper() for method in operations]
+        if 'get' in operations:
+            allowed_methods.append('HEAD')
+        allowed_methods.append('OPTIONS')
+        result[view_class] = RouteInfo(
+            path=path,
+            operations=types.MappingProxyType(operations),
+            allowed_methods=tuple(allowed_methods)
+        )
+    return types.MappingProxyType(result)
+
+
+def route_info(view) -> T.Optional[RouteInfo]:
+    # language=rst
+    """The :class:`RouteInfo` for ``view``, or ``None`` if there's no such route."""
+    return view.request.app['routes'].get(type(view))
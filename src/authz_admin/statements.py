@@ -0,0 +1,87 @@
+# language=rst
+"""
+SQL statements, independent of the database driver.
+
+All SQL in :mod:`authz_admin.database` is written once, as text with
+``:name`` parameters, in a :class:`Statement` or a :class:`PreparedStatement`.
+Both are converted at import time to Postgres' positional ``$n`` form, with
+each parameter cast to its declared type, and executed by one of the
+:mod:`~authz_admin.backends`.  The casts make sure that every backend binds
+parameters with the declared types: asyncpg otherwise binds each parameter
+with the type that Postgres infers from its context, like ``integer`` for a
+comparison with an ``integer`` column, even if the value doesn't fit.  Nothing is built or
+compiled on the hot path.
+
+Building a SQLAlchemy expression, compiling it, and having Postgres parse
+and plan the resulting SQL costs more than actually executing the small,
+indexed queries of this service.  A :class:`PreparedStatement` is therefore
+prepared on the server the first time it's executed on a connection.  From
+then on, executing it on that connection only binds parameters.
+
+Example::
+
+    _ACCOUNT = PreparedStatement(
+        'account',
+        'SELECT * FROM "AccountRoles" WHERE account_id = :account_id',
+        account_id='varchar'
+    )
+
+    async with request.app['pool'].acquire() as conn:
+        row = await conn.fetchrow(_ACCOUNT, account_id='j.doe@amsterdam.nl')
+
+"""
+
+import logging
+import re
+import typing as T
+
+_logger = logging.getLogger(__name__)
+
+
+_PARAMETER = re.compile(r'(?<![:\w]):(\w+)')
+
+
+class Statement:
+    # language=rst
+    """A SQL statement with named parameters.
+
+    :param sql: the statement, with parameters written as ``:name``.
+    :param param_types: the Postgres type of each parameter, by name.
+
+    """
+    prepared = False
+
+    def __init__(self, sql: str, **param_types: str):
+        self.named_sql = sql
+        self.param_types = param_types
+        self.param_names = tuple(param_types)
+        positions = {
+            param_name: position
+            for position, param_name in enumerate(self.param_names, start=1)
+        }
+
+        def positional(match):
+            assert match.group(1) in positions, \
+                "Undeclared parameter %r in statement %r" % (match.group(1), sql)
+            return '$%d::%s' % (positions[match.group(1)], param_types[match.group(1)])
+
+        self.sql = _PARAMETER.sub(positional, sql)
+
+    def args(self, params: T.Mapping[str, T.Any]) -> T.Tuple:
+        # language=rst
+        """The values of ``params``, in the order of the positional parameters."""
+        return tuple(params[param_name] for param_name in self.param_names)
+
+
+class PreparedStatement(Statement):
+    # language=rst
+    """A :class:`Statement` that is prepared once per database connection.
+
+    :param name: unique name of the statement.
+
+    """
+    prepared = True
+
+    def __init__(self, name: str, sql: str, **param_types: str):
+        super().__init__(sql, **param_types)
+        self.name = 'authz_admin_' + name
@@ -5,7 +5,7 @@ import typing as T
 from aiohttp import web
 
 import rest_utils
-from . import authorization
+from . import authorization, routes
 
 _logger = logging.getLogger(__name__)
 
@@ -24,18 +24,30 @@ class OAuth2View(rest_utils.View, metaclass=abc.ABCMeta):
         method = self.request.method.lower()
         if method == 'head':
             method = 'get'
-        path, path_info = self.request.app['swagger'].get_path_spec(
-            self.rel_url.raw_path,
-            action=method
-        )
-        if path is None:
+        route = routes.route_info(self)
+        if route is None or method not in route.operations:
             _logger.error("Couldn't find swagger info for path %s", str(self.rel_url))
             return {}
-        return dict({
-            param: param_info['default']
-            for param, param_info in path_info.get('parameters', {}).items()
-            if 'default' in param_info
-        })
+        return route.operations[method].default_query_params
+
+    @property
+    def cacheable(self) -> bool:
+        # language=rst
+        """
+
+        See :attr:`rest_utils.View.cacheable`.  A resource that requires
+        authorization is only cacheable as the requested resource, whose
+        authorization is enforced on each cache hit too, and not as an
+        embedded resource in the representation of another one.
+
+        """
+        if not super().cacheable:
+            return False
+        route = routes.route_info(self)
+        if route is None or 'get' not in route.operations:
+            return False
+        return route.operations['get'].security is None or \
+            self.request.match_info.handler is type(self)
 
     @property
     @abc.abstractmethod
@@ -50,21 +62,21 @@ class OAuth2View(rest_utils.View, metaclass=abc.ABCMeta):
 
     async def options(self):
         # language=rst
-        """Dummy implementation.
-
-        .. todo:: Fetch the actual allowed methods from the swagger definition,
-            and return all the operation items for this path in the body.
-
-        """
-
+        """The methods allowed on this resource, according to the swagger definition."""
+        route = routes.route_info(self)
+        allowed_methods = ','.join(route.allowed_methods) if route is not None else 'OPTIONS'
         return web.Response(
-            text='GET,HEAD,OPTIONS,PATCH,POST,PUT',
+            text=allowed_methods,
             status=200,
             headers={
-                'Allow': 'GET,HEAD,OPTIONS,PATCH,POST,PUT'
+                'Allow': allowed_methods
             }
         )
 
     @authorization.authorize('GET')
     async def to_dict(self):
         return await super().to_dict()
+
+    @authorization.authorize('GET')
+    async def _cached_response(self, *args, **kwargs):
+        return await super()._cached_response(*args, **kwargs)
@@ -1,14 +1,16 @@
-from ._best_content_type import best_content_type
+from ._best_content_type import best_content_type, NDJSON_CONTENT_TYPE
 from ._etags import (
     ETagType,
     etag_from_float,
     etag_from_int,
+    int_from_etag,
     ETagGenerator,
     etaggify,
     assert_preconditions,
     VALID_ETAG_PATTERN
 )
 from ._json import (
+    EMBED_CONCURRENCY,
     JSON_DEFAULT_CHUNK_SIZE,
     IM_A_DICT,
     json_encode
@@ -19,6 +21,12 @@ from ._middleware import (
     EMBED,
     middleware
 )
+from ._response_cache import (
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_MAXBYTES,
+    UNCACHEABLE,
+    ResponseCache
+)
 from ._parse_embed import (
     parse_embed,
     MAX_QUERY_DEPTH
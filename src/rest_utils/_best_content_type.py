@@ -9,9 +9,12 @@ _logger = logging.getLogger(__name__)
 # ┃ Content Negotiation ┃
 # ┗━━━━━━━━━━━━━━━━━━━━━┛
 
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
 _AVAILABLE_CONTENT_TYPES = (
     "application/hal+json",
     "application/json",
+    NDJSON_CONTENT_TYPE,
 )
 _HAL_JSON_COMPATIBLE = {
     "application/hal+json",
@@ -43,6 +46,9 @@ def best_content_type(request: web.Request) -> str:
         return "application/hal+json; charset=UTF-8"
     elif "application/json" in mime_types:
         return "application/json; charset=UTF-8"
+    elif NDJSON_CONTENT_TYPE in mime_types:
+        # Only supported by views that override :meth:`rest_utils.View.get`.
+        return NDJSON_CONTENT_TYPE + "; charset=UTF-8"
     else:
         body = ",".join(_AVAILABLE_CONTENT_TYPES).encode('ascii')
         raise web.HTTPNotAcceptable(
@@ -128,6 +128,30 @@ def etag_from_int(value: int, weak=False) -> str:
     )
 
 
+_INT_FORMATS = {struct.calcsize(format): format for format in 'qlhb'}
+
+
+def int_from_etag(etag: str) -> T.Optional[int]:
+    # language=rst
+    """The inverse of :func:`etag_from_int`.
+
+    Returns:
+        The integer encoded in ``etag``, or ``None`` if ``etag`` can't have been
+        created by :func:`etag_from_int`.
+
+    """
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    try:
+        packed = base64.urlsafe_b64decode(etag.strip('"'))
+    except ValueError:
+        return None
+    format = _INT_FORMATS.get(len(packed))
+    if format is None:
+        return None
+    return struct.unpack(format, packed)[0]
+
+
 def etag_from_float(value: float, weak=False) -> str:
     return etaggify(
         base64.urlsafe_b64encode(struct.pack('d', value)).decode(),
@@ -4,22 +4,31 @@ This module defines a method `encode`.
 
 """
 
+import asyncio
 import re
 import logging
 import inspect
 import collections
 import collections.abc
+import typing as T
 
 from yarl import URL
 from aiohttp import web
 
-from . import _view
+from . import _response_cache, _view
 
 _logger = logging.getLogger(__name__)
 
 
 JSON_DEFAULT_CHUNK_SIZE = 1024 * 1024
 IM_A_DICT = {}
+EMBED_CONCURRENCY = 'rest_utils.embed_concurrency'
+# language=rst
+"""Application key of the maximum number of embedded views rendered concurrently per request.
+
+See :func:`json_encode`.
+
+"""
 _INFINITY = float('inf')
 
 _ESCAPE = re.compile(r'[\x00-\x1f\\"\b\f\n\r\t]')
@@ -66,19 +75,97 @@ def _encode_float(o, allow_nan=False):
     return text
 
 
-async def _encode_list(obj, stack):
+async def _to_dict(view):
+    try:
+        return await view.to_dict()
+    except web.HTTPException as e:
+        _logger.error("Unexpected exception", exc_info=e, stack_info=True)
+        # The error may depend on the client, eg. on its authorization:
+        view.request[_response_cache.UNCACHEABLE] = True
+        result = {
+            '_links': {'self': {'href': view.canonical_rel_url}},
+            '_status': e.status_code
+        }
+        if e.text is not None:
+            result['description'] = e.text
+        return result
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class _Prefetcher:
+    # Renders embedded views concurrently, at most ``limit`` at a time per
+    # request.  Views are replaced by their representations; other items are
+    # passed through.  The order of the items is always preserved.
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def _resolve(self, item):
+        if not isinstance(item, _view.View):
+            return item
+        async with self._semaphore:
+            return await _to_dict(item)
+
+    async def gather(self, items: T.List) -> T.List:
+        # language=rst
+        """All ``items``, with the views among them rendered concurrently."""
+        if self.limit <= 1 or not any(isinstance(item, _view.View) for item in items):
+            return items
+        futures = [asyncio.ensure_future(self._resolve(item)) for item in items]
+        try:
+            return await asyncio.gather(*futures)
+        finally:
+            for future in futures:
+                future.cancel()
+
+    async def iterate(self, items):
+        # language=rst
+        """Iterates over ``items``, an iterable or an asynchronous generator.
+
+        Views are rendered at most ``limit`` items ahead of the consumer, so
+        that (possibly long) streams are still consumed lazily.
+
+        """
+        if not inspect.isasyncgen(items):
+            items = _aiter(items)
+        if self.limit <= 1:
+            async for item in items:
+                yield item
+            return
+        pending = collections.deque()
+        try:
+            async for item in items:
+                if len(pending) == 0 and not isinstance(item, _view.View):
+                    yield item
+                    continue
+                pending.append(asyncio.ensure_future(self._resolve(item)))
+                if len(pending) >= self.limit:
+                    yield await pending.popleft()
+            while len(pending) > 0:
+                yield await pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+async def _encode_list(obj, stack, prefetcher):
     if id(obj) in stack:
         raise ValueError("Cannot serialize cyclic data structure.")
     stack.add(id(obj))
     try:
         first = True
-        for item in obj:
+        async for item in prefetcher.iterate(obj):
             if first:
                 yield '['
                 first = False
             else:
                 yield ','
-            async for s in _encode(item, stack):
+            async for s in _encode(item, stack, prefetcher):
                 yield s
         if first:
             yield '[]'
@@ -88,14 +175,14 @@ async def _encode_list(obj, stack):
         stack.remove(id(obj))
 
 
-async def _encode_async_generator(obj, stack):
+async def _encode_async_generator(obj, stack, prefetcher):
     if id(obj) in stack:
         raise ValueError("Cannot serialize cyclic data structure.")
     stack.add(id(obj))
     try:
         first = True
         is_dict = False
-        async for item in obj:
+        async for item in prefetcher.iterate(obj):
             if first:
                 if item is IM_A_DICT:
                     is_dict = True
@@ -109,10 +196,10 @@ async def _encode_async_generator(obj, stack):
                     message = "Dictionary key is not a string: '%r'"
                     raise ValueError(message % repr(item[0]))
                 yield _encode_string(item[0]) + ':'
-                async for s in _encode(item[1], stack):
+                async for s in _encode(item[1], stack, prefetcher):
                     yield s
             else:
-                async for s in _encode(item, stack):
+                async for s in _encode(item, stack, prefetcher):
                     yield s
         if first:
             yield '[]'
@@ -122,13 +209,15 @@ async def _encode_async_generator(obj, stack):
         stack.remove(id(obj))
 
 
-async def _encode_dict(obj, stack):
+async def _encode_dict(obj, stack, prefetcher):
     if id(obj) in stack:
         raise ValueError("Cannot serialize cyclic data structure.")
     stack.add(id(obj))
     try:
         first = True
-        for key, value in obj.items():
+        keys = list(obj.keys())
+        values = await prefetcher.gather([obj[key] for key in keys])
+        for key, value in zip(keys, values):
             if not isinstance(key, str):
                 message = "Dictionary key is not a string: '%r'"
                 raise ValueError(message % repr(key))
@@ -137,7 +226,7 @@ async def _encode_dict(obj, stack):
                 first = False
             else:
                 yield ',' + _encode_string(key) + ':'
-            async for s in _encode(value, stack):
+            async for s in _encode(value, stack, prefetcher):
                 yield s
         if first:
             yield '{}'
@@ -147,27 +236,18 @@ async def _encode_dict(obj, stack):
         stack.remove(id(obj))
 
 
-async def _encode(obj, stack):
+async def _encode(obj, stack, prefetcher):
     """
 
     :param any obj:
     :param set stack:
+    :param _Prefetcher prefetcher:
 
     """
     if isinstance(obj, URL):
         yield _encode_string(str(obj))
     elif isinstance(obj, _view.View):
-        try:
-            obj = await obj.to_dict()
-        except web.HTTPException as e:
-            _logger.error("Unexpected exception", exc_info=e, stack_info=True)
-            obj = {
-                '_links': {'self': {'href': obj.canonical_rel_url}},
-                '_status': e.status_code
-            }
-            if e.text is not None:
-                obj['description'] = e.text
-        async for s in _encode_dict(obj, stack):
+        async for s in _encode_dict(await _to_dict(obj), stack, prefetcher):
             yield s
     elif isinstance(obj, str):
         yield _encode_string(obj)
@@ -182,13 +262,13 @@ async def _encode(obj, stack):
     elif isinstance(obj, int):
         yield str(obj)
     elif isinstance(obj, collections.abc.Mapping):
-        async for s in _encode_dict(obj, stack):
+        async for s in _encode_dict(obj, stack, prefetcher):
             yield s
     elif isinstance(obj, collections.abc.Iterable):
-        async for s in _encode_list(obj, stack):
+        async for s in _encode_list(obj, stack, prefetcher):
             yield s
     elif inspect.isasyncgen(obj):
-        async for s in _encode_async_generator(obj, stack):
+        async for s in _encode_async_generator(obj, stack, prefetcher):
             yield s
     elif hasattr(obj, '__str__'):
         message = "Not sure how to serialize object of class %s:\n" \
@@ -202,16 +282,21 @@ async def _encode(obj, stack):
         yield 'null'
 
 
-async def json_encode(obj, chunk_size=JSON_DEFAULT_CHUNK_SIZE):
+async def json_encode(obj, chunk_size=JSON_DEFAULT_CHUNK_SIZE, concurrency=1):
     """Asynchronous JSON serializer.
 
     :param any obj:
     :param int chunk_size: The size of chunks to be yielded.
+    :param int concurrency: The maximum number of embedded views whose
+        ``to_dict()`` is awaited concurrently.  Views in the same list,
+        dictionary or asynchronous generator are rendered ahead of the
+        encoder, so that their database queries overlap.  The output is the
+        same for any value.
     :rtype: collections.AsyncIterable
 
     """
     buffer = bytearray()
-    async for b in _encode(obj, set()):
+    async for b in _encode(obj, set(), _Prefetcher(concurrency)):
         buffer += b.encode()
         while len(buffer) >= chunk_size:
             yield buffer[:chunk_size]
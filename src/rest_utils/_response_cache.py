@@ -0,0 +1,129 @@
+# language=rst
+"""
+In-process cache of complete, serialized responses.
+
+Some resources only change when the service is reconfigured, ie. their
+:meth:`~rest_utils.View.etag` is the same for all requests.  Rendering them
+means constructing views, collecting HAL links, serializing the result with
+:func:`~rest_utils.json_encode` and compressing it, each time again.  A
+:class:`ResponseCache` in ``app[RESPONSE_CACHE]`` keeps the final response
+bodies of such resources, both uncompressed and gzipped, so that
+:meth:`rest_utils.View.get` can serve them without rendering anything.
+
+Only views whose :attr:`~rest_utils.View.cacheable` property is true are
+served from the cache.  A response is only *stored* if all views that were
+rendered for it, including embedded views, are cacheable; see
+:data:`UNCACHEABLE`.
+
+Example usage::
+
+    app[rest_utils.RESPONSE_CACHE] = rest_utils.ResponseCache()
+    ...
+    app[rest_utils.RESPONSE_CACHE].statistics()
+    >>> {'size': 42, 'bytes': 81920, 'hits': 8312, 'misses': 42}
+
+"""
+
+import collections
+import gzip
+import logging
+import typing as T
+
+from aiohttp import hdrs, web
+
+_logger = logging.getLogger(__name__)
+
+
+RESPONSE_CACHE = 'rest_utils.response_cache'
+# language=rst
+"""Application key of the :class:`ResponseCache`, if any."""
+
+UNCACHEABLE = 'rest_utils.uncacheable'
+# language=rst
+"""Request key, set while rendering a view whose representation mustn't be cached."""
+
+RESPONSE_CACHE_MAXBYTES = 16 * 1024 * 1024
+# language=rst
+"""Default maximum total size of the bodies in a :class:`ResponseCache`."""
+
+_GZIP_COMPRESSLEVEL = 6
+
+
+class CachedResponse(T.NamedTuple):
+    body: bytes
+    # The value of the Content-Encoding header, or None.
+    content_encoding: T.Optional[str]
+
+
+def accepted_encoding(request: web.Request) -> str:
+    # language=rst
+    """``'gzip'`` if the client accepts gzipped responses, ``'identity'`` otherwise."""
+    accept_encoding = request.headers.get(hdrs.ACCEPT_ENCODING, '').lower()
+    return 'gzip' if 'gzip' in accept_encoding else 'identity'
+
+
+class ResponseCache:
+    # language=rst
+    """LRU cache of response bodies, bounded by their total size.
+
+    Keys are tuples of the canonical URL of the resource (which includes the
+    ``embed`` parameter), the content type, the content encoding and the ETag
+    of the resource.  Entries for an ETag that is no longer current are never
+    hit again, and are evicted eventually.
+
+    """
+
+    def __init__(self, maxbytes: int=RESPONSE_CACHE_MAXBYTES):
+        self._maxbytes = maxbytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: T.Tuple) -> T.Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def _put(self, key: T.Tuple, entry: CachedResponse):
+        if len(entry.body) > self._maxbytes:
+            return
+        if key in self._entries:
+            self._bytes -= len(self._entries.pop(key).body)
+        self._entries[key] = entry
+        self._bytes += len(entry.body)
+        while self._bytes > self._maxbytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.body)
+
+    def put(self, key_prefix: T.Tuple, etag, body: bytes, encoding: str) -> CachedResponse:
+        # language=rst
+        """Stores ``body`` in all content encodings.
+
+        :param key_prefix: the canonical URL and content type.
+        :param encoding: the encoding, as returned by
+            :func:`accepted_encoding`, of the entry to return.
+        :returns: the entry for ``encoding``.
+
+        """
+        result = {'identity': CachedResponse(body, None)}
+        compressed = gzip.compress(body, compresslevel=_GZIP_COMPRESSLEVEL)
+        if len(compressed) < len(body):
+            result['gzip'] = CachedResponse(compressed, 'gzip')
+        else:
+            result['gzip'] = result['identity']
+        for key_encoding, entry in result.items():
+            self._put(key_prefix + (key_encoding, etag), entry)
+        return result[encoding]
+
+    def statistics(self) -> T.Dict[str, int]:
+        return {
+            'size': len(self._entries),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -8,7 +8,9 @@ from aiohttp import web
 from multidict import MultiDict
 
 from . import _json
+from ._best_content_type import NDJSON_CONTENT_TYPE
 from ._middleware import BEST_CONTENT_TYPE, ASSERT_PRECONDITIONS
+from ._response_cache import RESPONSE_CACHE, UNCACHEABLE, accepted_encoding
 from ._parse_embed import parse_embed
 from ._etags import assert_preconditions
 
@@ -25,6 +27,13 @@ class View(web.View):
     SEGMENT_RE = re.compile(r'([^/{}]+)/?$')
     PATHS = {}
     PATTERNS = {}
+    CACHEABLE = False
+    # language=rst
+    """Whether the representation of this resource only depends on its URL and ETag.
+
+    See :attr:`cacheable`.
+
+    """
 
     def __init__(
             self, request: web.Request,
@@ -108,6 +117,29 @@ class View(web.View):
         """
         return isinstance(self.aiohttp_resource(), web.PlainResource)
 
+    @property
+    def cacheable(self) -> bool:
+        # language=rst
+        """Whether GET responses for this resource may be served from the :class:`~rest_utils.ResponseCache`.
+
+        This default implementation returns :attr:`CACHEABLE`.  Subclasses
+        that set :attr:`CACHEABLE` must make sure that their representation
+        is the same for all clients, for as long as their ETag doesn't change.
+
+        """
+        return self.CACHEABLE
+
+    @property
+    def embed_concurrency(self) -> int:
+        # language=rst
+        """The maximum number of embedded views rendered concurrently.
+
+        Taken from ``app[EMBED_CONCURRENCY]``, if set.  The default of 1
+        renders embedded views one after the other.
+
+        """
+        return self.request.app.get(_json.EMBED_CONCURRENCY, 1)
+
     @property
     def query(self):
         # language=rst
@@ -305,10 +337,20 @@ class View(web.View):
         assert 'GET_IN_PROGRESS' not in self.request
         self.request['GET_IN_PROGRESS'] = True
 
+        if self.request[BEST_CONTENT_TYPE].startswith(NDJSON_CONTENT_TYPE):
+            raise web.HTTPNotAcceptable(
+                text="Newline delimited JSON isn't available for this resource."
+            )
+
         etag = await self.etag()
         if not etag:
             raise web.HTTPNotFound()
         assert_preconditions(self.request, etag)
+        response_cache = self.request.app.get(RESPONSE_CACHE)
+        if response_cache is not None and self.cacheable:
+            response = await self._cached_response(response_cache, etag)
+            del self.request['GET_IN_PROGRESS']
+            return response
         if self.request.method == 'GET':
             data = await self.to_dict()
         response = web.StreamResponse()
@@ -320,16 +362,54 @@ class View(web.View):
             response.headers.add('Content-Location', str(self.canonical_rel_url))
         await response.prepare(self.request)
         if self.request.method == 'GET':
-            async for chunk in _json.json_encode(data):
+            # Collections may be asynchronous generators all the way down to
+            # the database.  Waiting for the transport to drain after each
+            # chunk keeps memory use bounded for slow clients.
+            async for chunk in _json.json_encode(data, concurrency=self.embed_concurrency):
                 response.write(chunk)
-        response.write_eof()
+                await response.drain()
+        await response.write_eof()
         del self.request['GET_IN_PROGRESS']
         return response
 
+    async def _cached_response(self, response_cache, etag) -> web.Response:
+        # language=rst
+        """The response to a GET or HEAD request, served from ``response_cache`` if possible.
+
+        On a cache miss, the representation is rendered completely before
+        anything is sent, and stored unless a non-cacheable view was rendered
+        along the way.
+
+        """
+        encoding = accepted_encoding(self.request)
+        key_prefix = (str(self.canonical_rel_url), self.request[BEST_CONTENT_TYPE])
+        cached = response_cache.get(key_prefix + (encoding, etag))
+        if cached is None:
+            body = bytearray()
+            async for chunk in _json.json_encode(await self.to_dict(), concurrency=self.embed_concurrency):
+                body += chunk
+            if UNCACHEABLE not in self.request:
+                cached = response_cache.put(key_prefix, etag, bytes(body), encoding)
+        response = web.Response(body=body if cached is None else cached.body)
+        if isinstance(etag, str):
+            response.headers.add('ETag', etag)
+        response.content_type = self.request[BEST_CONTENT_TYPE]
+        if cached is None:
+            response.enable_compression()
+        else:
+            response.headers.add('Vary', 'Accept-Encoding')
+            if cached.content_encoding is not None:
+                response.headers.add('Content-Encoding', cached.content_encoding)
+        if str(self.canonical_rel_url) != str(self.request.rel_url):
+            response.headers.add('Content-Location', str(self.canonical_rel_url))
+        return response
+
     async def head(self):
         return await self.get()
 
     async def to_dict(self):
+        if not self.cacheable:
+            self.request[UNCACHEABLE] = True
         result = await self.attributes()
         if isinstance(await self.etag(), str):
             result['_etag'] = await self.etag()
@@ -2,7 +2,9 @@ import time
 
 import pytest
 import jwt
+import psycopg2
 
+from authz_admin import backends
 from authz_admin.config import load as load_config
 from authz_admin.main import build_application
 
@@ -27,6 +29,15 @@ def aaconfig():
     return load_config()
 
 
+@pytest.fixture()
+def db_connection(aaconfig):
+    # language=rst
+    """Fixture that gives a psycopg2 connection to the (migrated) database."""
+    conn = psycopg2.connect(**backends.connection_kwargs(aaconfig['postgres']))
+    yield conn
+    conn.close()
+
+
 @pytest.fixture(scope='session')
 def api_key(aaconfig) -> str:
     return aaconfig['authz_admin']['api_key']
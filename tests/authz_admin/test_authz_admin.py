@@ -1,6 +1,18 @@
+import asyncio
+import datetime
+import hashlib
 import json
 import re
 
+import pytest
+from aiohttp.test_utils import make_mocked_request
+
+from authz_admin import backends, database, log_partitions, prerender
+from authz_admin.mirror import AccountRolesMirror
+from authz_admin.config import ScopeIndex
+from authz_admin.statements import PreparedStatement
+from rest_utils import etag_from_int, int_from_etag, EMBED_CONCURRENCY, ResponseCache, RESPONSE_CACHE
+
 from .helpers import follow_path
 
 
@@ -47,6 +59,34 @@ async def test_accounts(client, base_path, access_token, api_key):
     follow_path(scopes[0], '_links', 'self', 'name')
 
 
+async def test_accounts_pagination(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    resp = await client.get(base_path + '/accounts', headers=authz_headers)
+    assert resp.status == 200
+    etag = follow_path(resp.headers, 'ETag')
+    body = json.loads(await resp.text())
+    all_accounts = [follow_path(item, 'href') for item in follow_path(body, '_links', 'item')]
+    paged_accounts = []
+    url = base_path + '/accounts?limit=1'
+    while url is not None:
+        resp = await client.get(url, headers=authz_headers)
+        assert resp.status == 200
+        body = json.loads(await resp.text())
+        items = follow_path(body, '_links', 'item')
+        assert len(items) <= 1
+        paged_accounts.extend(follow_path(item, 'href') for item in items)
+        url = body['_links'].get('next', {}).get('href')
+    assert paged_accounts == all_accounts
+    resp = await client.get(base_path + '/accounts', headers=dict(
+        authz_headers, **{'If-None-Match': etag}
+    ))
+    assert resp.status == 304
+    resp = await client.get(base_path + '/accounts?limit=0', headers=authz_headers)
+    assert resp.status == 400
+    resp = await client.get(base_path + '/accounts?after=a&before=b', headers=authz_headers)
+    assert resp.status == 400
+
+
 async def test_scopes(client, base_path, access_token):
     authz_headers = {'Authorization': 'Bearer ' + access_token}
     resp = await client.get(base_path + '/datasets?embed=item(item)')
@@ -78,6 +118,38 @@ async def test_scopes(client, base_path, access_token):
     assert len(accounts) > 0
 
 
+async def test_roles_embedded_accounts(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    resp = await client.get(base_path + '/roles?embed=item(account)', headers=authz_headers)
+    assert resp.status == 200
+    body = json.loads(await resp.text())
+    roles = follow_path(body, '_embedded', 'item')
+    assert len(roles) > 0
+    for role in roles:
+        resp = await client.get(follow_path(role, '_links', 'self', 'href'), headers=authz_headers)
+        assert resp.status == 200
+        role_body = json.loads(await resp.text())
+        assert [
+            follow_path(account, '_links', 'self', 'href')
+            for account in follow_path(role, '_embedded', 'account')
+        ] == [
+            follow_path(account, 'href')
+            for account in follow_path(role_body, '_links', 'account')
+        ]
+
+
+async def test_embed_concurrency(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    url = base_path + '/?embed=accounts(item),roles(item(account))'
+    bodies = []
+    for concurrency in (1, 8):
+        client.server.app[EMBED_CONCURRENCY] = concurrency
+        resp = await client.get(url, headers=authz_headers)
+        assert resp.status == 200
+        bodies.append(await resp.text())
+    assert bodies[0] == bodies[1]
+
+
 async def test_account_methods(client, base_path, access_token):
     authz_headers = {'Authorization': 'Bearer ' + access_token}
     url = base_path + '/accounts/pytest_test_account@amsterdam.nl'
@@ -142,6 +214,172 @@ async def test_account_methods(client, base_path, access_token):
         'If-Match': new_etag
     })
     assert resp.status == 204
+    resp = await client.put(url, json=data, headers={
+        'Authorization': 'Bearer ' + access_token,
+        'If-Match': new_etag
+    })
+    assert resp.status == 404
+    # Past states of the account, reconstructed from the log:
+    for as_of_etag, num_roles in ((etag, 2), (new_etag, 1)):
+        resp = await client.get(url, params={'as_of': int_from_etag(as_of_etag)}, headers=authz_headers)
+        assert resp.status == 200
+        body = json.loads(await resp.text())
+        assert len(follow_path(body, '_links', 'role')) == num_roles
+    resp = await client.get(url, params={'as_of': '2000-01-01'}, headers=authz_headers)
+    assert resp.status == 404
+    resp = await client.get(url, params={'as_of': 10 ** 17}, headers=authz_headers)
+    assert resp.status == 404
+    resp = await client.get(url, params={'as_of': 'yesterday'}, headers=authz_headers)
+    assert resp.status == 400
+    resp = await client.delete(url, params={'as_of': int_from_etag(new_etag)}, headers={
+        'Authorization': 'Bearer ' + access_token,
+        'If-Match': new_etag
+    })
+    assert resp.status == 400
+
+
+async def test_account_checkpoint(client, base_path, access_token, db_connection):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    url = base_path + '/accounts/archived@example.com'
+    # As if the log partition with this account's last entry had been archived:
+    with db_connection.cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO "AccountRolesCheckpoint" (account_id, role_ids, log_id, action, created_at)
+            SELECT 'archived@example.com', ARRAY['DPB'], max(id), 'C', now() FROM "AccountRolesLog"
+            RETURNING log_id
+        ''')
+        log_id = cursor.fetchone()[0]
+    db_connection.commit()
+    try:
+        resp = await client.get(url, params={'as_of': log_id}, headers=authz_headers)
+        assert resp.status == 200
+        body = json.loads(await resp.text())
+        assert len(follow_path(body, '_links', 'role')) == 1
+        resp = await client.get(url, params={'as_of': log_id - 1}, headers=authz_headers)
+        assert resp.status == 410
+    finally:
+        with db_connection.cursor() as cursor:
+            cursor.execute('DELETE FROM "AccountRolesCheckpoint" WHERE account_id = %s', ('archived@example.com',))
+        db_connection.commit()
+
+
+async def test_account_imports(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    account_urls = [
+        base_path + '/accounts/pytest_import_%d@amsterdam.nl' % i for i in (1, 2)
+    ]
+    for url in account_urls:
+        resp = await client.get(url, headers=authz_headers)
+        if resp.status == 200:
+            resp = await client.delete(url, headers=dict(
+                authz_headers, **{'If-Match': follow_path(resp.headers, 'ETag')}
+            ))
+            assert resp.status == 204
+    url = base_path + '/account_imports'
+    ndjson = '\n'.join(json.dumps(line) for line in [
+        {'account': 'pytest_import_1@amsterdam.nl', 'roles': ['CDE']},
+        {'account': 'p.van.beek@amsterdam.nl', 'roles': ['CDE']},
+        {'account': 'pytest_import_1@amsterdam.nl', 'roles': []},
+    ])
+    resp = await client.post(url, data=ndjson, headers=dict(
+        authz_headers, **{'Content-Type': 'application/x-ndjson'}
+    ))
+    assert resp.status == 200
+    body = json.loads(await resp.text())
+    assert follow_path(body, 'created') == 1
+    assert [
+        (conflict['line'], conflict['reason']) for conflict in follow_path(body, 'conflicts')
+    ] == [(2, 'exists'), (3, 'duplicate')]
+    csv = 'account,roles\npytest_import_2@amsterdam.nl,CDE,pytest_no_such_role\n'
+    resp = await client.post(url, data=csv, headers=dict(
+        authz_headers, **{'Content-Type': 'text/csv'}
+    ))
+    assert resp.status == 400
+    resp = await client.post(url, data=csv.replace(',pytest_no_such_role', ''), headers=dict(
+        authz_headers, **{'Content-Type': 'text/csv'}
+    ))
+    assert resp.status == 200
+    assert follow_path(json.loads(await resp.text()), 'created') == 1
+    for url in account_urls:
+        resp = await client.get(url, headers=authz_headers)
+        assert resp.status == 200
+        resp = await client.delete(url, headers=dict(
+            authz_headers, **{'If-Match': follow_path(resp.headers, 'ETag')}
+        ))
+        assert resp.status == 204
+
+
+async def test_role_changes(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    account_id = 'pytest_role_changes@amsterdam.nl'
+    url = base_path + '/accounts/' + account_id
+    resp = await client.get(url, headers=authz_headers)
+    if resp.status == 200:
+        resp = await client.delete(url, headers=dict(
+            authz_headers, **{'If-Match': follow_path(resp.headers, 'ETag')}
+        ))
+        assert resp.status == 204
+    resp = await client.put(url, json={'_links': {'role': [{'href': '/roles/CDE'}]}},
+                            headers=dict(authz_headers, **{'If-None-Match': '*'}))
+    assert resp.status == 201
+    etag = follow_path(resp.headers, 'ETag')
+    change = {'action': 'add', 'role': 'CDE_PLUS', 'accounts': [account_id], 'having_role': 'CDE'}
+    for expected in ([account_id], []):
+        resp = await client.post(base_path + '/role_changes', json=change, headers=authz_headers)
+        assert resp.status == 200
+        assert follow_path(json.loads(await resp.text()), 'changed') == expected
+    resp = await client.get(url, headers=authz_headers)
+    assert follow_path(resp.headers, 'ETag') != etag
+    body = json.loads(await resp.text())
+    assert {follow_path(role, 'name') for role in follow_path(body, '_links', 'role')} == {'CDE', 'CDE_PLUS'}
+    resp = await client.post(base_path + '/role_changes', json=dict(change, action='remove'),
+                             headers=authz_headers)
+    assert follow_path(json.loads(await resp.text()), 'changed') == [account_id]
+    resp = await client.post(base_path + '/role_changes', json=dict(change, role='pytest_no_such_role'),
+                             headers=authz_headers)
+    assert resp.status == 400
+    resp = await client.get(base_path + '/log?action=U&account=' + account_id,
+                            headers=dict(authz_headers, Accept='application/x-ndjson'))
+    text = await resp.text()
+    assert access_token not in text
+    records = [json.loads(line) for line in text.splitlines()]
+    assert len(records) >= 2
+    assert records[-1]['request_info']['method'] == 'POST'
+    assert records[-1]['request_info']['token'] == hashlib.sha256(access_token.encode()).hexdigest()
+    resp = await client.get(url, headers=authz_headers)
+    resp = await client.delete(url, headers=dict(
+        authz_headers, **{'If-Match': follow_path(resp.headers, 'ETag')}
+    ))
+    assert resp.status == 204
+
+
+async def test_log(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    url = base_path + '/log?account=p.van.beek@amsterdam.nl&action=C&limit=1'
+    resp = await client.get(url, headers=authz_headers)
+    assert resp.status == 200
+    body = json.loads(await resp.text())
+    items = follow_path(body, '_links', 'item')
+    assert len(items) == 1
+    resp = await client.get(follow_path(items[0], 'href'), headers=authz_headers)
+    assert resp.status == 200
+    entry = json.loads(await resp.text())
+    assert follow_path(entry, 'action') == 'C'
+    assert follow_path(entry, '_links', 'account', 'name') == 'p.van.beek@amsterdam.nl'
+    resp = await client.get(url, headers=dict(authz_headers, Accept='application/x-ndjson'))
+    assert resp.status == 200
+    records = [json.loads(line) for line in (await resp.text()).splitlines()]
+    assert [record['id'] for record in records] == [follow_path(entry, 'id')]
+    resp = await client.get(base_path + '/', headers=dict(authz_headers, Accept='application/x-ndjson'))
+    assert resp.status == 406
+    resp = await client.get(base_path + '/log?since=yesterday', headers=authz_headers)
+    assert resp.status == 400
+    # Ids beyond the range of a 32 bit integer:
+    resp = await client.get(base_path + '/log/%d' % 2 ** 40, headers=authz_headers)
+    assert resp.status == 404
+    resp = await client.get(base_path + '/log?limit=1&after=%d' % 2 ** 40, headers=authz_headers)
+    assert resp.status == 200
+    assert len(json.loads(await resp.text())['_links'].get('item', [])) == 0
 
 
 async def test_maximum_query_depth(client, base_path, access_token):
@@ -155,3 +393,319 @@ async def test_maximum_query_depth(client, base_path, access_token):
     assert resp.status == 400
     text = await resp.text()
     assert re.search('query depth', text) is not None
+
+
+async def test_token_cache(client, base_path, access_token):
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    token_cache = client.server.app['token_cache']
+    resp = await client.get(base_path + '/accounts', headers=authz_headers)
+    assert resp.status == 200
+    hits = token_cache.statistics()['hits']
+    resp = await client.get(base_path + '/accounts', headers=authz_headers)
+    assert resp.status == 200
+    assert token_cache.statistics()['hits'] > hits
+
+
+async def test_response_cache(client, base_path, access_token):
+    response_cache = client.server.app[RESPONSE_CACHE]
+    url = base_path + '/datasets?embed=item'
+    resp = await client.get(url)
+    assert resp.status == 200
+    body = await resp.text()
+    hits = response_cache.statistics()['hits']
+    resp = await client.get(url)
+    assert resp.status == 200
+    assert await resp.text() == body
+    assert response_cache.statistics()['hits'] == hits + 1
+    resp = await client.get(url, headers={'If-None-Match': follow_path(resp.headers, 'ETag')})
+    assert resp.status == 304
+    # Roles link to their accounts, so they're never served from the cache:
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    resp = await client.get(base_path + '/roles?embed=item', headers=authz_headers)
+    assert resp.status == 200
+    resp = await client.get(base_path + '/roles?embed=item', headers=authz_headers)
+    assert resp.status == 200
+    assert response_cache.statistics()['hits'] == hits + 1
+
+
+async def test_prerender(client, base_path):
+    response_cache = client.server.app[RESPONSE_CACHE]
+    await prerender.initialize_app(client.server.app)
+    hits = response_cache.statistics()['hits']
+    for url in ('/datasets', '/datasets?embed=item', '/datasets/BRK/RS', '/profiles?embed=item'):
+        resp = await client.get(base_path + url)
+        assert resp.status == 200
+    assert response_cache.statistics()['hits'] == hits + 4
+
+
+def test_response_cache_eviction():
+    response_cache = ResponseCache(maxbytes=100)
+    for i in range(3):
+        response_cache.put(('/foo/%d' % i, 'application/json'), '"etag"', b' ' * 40, 'identity')
+    assert response_cache.statistics()['bytes'] <= 100
+    assert response_cache.get(('/foo/0', 'application/json', 'identity', '"etag"')) is None
+    entry = response_cache.get(('/foo/2', 'application/json', 'gzip', '"etag"'))
+    assert entry.content_encoding == 'gzip'
+    assert len(entry.body) < 40
+
+
+def test_create_partitions(db_connection):
+    today = datetime.date.today()
+    created = log_partitions.create_partitions(db_connection, 3, today)
+    assert len(created) > 0
+    # Months covered by the legacy partition, or by an earlier run, are skipped.
+    assert log_partitions.create_partitions(db_connection, 3, today) == created
+
+
+def test_partition_helpers():
+    assert log_partitions._add_months(datetime.date(2017, 11, 1), 3) == datetime.date(2018, 2, 1)
+    assert log_partitions._add_months(datetime.date(2017, 1, 1), -1) == datetime.date(2016, 12, 1)
+    assert log_partitions._add_months(datetime.date(2017, 1, 1), -24) == datetime.date(2015, 1, 1)
+    assert log_partitions._partition_bounds(
+        "FOR VALUES FROM (MINVALUE) TO ('2017-10-01 00:00:00')"
+    ) == (None, datetime.date(2017, 10, 1))
+    assert log_partitions._partition_bounds(
+        "FOR VALUES FROM ('2017-10-01 00:00:00') TO ('2017-11-01 00:00:00')"
+    ) == (datetime.date(2017, 10, 1), datetime.date(2017, 11, 1))
+    assert log_partitions._partition_bounds('DEFAULT') is None
+
+
+def test_expired_partitions(db_connection):
+    today = datetime.date.today()
+    assert 'AccountRolesLog_legacy' not in log_partitions.expired_partitions(db_connection, 24, today)
+    # With a negative retention, even next month's entries have expired.
+    expired = log_partitions.expired_partitions(db_connection, -2, today)
+    assert 'AccountRolesLog_legacy' in expired
+    assert 'AccountRolesLog_default' not in expired
+
+
+def _mirror_ids(rows):
+    return [row['account_id'] for row in rows]
+
+
+def test_mirror_apply():
+    account_mirror = AccountRolesMirror({})
+    account_mirror.apply('a', {'account_id': 'a', 'role_ids': ['R1'], 'log_id': 1})
+    account_mirror.apply('b', {'account_id': 'b', 'role_ids': ['R1', 'R2'], 'log_id': 2})
+    assert _mirror_ids(account_mirror.accounts(['R1'])) == ['a', 'b']
+    # Update:
+    account_mirror.apply('a', {'account_id': 'a', 'role_ids': ['R2'], 'log_id': 3})
+    assert _mirror_ids(account_mirror.accounts(['R1'])) == ['b']
+    assert _mirror_ids(account_mirror.accounts(['R2'])) == ['a', 'b']
+    # Stale rows are ignored:
+    account_mirror.apply('a', {'account_id': 'a', 'role_ids': ['R1'], 'log_id': 1})
+    assert account_mirror.account('a')['role_ids'] == ('R2',)
+    # Delete, after which a new account reuses the slot:
+    account_mirror.apply('a', None)
+    assert account_mirror.account('a') is None
+    assert _mirror_ids(account_mirror.accounts(['R2'])) == ['b']
+    account_mirror.apply('c', {'account_id': 'c', 'role_ids': ['R3'], 'log_id': 4})
+    assert account_mirror.statistics()['slots'] == 2
+    assert _mirror_ids(account_mirror.accounts(['R2'])) == ['b']
+    assert _mirror_ids(account_mirror.accounts(['R3'])) == ['c']
+    assert _mirror_ids(account_mirror.accounts()) == ['b', 'c']
+
+
+def test_mirror_accounts():
+    account_mirror = AccountRolesMirror({})
+    for log_id, (account_id, role_ids) in enumerate((
+            ('d', ['R1', 'R2']), ('b', ['R1']), ('e', ['R2']),
+            ('a', ['R1', 'R2', 'R3']), ('c', ['R1', 'R2']))):
+        account_mirror.apply(account_id, {
+            'account_id': account_id, 'role_ids': role_ids, 'log_id': log_id
+        })
+    # All roles must match:
+    assert _mirror_ids(account_mirror.accounts(['R1', 'R2'])) == ['a', 'c', 'd']
+    assert _mirror_ids(account_mirror.accounts(['R1', 'R2', 'R3'])) == ['a']
+    assert _mirror_ids(account_mirror.accounts(['R1', 'R4'])) == []
+    assert _mirror_ids(account_mirror.accounts(account_ids=['e', 'a', 'x'])) == ['a', 'e']
+    # Pagination:
+    assert _mirror_ids(account_mirror.accounts(after='b', limit=2)) == ['c', 'd']
+    assert _mirror_ids(account_mirror.accounts(before='d', limit=2)) == ['b', 'c']
+    assert _mirror_ids(account_mirror.accounts(['R1'], after='a', before='d')) == ['b', 'c']
+    assert _mirror_ids(account_mirror.accounts(['R2'], before='c', limit=5)) == ['a']
+    assert _mirror_ids(account_mirror.accounts(['R1'], before='e', limit=2)) == ['c', 'd']
+    assert _mirror_ids(account_mirror.accounts(['R2'], after='a', limit=2)) == ['c', 'd']
+    assert _mirror_ids(account_mirror.accounts(account_ids=['e', 'c', 'a'], after='a', limit=1)) == ['c']
+
+
+async def test_mirror_order(client, base_path, access_token):
+    # Ids in a different order under a linguistic collation like en_US than
+    # by code point:
+    account_ids = ['mirror.a@example.com', 'Mirror.B@example.com',
+                   'mirror-c@example.com', 'mirror_d@example.com']
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    account_mirror = AccountRolesMirror({})
+    for account_id in account_ids:
+        url = base_path + '/accounts/' + account_id
+        resp = await client.get(url, headers=authz_headers)
+        if resp.status == 200:
+            etag = follow_path(resp.headers, 'ETag')
+        else:
+            assert resp.status == 404
+            resp = await client.put(
+                url, json={'_links': {'role': [{'href': '/roles/CDE'}]}},
+                headers=dict(authz_headers, **{'If-None-Match': '*'})
+            )
+            assert resp.status == 201
+            etag = follow_path(resp.headers, 'ETag')
+        account_mirror.apply(account_id, {
+            'account_id': account_id, 'role_ids': ['CDE'], 'log_id': int_from_etag(etag)
+        })
+    resp = await client.get(base_path + '/accounts', headers=authz_headers)
+    assert resp.status == 200
+    items = follow_path(json.loads(await resp.text()), '_links', 'item')
+    database_order = [item['name'] for item in items if item['name'] in account_ids]
+    assert database_order == _mirror_ids(account_mirror.accounts())
+    assert database_order == sorted(account_ids)
+
+
+async def test_mirror_version(client, base_path, access_token, aaconfig):
+    app = client.server.app
+    authz_headers = {'Authorization': 'Bearer ' + access_token}
+    url = base_path + '/accounts/mirror.version@example.com'
+    account_mirror = AccountRolesMirror(backends.connection_kwargs(aaconfig['postgres']))
+    await account_mirror.start()
+    app['mirror'] = account_mirror
+    try:
+        resp = await client.get(base_path + '/accounts', headers=authz_headers)
+        assert resp.status == 200
+        assert follow_path(resp.headers, 'ETag') == etag_from_int(account_mirror.version)
+        resp = await client.get(url, headers=authz_headers)
+        if resp.status == 200:
+            resp = await client.delete(url, headers=dict(authz_headers, **{
+                'If-Match': follow_path(resp.headers, 'ETag')
+            }))
+            assert resp.status == 204
+        resp = await client.put(
+            url, json={'_links': {'role': [{'href': '/roles/CDE'}]}},
+            headers=dict(authz_headers, **{'If-None-Match': '*'})
+        )
+        assert resp.status == 201
+        etag = follow_path(resp.headers, 'ETag')
+        # The version only advances once the notification has been applied:
+        for _ in range(50):
+            if account_mirror.version >= int_from_etag(etag):
+                break
+            await asyncio.sleep(0.1)
+        assert account_mirror.version == int_from_etag(etag)
+        resp = await client.get(base_path + '/accounts', headers=authz_headers)
+        assert follow_path(resp.headers, 'ETag') == etag_from_int(account_mirror.version)
+        items = follow_path(json.loads(await resp.text()), '_links', 'item')
+        assert 'mirror.version@example.com' in [item['name'] for item in items]
+        resp = await client.delete(url, headers=dict(authz_headers, **{'If-Match': etag}))
+        assert resp.status == 204
+    finally:
+        del app['mirror']
+        await account_mirror.stop()
+
+
+def test_scope_index(aaconfig):
+    scope_index = ScopeIndex(aaconfig)
+    granted = scope_index.mask(['AUR/W'])
+    assert scope_index.mask(['AUR/R'], implied=False) & ~granted == 0
+    assert scope_index.mask(['AUR/W'], implied=False) & ~granted == 0
+    assert scope_index.mask(['BRK/RS'], implied=False) & ~granted != 0
+    assert scope_index.mask(['AUR/X'], implied=False) & ~granted != 0
+    assert scope_index.closure['BRK/RSN'] == {'BRK/RSN', 'BRK/RS'}
+
+
+def test_int_from_etag():
+    for value in (0, -1, 127, 128, 40000, 2 ** 31, 2 ** 40):
+        assert int_from_etag(etag_from_int(value)) == value
+        assert int_from_etag(etag_from_int(value, weak=True)) == value
+    assert int_from_etag('"not an int"') is None
+
+
+@pytest.mark.parametrize('backend', sorted(backends.BACKENDS))
+async def test_bigint_params(loop, aaconfig, backend):
+    if backend == 'asyncpg':
+        pytest.importorskip('asyncpg')
+    dbconf = dict(aaconfig['postgres'], backend=backend)
+    async with backends.create(dbconf) as pool:
+        async with pool.acquire() as conn:
+            # Larger than the integer columns they're compared with:
+            rows = await conn.fetch(
+                database._accounts_statement(False, True, False, False, False, False, int),
+                account_ids=['p.van.beek@amsterdam.nl'], as_of=10 ** 17
+            )
+            assert len(rows) <= 1
+            assert await conn.fetchrow(database._LOG_ENTRY, entry_id=2 ** 40) is None
+            statement = database._log_entries_statement(
+                (False, False, False, False, False, False, True), True
+            )
+            assert await conn.fetch(statement, after=2 ** 40, limit=1) == []
+
+
+async def test_read_pool_choice(loop):
+    class Replica:
+        pool = 'replica'
+        checks = 0
+
+        async def has_applied(self, version):
+            self.checks += 1
+            await asyncio.sleep(0.01)
+            # Catches up while the first check is still running:
+            return self.checks > 1
+
+    replica = Replica()
+    request = make_mocked_request('GET', '/accounts', app={'pool': 'primary', 'replica': replica})
+    # Like embedded views rendered concurrently:
+    pools = await asyncio.gather(*(database._read_pool(request) for _ in range(3)))
+    assert pools == ['primary'] * 3
+    assert replica.checks == 1
+
+
+def test_prepared_statement():
+    statement = PreparedStatement(
+        'test', 'SELECT :b::text WHERE :a = ANY(:b)', a='varchar', b='varchar[]'
+    )
+    assert statement.sql == 'SELECT $2::varchar[]::text WHERE $1::varchar = ANY($2::varchar[])'
+    assert statement.param_names == ('a', 'b')
+    assert statement.args({'b': ['x'], 'a': 'x'}) == ('x', ['x'])
+
+
+async def test_account_scopes(client, base_path, api_key):
+    authz_headers = {'Authorization': 'apikey ' + api_key}
+    url = base_path + '/accounts/p.van.beek@amsterdam.nl'
+    resp = await client.get(url, headers=authz_headers)
+    assert resp.status == 200
+    account_etag = follow_path(resp.headers, 'ETag')
+    resp = await client.get(url + '/scopes', headers=authz_headers)
+    assert resp.status == 200
+    assert follow_path(resp.headers, 'ETag') == account_etag
+    body = json.loads(await resp.text())
+    scopes = follow_path(body, 'scopes')
+    assert 'AUR/R' in scopes
+    assert 'AUR/W' in scopes
+    resp = await client.get(url + '/scopes', headers={
+        'Authorization': 'apikey ' + api_key,
+        'If-None-Match': account_etag
+    })
+    assert resp.status == 304
+
+
+async def test_authorization_decisions(client, base_path, api_key):
+    url = base_path + '/authorization_decisions'
+    pairs = [
+        ['p.van.beek@amsterdam.nl', 'AUR/R'],
+        ['p.van.beek@amsterdam.nl', 'BRK/RSN'],
+        ['Medewerker', 'BRK/RS'],
+        ['pytest_no_such_account@amsterdam.nl', 'AUR/R']
+    ]
+    resp = await client.post(url, json=pairs)
+    assert resp.status == 401
+    resp = await client.post(url, json=pairs, headers={'Authorization': 'apikey ' + api_key})
+    assert resp.status == 200
+    body = json.loads(await resp.text())
+    assert follow_path(body, 'decisions') == [True, False, True, False]
+
+
+async def test_statistics(client, base_path, api_key):
+    resp = await client.get(base_path + '/statistics',
+                            headers={'Authorization': 'apikey ' + api_key})
+    assert resp.status == 200
+    body = json.loads(await resp.text())
+    pool = follow_path(body, 'database_pool')
+    assert pool['free'] + pool['in_use'] == pool['size']
+    assert sum(pool['acquire_wait_histogram'].values()) > 0